@@ -0,0 +1,165 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+SYSFS_BLUETOOTH = "/sys/class/bluetooth"
+
+# Connections one adapter is trusted with. The on-board radio of the Pi Zero
+# 2 W and the common USB dongles get unreliable well before the controller
+# limit. FALLYX_ADAPTER_CAPACITY overrides it, e.g. for simulated sensors.
+# It is counted per process: the three connect.py processes log.py starts
+# each have their own scheduler, so only hub.py enforces it across sensors.
+DEFAULT_CAPACITY = int(os.environ.get("FALLYX_ADAPTER_CAPACITY", 3))
+# A connected sensor is moved to another adapter when its link loses more
+# than this fraction of samples in REBALANCE_WINDOWS loss windows in a row
+# (connected sensors stop advertising, so the link itself is the only live
+# measure of how well the adapter hears it) ...
+REBALANCE_LOSS = 0.05
+REBALANCE_WINDOWS = 2
+# ... to an adapter that heard it at least REBALANCE_MARGIN dB louder than
+# the current one within the last HEARD_MAX_AGE seconds. A sensor is not
+# moved again within REBALANCE_COOLDOWN seconds of being placed or moved.
+REBALANCE_MARGIN = 6
+HEARD_MAX_AGE = 60.0
+REBALANCE_COOLDOWN = 120.0
+
+
+def list_adapters() -> List[str]:
+    """
+    :return: Names of the HCI adapters on this machine, e.g. ['hci0', 'hci1'].
+             Falls back to ['hci0'] when sysfs is not available.
+    """
+    try:
+        names = [n for n in os.listdir(SYSFS_BLUETOOTH)
+                 if n.startswith("hci") and n[3:].isdigit()]
+    except FileNotFoundError:
+        names = []
+    return sorted(names, key=lambda n: int(n[3:])) or ["hci0"]
+
+
+class AdapterScheduler:
+    """
+    Decide which adapter each sensor connection goes on.
+
+    A sensor is placed on the adapter that hears it loudest among those with
+    a free connection slot. Placements are kept so later decisions account
+    for slot usage, together with what every adapter heard at the time, and
+    rebalance() suggests moves for sensors whose link is losing samples.
+    Capacity is only enforced among the sensors of one scheduler, i.e. of
+    one process.
+
+    :param adapters: Adapter names to schedule over.
+    :param capacity: Maximum connections per adapter.
+    """
+
+    def __init__(self, adapters: List[str] = None, capacity: int = DEFAULT_CAPACITY) -> None:
+        self._adapters = adapters if adapters is not None else list_adapters()
+        self._capacity = capacity
+        self._placed: Dict[str, str] = {}
+        # Advertisement RSSI per adapter when each sensor was last placed,
+        # and when that was
+        self._heard: Dict[str, Tuple[Dict[str, int], float]] = {}
+        # Monotonic time each sensor was last placed or moved
+        self._moved: Dict[str, float] = {}
+        # Loss windows in a row each sensor lost too much in
+        self._bad: Dict[str, int] = {}
+
+    @property
+    def adapters(self) -> List[str]:
+        return list(self._adapters)
+
+    def load(self) -> Dict[str, int]:
+        usage = {adapter: 0 for adapter in self._adapters}
+        for adapter in self._placed.values():
+            usage[adapter] += 1
+        return usage
+
+    def adapter_for(self, address: str) -> Optional[str]:
+        return self._placed.get(address)
+
+    def place(self, address: str, rssi_by_adapter: Dict[str, int],
+              min_rssi: int) -> Optional[str]:
+        """
+        Pick an adapter for a sensor and record the placement.
+
+        :param address: Sensor address.
+        :param rssi_by_adapter: Latest RSSI of the sensor per adapter that heard it.
+        :param min_rssi: Adapters hearing the sensor at or below this are not used.
+        :return: Adapter name, or None if no adapter with a free slot hears it
+                 well. A previous placement is then kept.
+        """
+        previous = self._placed.pop(address, None)
+        usage = self.load()
+        candidates = [(rssi, adapter) for adapter, rssi in rssi_by_adapter.items()
+                      if adapter in usage and usage[adapter] < self._capacity
+                      and rssi > min_rssi]
+        if not candidates:
+            if previous is not None:
+                self._placed[address] = previous
+            return None
+        # Loudest first; ties go to the less loaded adapter
+        rssi, adapter = max(candidates, key=lambda c: (c[0], -usage[c[1]]))
+        self._placed[address] = adapter
+        now = time.monotonic()
+        self._heard[address] = (dict(rssi_by_adapter), now)
+        if adapter != previous:
+            self._moved[address] = now
+            self._bad.pop(address, None)
+        return adapter
+
+    def release(self, address: str) -> None:
+        for table in (self._placed, self._heard, self._moved, self._bad):
+            table.pop(address, None)
+
+    def _recent_rssi(self, address: str, rssi_lookup, now: float) -> Dict[str, int]:
+        # What each adapter heard of the sensor lately: the live advertisement
+        # table, else what was heard when it was placed, if that is recent
+        heard, when = self._heard.get(address, ({}, 0.0))
+        recent = dict(heard) if now - when <= HEARD_MAX_AGE else {}
+        recent.update(rssi_lookup(address))
+        return recent
+
+    def rebalance(self, loss_by_address: Dict[str, Optional[float]], rssi_lookup,
+                  min_rssi: int) -> List[Tuple[str, str, str]]:
+        """
+        Move sensors whose link keeps losing samples to an adapter that
+        hears them clearly better.
+
+        :param loss_by_address: Fraction of samples each connected sensor
+                                lost in its latest loss window (e.g.
+                                LossTracker.window()), None if there is not
+                                enough data yet.
+        :param rssi_lookup: Callable returning the recent per-adapter RSSI of
+                            an address (e.g. ScannerService.rssi_by_adapter).
+        :param min_rssi: Adapters hearing the sensor at or below this are not used.
+        :return: List of (address, old adapter, new adapter) moves, already
+                 recorded as placements.
+        """
+        now = time.monotonic()
+        moves = []
+        for address, loss in loss_by_address.items():
+            current = self._placed.get(address)
+            if current is None or loss is None:
+                continue
+            if loss <= REBALANCE_LOSS:
+                self._bad.pop(address, None)
+                continue
+            self._bad[address] = self._bad.get(address, 0) + 1
+            if (self._bad[address] < REBALANCE_WINDOWS
+                    or now - self._moved.get(address, 0.0) < REBALANCE_COOLDOWN):
+                continue
+            usage = self.load()
+            heard = self._recent_rssi(address, rssi_lookup, now)
+            # The current adapter is lossy; if it was not heard lately it
+            # counts as barely usable
+            floor = max(heard.get(current, min_rssi), min_rssi) + REBALANCE_MARGIN
+            better = [(rssi, adapter) for adapter, rssi in heard.items()
+                      if adapter != current and usage.get(adapter, self._capacity) < self._capacity
+                      and rssi > min_rssi and rssi >= floor]
+            if better:
+                _, adapter = max(better)
+                self._placed[address] = adapter
+                self._moved[address] = now
+                self._bad.pop(address, None)
+                moves.append((address, current, adapter))
+        return moves
@@ -0,0 +1,86 @@
+from typing import Dict, NamedTuple, Optional, Sequence
+
+# Order in which the firmware notifies the per-axis characteristics
+# (def1..def7). The last field closes a frame.
+FIELD_ORDER = ("ax", "ay", "az", "gx", "gy", "gz", "time")
+
+
+class Sample(NamedTuple):
+    time: int
+    ax: float
+    ay: float
+    az: float
+    gx: float
+    gy: float
+    gz: float
+
+
+class SampleAssembler:
+    """
+    Group per-axis notifications into complete samples.
+
+    The firmware sends one notification per field, always in the same order.
+    A field whose position is not after the previous one means a new frame
+    has started; whatever was pending is counted as partial and dropped.
+    Complete frames are keyed by the firmware microsecond counter, so a frame
+    repeating the previous counter value is counted as a duplicate and not
+    emitted again.
+
+    :param order: Field names in the order the firmware notifies them.
+    """
+
+    def __init__(self, order: Sequence[str] = FIELD_ORDER) -> None:
+        if sorted(order) != sorted(Sample._fields):
+            raise ValueError(f"Order must contain each of {Sample._fields} once")
+        self._index = {field: i for i, field in enumerate(order)}
+        self._width = len(order)
+        self._pending = {}
+        self._last_index = -1
+        self._last_time = None
+        self.complete = 0
+        self.partial = 0
+        self.duplicates = 0
+
+    def push(self, field: str, value) -> Optional[Sample]:
+        """
+        Add one field value.
+
+        :param field: Field name, one of Sample._fields.
+        :param value: Decoded value of the field.
+        :return: The finished sample, or None while the frame is still open.
+        """
+        index = self._index[field]
+        if index <= self._last_index:
+            self._drop_pending()
+        self._pending[field] = value
+        self._last_index = index
+        if len(self._pending) < self._width:
+            return None
+
+        sample = Sample(**self._pending)
+        self._pending = {}
+        self._last_index = -1
+        if sample.time == self._last_time:
+            self.duplicates += 1
+            return None
+        self._last_time = sample.time
+        self.complete += 1
+        return sample
+
+    def flush(self) -> None:
+        """Drop any frame still pending, e.g. on disconnect."""
+        if self._pending:
+            self._drop_pending()
+
+    def _drop_pending(self) -> None:
+        if self._pending:
+            self.partial += 1
+        self._pending = {}
+        self._last_index = -1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "complete": self.complete,
+            "partial": self.partial,
+            "duplicates": self.duplicates,
+        }
@@ -0,0 +1,197 @@
+"""
+Gateway capacity benchmark over simulated sensors.
+
+Runs the full pipeline - hub.py ingesting from the simulated radio
+(FALLYX_TRANSPORT=sim), segments in send_out, send_to_api.py uploading
+them to a local mock_api.MockAPI - for an increasing number of sensors at
+each sample rate. Every step reports CPU (total and per sensor) and peak
+RSS of the gateway processes, end-to-end latency percentiles (sample time
+to arrival at the API) and the share of generated samples that never
+arrived. A step is sustainable when every sensor connected, the loss rate
+and hub CPU stay under their limits and the upload backlog drained. The
+sweep at a rate stops at the first step that is not.
+
+    python bench_capacity.py --rates 50 100 200 --sensors 1 2 4 8 12 16
+
+Adapter capacity is lifted for the run, so the result is the host's limit;
+the radio allows DEFAULT_CAPACITY connections per adapter (adapters.py).
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import numpy as np
+
+from compression import strip_extension
+from mock_api import MockAPI
+from segments import SEGMENT_EXT
+from usage import process_usage
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def start(script: str, args, workdir: str, env: Dict[str, str]) -> subprocess.Popen:
+    log = open(os.path.join(workdir, f"{os.path.splitext(script)[0]}.log"), "w")
+    return subprocess.Popen([sys.executable, "-u", os.path.join(SRC_DIR, script)] + list(args),
+                            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def stop(process: subprocess.Popen, timeout: float = 15) -> None:
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def backlog(directory: str) -> int:
+    return sum(1 for name in os.listdir(directory)
+               if strip_extension(name).endswith((".csv", SEGMENT_EXT)))
+
+
+def run_step(api: MockAPI, sensors: int, rate: float, args) -> Dict[str, float]:
+    """
+    Run the pipeline once and measure it.
+
+    :param api: Mock API the uploader posts to; reset here.
+    :param sensors: Number of simulated sensors (and hub slots).
+    :param rate: Sample rate per sensor in Hz.
+    :return: Measurements of the step.
+    """
+    workdir = tempfile.mkdtemp(prefix="fallyx_bench_")
+    send_out = os.path.join(workdir, "send_out")
+    os.makedirs(send_out)
+    stats_path = os.path.join(workdir, "sim_stats.json")
+    env = dict(os.environ,
+               FALLYX_TRANSPORT="sim",
+               FALLYX_SIM_SENSORS=str(sensors),
+               FALLYX_SIM_RATE=str(rate),
+               FALLYX_SIM_STATS=stats_path,
+               FALLYX_ADAPTER_CAPACITY=str(sensors),
+               FALLYX_API_URL=api.url,
+               # Measure the gateway, not the pause between uploads
+               FALLYX_UPLOAD_PAUSE="0",
+               FALLYX_SEND_OUT=send_out)
+    api.reset()
+    hub = start("hub.py", [str(sensors)], workdir, env)
+    uploader = start("send_to_api.py", [], workdir, env)
+    pids = (hub.pid, uploader.pid)
+
+    time.sleep(args.warmup)
+    cpu_start = [process_usage(pid).get("cpu_s", 0.0) for pid in pids]
+    begin = time.monotonic()
+    peak_rss = 0.0
+    while time.monotonic() - begin < args.duration and hub.poll() is None:
+        time.sleep(1)
+        peak_rss = max(peak_rss, sum(process_usage(pid).get("rss_mb", 0.0) for pid in pids))
+    elapsed = time.monotonic() - begin
+    cpu_end = [process_usage(pid).get("cpu_s", 0.0) for pid in pids]
+    hub_cpu = 100.0 * (cpu_end[0] - cpu_start[0]) / elapsed
+    upload_cpu = 100.0 * (cpu_end[1] - cpu_start[1]) / elapsed
+    waiting = backlog(send_out)
+
+    # Stopping the hub seals the open segments; then let the uploader catch up
+    stop(hub)
+    deadline = time.monotonic() + args.drain
+    while backlog(send_out) and time.monotonic() < deadline and uploader.poll() is None:
+        time.sleep(1)
+    left = backlog(send_out)
+    stop(uploader)
+
+    try:
+        with open(stats_path) as file:
+            sim = json.load(file)
+    except (FileNotFoundError, ValueError):
+        sim = {}
+    generated = sum(s["samples"] for s in sim.values())
+    connected = sum(1 for s in sim.values() if s["samples"])
+    latencies = api.latencies()
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies.size else (0, 0, 0)
+    loss = 1.0 - api.samples / generated if generated else 1.0
+    result = {
+        "sensors": sensors,
+        "rate_hz": rate,
+        "connected": connected,
+        "cpu_pct": round(hub_cpu + upload_cpu, 1),
+        "hub_cpu_pct": round(hub_cpu, 1),
+        "cpu_pct_per_sensor": round((hub_cpu + upload_cpu) / sensors, 2),
+        "rss_mb": round(peak_rss, 1),
+        "latency_p50_s": round(float(p50), 2),
+        "latency_p95_s": round(float(p95), 2),
+        "latency_p99_s": round(float(p99), 2),
+        "generated": generated,
+        "delivered": api.samples,
+        "loss_rate": round(max(loss, 0.0), 5),
+        "backlog_at_stop": waiting,
+        "backlog_left": left,
+    }
+    result["sustainable"] = (connected == sensors and left == 0
+                             and result["loss_rate"] <= args.max_loss
+                             and hub_cpu <= args.max_cpu)
+    if args.keep:
+        result["workdir"] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 100, 200],
+                        help="sample rates per sensor (Hz)")
+    parser.add_argument("--sensors", type=int, nargs="+", default=[1, 2, 4, 8, 12, 16, 24, 32],
+                        help="sensor counts to try, in increasing order")
+    parser.add_argument("--duration", type=float, default=120, help="measured seconds per step")
+    parser.add_argument("--warmup", type=float, default=15, help="seconds before measuring")
+    parser.add_argument("--drain", type=float, default=60,
+                        help="seconds the uploader gets to empty send_out after the hub stops")
+    parser.add_argument("--max-loss", type=float, default=0.005, help="highest sustainable loss rate")
+    parser.add_argument("--max-cpu", type=float, default=80, help="highest sustainable hub CPU (%%)")
+    parser.add_argument("--json", help="also write all results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the working directories")
+    args = parser.parse_args()
+
+    api = MockAPI()
+    api.start()
+    results = []
+    summary = {}
+    try:
+        for rate in args.rates:
+            print(f"\n{rate:g} Hz per sensor")
+            print(f"{'sensors':>8}{'cpu %':>8}{'cpu/sensor':>11}{'rss MB':>8}"
+                  f"{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'loss %':>9}  ok")
+            summary[rate] = 0
+            for sensors in args.sensors:
+                r = run_step(api, sensors, rate, args)
+                results.append(r)
+                print(f"{sensors:>8}{r['cpu_pct']:>8.1f}{r['cpu_pct_per_sensor']:>11.2f}"
+                      f"{r['rss_mb']:>8.1f}{r['latency_p50_s']:>8.1f}{r['latency_p95_s']:>8.1f}"
+                      f"{r['latency_p99_s']:>8.1f}{100 * r['loss_rate']:>9.2f}  "
+                      f"{'yes' if r['sustainable'] else 'no'}", flush=True)
+                if not r["sustainable"]:
+                    break
+                summary[rate] = sensors
+    finally:
+        api.stop()
+
+    print("\nMaximum sustainable sensors per gateway")
+    for rate, sensors in summary.items():
+        print(f"{rate:>6g} Hz: {sensors}")
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"max_sensors": {str(k): v for k, v in summary.items()},
+                       "steps": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
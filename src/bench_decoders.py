@@ -0,0 +1,113 @@
+"""
+Microbenchmark for per-axis notification decoding.
+
+Compares the old newdata_hndlr dispatch (str(sender.uuid), if/elif chain,
+struct.unpack on a copied slice) with the handle dispatch table from
+decoders.build_decoders, both with and without frame assembly. Prints
+notifications per second on one core and how many sensors that core could
+decode at the given sample rate (7 notifications per sample).
+
+    python bench_decoders.py --rate 100
+"""
+import argparse
+import random
+import struct
+import time
+
+from assembler import SampleAssembler
+from decoders import AXIS_FORMATS, build_decoders
+
+
+class FakeCharacteristic:
+    # Same attributes bleak passes to notification handlers
+    def __init__(self, uuid: str, handle: int) -> None:
+        self.uuid = uuid
+        self.handle = handle
+
+
+def legacy_decode(sender, data):
+    # The dispatch newdata_hndlr used before the decoder table
+    uuid = str(sender.uuid)
+    if uuid == '12345678-1234-5678-1234-56789abcdef1':
+        return 'ax', struct.unpack('<f', bytes(data[0:4]))[-1]
+    elif uuid == '12345678-1234-5678-1234-56789abcdef2':
+        return 'ay', struct.unpack('<f', bytes(data[0:4]))[-1]
+    elif uuid == '12345678-1234-5678-1234-56789abcdef3':
+        return 'az', struct.unpack('<f', bytes(data[0:4]))[-1]
+    elif uuid == '12345678-1234-5678-1234-56789abcdef4':
+        return 'gx', struct.unpack('<f', bytes(data[0:4]))[-1]
+    elif uuid == '12345678-1234-5678-1234-56789abcdef5':
+        return 'gy', struct.unpack('<f', bytes(data[0:4]))[-1]
+    elif uuid == '12345678-1234-5678-1234-56789abcdef6':
+        return 'gz', struct.unpack('<f', bytes(data[0:4]))[-1]
+    elif uuid == '12345678-1234-5678-1234-56789abcdef7':
+        return 'time', struct.unpack('<L', bytes(data[0:4]))[-1]
+    return None
+
+
+def make_notifications(samples: int):
+    characteristics = [FakeCharacteristic(uuid, 0x10 + 2 * i)
+                       for i, uuid in enumerate(AXIS_FORMATS)]
+    notifications = []
+    for n in range(samples):
+        for c in characteristics:
+            if c.uuid.endswith('7'):
+                data = bytearray(struct.pack('<L', n * 10000))
+            else:
+                data = bytearray(struct.pack('<f', random.uniform(-20, 20)))
+            notifications.append((c, data))
+    return characteristics, notifications
+
+
+def run_legacy(notifications, assemble: bool) -> None:
+    assembler = SampleAssembler()
+    for sender, data in notifications:
+        field, value = legacy_decode(sender, data)
+        if assemble:
+            assembler.push(field, value)
+
+
+def run_table(table, notifications, assemble: bool) -> None:
+    assembler = SampleAssembler()
+    for sender, data in notifications:
+        decoder = table.get(sender.handle)
+        if decoder is None:
+            continue
+        field, unpack_from = decoder
+        value = unpack_from(data)[0]
+        if assemble:
+            assembler.push(field, value)
+
+
+def measure(fn, *args, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--samples", type=int, default=50000, help="samples per run")
+    parser.add_argument("--rate", type=float, default=100.0, help="sensor sample rate (Hz)")
+    args = parser.parse_args()
+
+    characteristics, notifications = make_notifications(args.samples)
+    table = build_decoders({c.uuid: c.handle for c in characteristics})
+    per_sensor = 7 * args.rate
+
+    print(f"{len(notifications)} notifications, {args.rate:g} Hz per sensor")
+    print(f"{'path':<28}{'notif/s':>12}{'sensors/core':>14}")
+    for name, fn, fn_args in (
+            ("if/elif dispatch", run_legacy, (notifications, False)),
+            ("handle table", run_table, (table, notifications, False)),
+            ("if/elif + assembler", run_legacy, (notifications, True)),
+            ("handle table + assembler", run_table, (table, notifications, True))):
+        rate = len(notifications) / measure(fn, *fn_args)
+        print(f"{name:<28}{rate:>12,.0f}{rate / per_sensor:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
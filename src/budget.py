@@ -0,0 +1,212 @@
+"""
+Disk budget for the segments waiting in send_out.
+
+While the network is down segments pile up in send_out. The budget caps
+them at SPOOL_MAX_BYTES or SPOOL_MAX_PERCENT of the disk, whichever is
+smaller, and makes room in steps as the spool fills up:
+
+    COMPRESS_AT   compress segments that are still plain (lossless)
+    DECIMATE_AT   halve the sample rate of the oldest quiet segments, down
+                  to 1 / MAX_DECIMATION of the original
+    over budget   delete the oldest quiet segments, then the oldest flagged
+                  as a possible fall
+
+Within one check eviction runs before decimation, so a segment is never
+decimated and then deleted straight away, and the spool is measured again
+after every step. Segments the uploader is sending are never touched. If
+the disk has less than MIN_FREE_BYTES free after that, the budget reports
+it full and the storage thread drops new samples instead of failing to
+write them.
+"""
+import os
+import shutil
+import time
+from typing import Dict
+
+from compression import (COMPRESSION, DECODE_ERRORS, available, codec_for, compress_file,
+                         strip_extension, write_compressed)
+from segments import SEGMENT_EXT, Segment, compress_segment, encode_segment
+from uploads import UploadQueue
+
+SPOOL_MAX_BYTES = int(os.environ.get("FALLYX_SPOOL_MAX_BYTES", 4 * 1024 ** 3))
+SPOOL_MAX_PERCENT = float(os.environ.get("FALLYX_SPOOL_MAX_PERCENT", 50))
+# Free space below which new samples are dropped
+MIN_FREE_BYTES = 64 * 1024 * 1024
+# Fill levels (spool size / budget) at which each step starts; eviction
+# frees down to EVICT_TO so it does not run again on the next segment
+COMPRESS_AT = 0.7
+DECIMATE_AT = 0.85
+EVICT_TO = 0.95
+MAX_DECIMATION = 4
+# Seconds between checks, and segments reworked per check, so a check never
+# holds up the storage thread for long
+CHECK_INTERVAL = 10.0
+MAX_ACTIONS = 32
+
+
+class SpoolBudget:
+    """
+    :param queue: Upload queue of the send_out directory.
+    :param directory: The send_out directory.
+    :param max_bytes: Byte cap, 0 for none.
+    :param max_percent: Cap in percent of the disk, 0 for none.
+    :param codec: Codec used to compress plain segments.
+    """
+
+    def __init__(self, queue: UploadQueue, directory: str, max_bytes: int = SPOOL_MAX_BYTES,
+                 max_percent: float = SPOOL_MAX_PERCENT, codec: str = COMPRESSION) -> None:
+        self._queue = queue
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_percent = max_percent
+        self._codec = codec if codec != "none" and available(codec) else "gzip"
+        self._last_check = 0.0
+        self.full = False
+        self._state = {
+            "spool_bytes": 0,
+            "spool_limit_bytes": 0,
+            "spool_level": 0.0,
+            "spool_full": 0,
+            "disk_free_bytes": 0,
+            "spool_compressed_total": 0,
+            "spool_decimated_total": 0,
+            "spool_evicted_total": 0,
+            "spool_evicted_flagged_total": 0,
+            "spool_freed_bytes_total": 0,
+        }
+
+    def limit(self) -> int:
+        limits = []
+        if self._max_bytes:
+            limits.append(self._max_bytes)
+        if self._max_percent:
+            limits.append(int(shutil.disk_usage(self._directory).total * self._max_percent / 100))
+        return min(limits) if limits else 0
+
+    def counters(self) -> Dict[str, float]:
+        return dict(self._state)
+
+    def maybe_check(self, interval: float = CHECK_INTERVAL) -> None:
+        if time.monotonic() - self._last_check >= interval:
+            self.check()
+
+    def check(self) -> None:
+        """
+        Measure the spool and make room if it is getting full.
+        """
+        self._last_check = time.monotonic()
+        limit = self.limit()
+        used = self._queue.total_bytes()
+        actions = MAX_ACTIONS
+        if limit and used >= COMPRESS_AT * limit:
+            actions = self._compress(actions)
+            used = self._queue.total_bytes()
+        free = shutil.disk_usage(self._directory).free
+        # Bytes to free: what is over budget, or what the disk lacks
+        excess = max(used - EVICT_TO * limit if limit and used > limit else 0,
+                     MIN_FREE_BYTES - free)
+        if excess > 0:
+            self._evict(excess)
+            used = self._queue.total_bytes()
+            free = shutil.disk_usage(self._directory).free
+        if limit and used >= DECIMATE_AT * limit:
+            self._decimate(used, limit, actions)
+            used = self._queue.total_bytes()
+            free = shutil.disk_usage(self._directory).free
+        self.full = free < MIN_FREE_BYTES
+        self._state.update(spool_bytes=used, spool_limit_bytes=limit,
+                           spool_level=round(used / limit, 3) if limit else 0.0,
+                           spool_full=int(self.full), disk_free_bytes=free)
+
+    def _compress(self, actions: int) -> int:
+        for flagged in (False, True):
+            for entry in self._queue.oldest(MAX_ACTIONS, flagged):
+                if actions <= 0:
+                    return actions
+                if codec_for(entry["path"]) or not self._queue.take(entry["id"]):
+                    continue
+                actions -= 1
+                path = entry["path"]
+                compress = (compress_segment if strip_extension(path).endswith(SEGMENT_EXT)
+                            else compress_file)
+                # The entry goes back to the uploader whatever happens here,
+                # which quarantines files it cannot read
+                try:
+                    path = compress(path, self._codec)[0]
+                    self._state["spool_compressed_total"] += 1
+                except (OSError, ValueError) + DECODE_ERRORS as e:
+                    print(f"Spool: cannot compress {path}: {e}")
+                finally:
+                    self._rewritten(entry, path)
+        return actions
+
+    def _decimate(self, used: int, limit: int, actions: int) -> int:
+        for entry in self._queue.oldest(MAX_ACTIONS, False, MAX_DECIMATION):
+            if actions <= 0 or used < DECIMATE_AT * limit:
+                break
+            if (not strip_extension(entry["path"]).endswith(SEGMENT_EXT)
+                    or not self._queue.take(entry["id"])):
+                continue
+            actions -= 1
+            path = entry["path"]
+            decimation = entry["decimation"]
+            samples = None
+            try:
+                segment = Segment(path)
+                # Every other sample; the device times keep the wall times right
+                records = segment.records[::2]
+                codec = codec_for(path)
+                data = encode_segment(segment, records, shuffled=codec is not None)
+                count = len(records)
+                del segment, records
+                write_compressed(path, data, codec)
+                decimation *= 2
+                samples = count
+                self._state["spool_decimated_total"] += 1
+            except (OSError, ValueError) + DECODE_ERRORS as e:
+                print(f"Spool: cannot decimate {path}: {e}")
+            finally:
+                used += self._rewritten(entry, path, decimation, samples)
+        return actions
+
+    def _rewritten(self, entry: Dict[str, object], path: str, decimation: int = None,
+                   samples: int = None) -> int:
+        # Hand the entry back to the uploader; returns the change in size
+        try:
+            self._queue.replace(entry["id"], path, decimation, samples)
+        except OSError:
+            self._queue.done(entry["id"])
+            return -entry["size"]
+        size = os.path.getsize(path)
+        self._state["spool_freed_bytes_total"] += max(entry["size"] - size, 0)
+        return size - entry["size"]
+
+    def _evict(self, excess: int) -> int:
+        freed = 0
+        # Quiet segments first; flagged ones only if that was not enough
+        for flagged in (False, True):
+            removed = True
+            while freed < excess and removed:
+                removed = False
+                for entry in self._queue.oldest(MAX_ACTIONS, flagged):
+                    if freed >= excess:
+                        break
+                    if not self._queue.take(entry["id"]):
+                        continue
+                    try:
+                        os.remove(entry["path"])
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        print(f"Spool: cannot remove {entry['path']}: {e}")
+                        self._queue.retry(entry["id"], str(e))
+                        continue
+                    self._queue.done(entry["id"])
+                    removed = True
+                    freed += entry["size"]
+                    self._state["spool_evicted_total"] += 1
+                    if flagged:
+                        self._state["spool_evicted_flagged_total"] += 1
+                    print(f"Spool over budget: removed {entry['path']}")
+        self._state["spool_freed_bytes_total"] += freed
+        return freed
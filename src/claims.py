@@ -0,0 +1,66 @@
+import fcntl
+import os
+from typing import Dict
+
+CLAIM_DIR = "/tmp/fallyx_claims"
+
+
+class ClaimRegistry:
+    """
+    Make sure a sensor is only ever connected by one connector.
+
+    Each device address has a lock file in `directory`. Claiming takes a
+    non-blocking exclusive flock on it, which is atomic across processes and
+    costs one open and one flock call no matter how many sensors or data
+    files there are. The kernel drops the lock when the holding process
+    exits, so a crashed connector never leaves a stale claim behind.
+
+    :param directory: Directory holding the per-device lock files.
+    """
+
+    def __init__(self, directory: str = CLAIM_DIR) -> None:
+        self._directory = directory
+        self._held: Dict[str, object] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, address: str) -> str:
+        # Addresses are MACs (or UUIDs on macOS); keep them filename-safe
+        return os.path.join(self._directory, address.replace(":", "").replace("/", "") + ".lock")
+
+    def claim(self, address: str) -> bool:
+        """
+        :param address: Device address to claim.
+        :return: True if this registry now holds the device, False if someone
+                 else already does.
+        """
+        if address in self._held:
+            return False
+        file = open(self._path(address), "a+")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return False
+        # Owner pid, for whoever is debugging a stuck claim
+        file.seek(0)
+        file.truncate()
+        file.write(f"{os.getpid()}\n")
+        file.flush()
+        self._held[address] = file
+        return True
+
+    def release(self, address: str) -> None:
+        file = self._held.pop(address, None)
+        if file is None:
+            return
+        # The lock file is kept: unlinking it would let a waiting claimant
+        # lock an orphaned inode while a third process creates a new one
+        fcntl.flock(file, fcntl.LOCK_UN)
+        file.close()
+
+    def holds(self, address: str) -> bool:
+        return address in self._held
+
+    def release_all(self) -> None:
+        for address in list(self._held):
+            self.release(address)
@@ -0,0 +1,172 @@
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from losstracker import COUNTER_WRAP
+
+# Device time covered by one fit point; the earliest arrival in each bucket
+# is kept, since queueing and radio delays only ever make samples late
+BUCKET_US = 1000000
+# Fit points kept, i.e. seconds of history the model is fitted over
+WINDOW = 120
+# Span of device time needed before drift is estimated instead of assumed 0
+MIN_DRIFT_SPAN_S = 10.0
+# Points further above the fit than this many MADs are dropped before refitting
+OUTLIER_MADS = 3.0
+# Seconds by which device time and arrival time may disagree between two
+# observations before the counter is taken to have jumped (sensor reboot)
+JUMP_TOLERANCE_S = 5.0
+
+
+def counter_delta(counter: int, reference: int) -> int:
+    """
+    :return: Signed microseconds from reference to counter on the wrapping
+             uint32 firmware clock.
+    """
+    return ((counter - reference + COUNTER_WRAP // 2) % COUNTER_WRAP) - COUNTER_WRAP // 2
+
+
+class ClockModel:
+    """
+    Map the firmware microsecond counter of one device to gateway wall time.
+
+    Arrival times are observed against the device counter. Per second of
+    device time only the earliest arrival is kept, which tracks the lower
+    envelope where radio and queueing delay is smallest. An offset plus
+    drift line is fitted over the recent points by least squares, refitted
+    once without points far above the line. Each sample's wall time then
+    comes from the model instead of from when the gateway handled it.
+
+    When the counter moves by something other than the time that passed
+    between arrivals (the sensor rebooted), the fit starts over.
+    """
+
+    def __init__(self, window: int = WINDOW) -> None:
+        self._points = deque(maxlen=window)
+        self.resets = 0
+        self.reset()
+
+    def reset(self) -> None:
+        # Forget the fit, e.g. for a new session or after a counter jump
+        self._points.clear()
+        # Raw counter, arrival and unwrapped device time (us) of the newest observation
+        self._last_counter: Optional[int] = None
+        self._last_arrival: Optional[float] = None
+        self._x = 0
+        self._bucket = None
+        self._bucket_min = None
+        # Fit: wall = self._wall_ref + self._rate * (device us from _counter_ref) / 1e6
+        self._counter_ref = None
+        self._wall_ref = None
+        self._rate = 1.0
+        self._residual = 0.0
+
+    @property
+    def ready(self) -> bool:
+        return self._counter_ref is not None
+
+    @property
+    def drift_ppm(self) -> float:
+        return (self._rate - 1.0) * 1e6
+
+    def observe(self, counter: int, arrival: float) -> None:
+        """
+        :param counter: Raw uint32 device time of a sample, in order of arrival.
+        :param arrival: Gateway wall time (time.time()) the sample arrived at.
+        """
+        if self._last_counter is not None:
+            delta = counter_delta(counter, self._last_counter)
+            if abs(delta / 1e6 - (arrival - self._last_arrival)) > JUMP_TOLERANCE_S:
+                self.reset()
+                self.resets += 1
+            else:
+                self._x += delta
+        self._last_counter = counter
+        self._last_arrival = arrival
+        x = self._x
+        bucket = x // BUCKET_US
+        if bucket != self._bucket:
+            if self._bucket_min is not None:
+                self._points.append(self._bucket_min)
+                self._fit()
+            self._bucket = bucket
+            self._bucket_min = None
+        # Compare arrivals by how late they are relative to device time
+        if self._bucket_min is None or arrival - x / 1e6 < self._bucket_min[2]:
+            self._bucket_min = (x, arrival, arrival - x / 1e6, counter)
+        if not self._points:
+            # Offset only until the first bucket is complete
+            _, self._wall_ref, _, self._counter_ref = self._bucket_min
+            self._rate = 1.0
+
+    def _fit(self) -> None:
+        points = list(self._points)
+        x_ref, y_ref, _, counter_ref = points[-1]
+        xs = [(p[0] - x_ref) / 1e6 for p in points]
+        ys = [p[1] - y_ref for p in points]
+        rate, intercept = self._line(xs, ys)
+        residuals = [y - (intercept + rate * x) for x, y in zip(xs, ys)]
+        mad = sorted(abs(r) for r in residuals)[len(residuals) // 2]
+        keep = [i for i, r in enumerate(residuals) if r <= OUTLIER_MADS * mad + 1e-3]
+        if 2 <= len(keep) < len(points):
+            rate, intercept = self._line([xs[i] for i in keep], [ys[i] for i in keep])
+            residuals = [ys[i] - (intercept + rate * xs[i]) for i in keep]
+        # Shift down onto the lower envelope of the kept points
+        floor = min(residuals)
+        self._counter_ref = counter_ref
+        self._wall_ref = y_ref + intercept + floor
+        self._rate = rate
+        self._residual = mad
+
+    @staticmethod
+    def _line(xs, ys):
+        n = len(xs)
+        mean_x = sum(xs) / n
+        mean_y = sum(ys) / n
+        sxx = sum((x - mean_x) ** 2 for x in xs)
+        if n < 2 or max(xs) - min(xs) < MIN_DRIFT_SPAN_S:
+            # Too short a span to tell drift from jitter
+            return 1.0, mean_y - mean_x
+        rate = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx
+        return rate, mean_y - rate * mean_x
+
+    def wall_time(self, counter: int) -> float:
+        """
+        :param counter: Raw uint32 device time of a sample within about half
+                        an hour of the latest observation.
+        :return: Estimated gateway wall time of the sample (seconds since epoch).
+        """
+        if self._counter_ref is None:
+            return time.time()
+        return self._wall_ref + self._rate * counter_delta(counter, self._counter_ref) / 1e6
+
+    def counters(self) -> Dict[str, float]:
+        return {
+            "clock_drift_ppm": round(self.drift_ppm, 2),
+            "clock_fit_points": len(self._points),
+            "clock_jitter_ms": round(self._residual * 1e3, 3),
+            "clock_resets_total": self.resets,
+        }
+
+
+class TimestampFormatter:
+    """
+    Format wall times like datetime's "%Y-%m-%d %H:%M:%S.%f" with one
+    strftime call per second instead of one per sample.
+    """
+
+    def __init__(self) -> None:
+        self._second = None
+        self._prefix = ""
+
+    def format(self, wall: float) -> str:
+        second = int(wall)
+        # Rounded like datetime.fromtimestamp, so 0.51 is not printed as .509999
+        micros = round((wall - second) * 1e6)
+        if micros == 1000000:
+            second += 1
+            micros = 0
+        if second != self._second:
+            self._second = second
+            self._prefix = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        return f"{self._prefix}.{micros:06d}"
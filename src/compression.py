@@ -0,0 +1,183 @@
+import gzip
+import os
+import zlib
+from typing import BinaryIO, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec for upload bodies, and for segments the spool budget compresses:
+# "gzip", "zstd" (needs the zstandard package) or "none"
+COMPRESSION = os.environ.get("FALLYX_COMPRESSION", "gzip")
+# Codec segments are compressed with as they are sealed. Off by default:
+# it writes every segment twice on the SD card, for about 1.35x on binary
+# segments, so the spool budget only compresses once send_out fills up.
+SEAL_COMPRESSION = os.environ.get("FALLYX_SEAL_COMPRESSION", "none")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+CHUNK = 64 * 1024
+
+# File extension and HTTP Content-Encoding per codec
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+ENCODINGS = {"gzip": "gzip", "zstd": "zstd"}
+# What reading a damaged or truncated compressed file raises
+DECODE_ERRORS = (EOFError, zlib.error, gzip.BadGzipFile) + (
+    (zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def available(codec: str) -> bool:
+    if codec == "zstd":
+        return zstandard is not None
+    return codec in ("gzip", "none")
+
+
+def codec_for(path: str) -> Optional[str]:
+    """
+    :return: Codec a file was compressed with, from its extension, or None.
+    """
+    for codec, ext in EXTENSIONS.items():
+        if path.endswith(ext):
+            return codec
+    return None
+
+
+def strip_extension(path: str) -> str:
+    # "x.seg.gz" -> "x.seg"
+    codec = codec_for(path)
+    return path[:-len(EXTENSIONS[codec])] if codec else path
+
+
+def _writer(codec: str, file: BinaryIO):
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=file, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file, closefd=False)
+
+
+def open_compressed(path: str) -> BinaryIO:
+    """
+    Open a file for reading, decompressing it on the fly if its extension
+    says it is compressed.
+    """
+    codec = codec_for(path)
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    return open(path, "rb")
+
+
+def compress_file(path: str, codec: str = COMPRESSION,
+                  directory: str = None) -> Tuple[str, int, int]:
+    """
+    Compress a file in CHUNK-sized pieces and remove the original. The
+    compressed file only appears under its final name once it is complete
+    and fsynced, so a reader watching the directory never sees half of it.
+
+    :param path: File to compress.
+    :param codec: "gzip" or "zstd".
+    :param directory: Where to put the result, next to the original by default.
+    :return: Path of the result, bytes in, bytes out.
+    """
+    size = os.path.getsize(path)
+    target = os.path.join(directory or os.path.dirname(path),
+                          os.path.basename(path) + EXTENSIONS[codec])
+    part = target + ".part"
+    with open(path, "rb") as src, open(part, "wb") as dst:
+        writer = _writer(codec, dst)
+        while True:
+            chunk = src.read(CHUNK)
+            if not chunk:
+                break
+            writer.write(chunk)
+        writer.close()
+        dst.flush()
+        os.fsync(dst.fileno())
+        written = dst.tell()
+    os.replace(part, target)
+    os.remove(path)
+    return target, size, written
+
+
+def write_compressed(path: str, data: bytes, codec: Optional[str]) -> int:
+    """
+    Write data compressed to path, which only appears (or is replaced) once
+    the file is complete and fsynced.
+
+    :param codec: "gzip", "zstd", or None to write data as it is.
+    :return: Bytes written.
+    """
+    part = path + ".part"
+    with open(part, "wb") as file:
+        file.write(compress_bytes(data, codec))
+        file.flush()
+        os.fsync(file.fileno())
+        written = file.tell()
+    os.replace(part, path)
+    return written
+
+
+def compress_bytes(data: bytes, codec: Optional[str]) -> bytes:
+    """
+    :param codec: "gzip", "zstd", or None to leave data as it is.
+    """
+    if codec == "gzip":
+        return gzip.compress(data, GZIP_LEVEL, mtime=0)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+class BodyCompressor:
+    """
+    Compress an upload body piece by piece.
+
+    :param codec: "gzip", "zstd" or "none".
+    """
+
+    def __init__(self, codec: str = COMPRESSION) -> None:
+        if not available(codec):
+            codec = "gzip"
+        self.codec = codec
+        if codec == "gzip":
+            # wbits 31: gzip framing, as Content-Encoding: gzip expects
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        elif codec == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        else:
+            self._compressor = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def encoding(self) -> Optional[str]:
+        return ENCODINGS.get(self.codec)
+
+    def compress(self, data: bytes) -> bytes:
+        self.bytes_in += len(data)
+        out = self._compressor.compress(data) if self._compressor else data
+        self.bytes_out += len(out)
+        return out
+
+    def flush(self) -> bytes:
+        out = self._compressor.flush() if self._compressor else b""
+        self.bytes_out += len(out)
+        return out
+
+
+def decompress_body(data: bytes, encoding: Optional[str]) -> bytes:
+    """
+    Undo a Content-Encoding ("gzip", "deflate", "zstd" or none).
+
+    :raises ValueError: For an encoding that is not supported.
+    """
+    if not encoding or encoding == "identity":
+        return data
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompress(data, 47)
+    if encoding == "deflate":
+        return zlib.decompress(data)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    raise ValueError(f"Unsupported Content-Encoding: {encoding}")
@@ -1,15 +1,25 @@
 
 import asyncio
-import struct
 import sys
 import time
-import csv
-import shutil
-import fcntl
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime
-from bleak import BleakClient, BleakScanner, BleakError
+import numpy as np
+from transport import BleakClient, BleakError
+from assembler import Sample, SampleAssembler
+from adapters import AdapterScheduler
+from claims import ClaimRegistry
+from clocksync import ClockModel
+from decoders import PACKED_UUID, SAMPLE_DTYPE, build_decoders, decode_packed
+from losstracker import LossTracker
+from metrics import RateEstimator, metrics
+from ringbuffer import SampleRing
+from scanwindow import WindowImpact, scan_window
+from rotation import RotationPolicy, rotator
+from scanner import ScannerService
+from segments import SEGMENT_EXT, CsvSegmentWriter, SegmentWriter
+from storage import storage
 
 # Example UUIDs for multiple characteristics
 IMU_UUIDS = [
@@ -23,65 +33,129 @@ IMU_UUIDS = [
     
 ]
 
+IMU_SERVICE_UUID = '12345678-1234-5678-1234-56789abcdef0'
+
 TARGET_TAG_NAME = 'FallSensor'
+MIN_RSSI = -80
+# Seconds to wait for an advertisement before reporting the sensor missing
+SCAN_TIMEOUT = 10
+# Scan for SCAN_WINDOW seconds out of every SCAN_INTERVAL, leaving the radio
+# to open connections in between
+SCAN_INTERVAL = 5.0
+SCAN_WINDOW = 1.0
+# Delays in seconds before each direct reconnect attempt after a drop
+RECONNECT_BACKOFF = [0, 0.5, 1, 2, 4, 8]
+# In-memory history per sensor: RING_SECONDS at up to RING_MAX_HZ
+# (2 * 30 * 200 * 32 bytes = 384 KB per sensor)
+RING_SECONDS = 30
+RING_MAX_HZ = 200
 GATEWAY_LOC = "Ayaan's Suite"
+# Segment files are binary (segments.py, 28 bytes per sample) unless set to
+# "csv"; binary segments can be exported to CSV with segments.py. Both are
+# written by the storage thread (storage.py), never on the event loop.
+SEGMENT_FORMAT = os.environ.get("FALLYX_SEGMENT_FORMAT", "bin")
+# Segments are sealed on every SEGMENT_SECONDS wall-clock boundary (each :00
+# for 60), the same moment for all sensors, or after SEGMENT_MAX_SAMPLES
+# samples or SEGMENT_MAX_BYTES bytes when those are set (0 = no limit)
+SEGMENT_SECONDS = 60
+SEGMENT_MAX_SAMPLES = 0
+SEGMENT_MAX_BYTES = 0
 
 imu_client = None
 
 class NanoIMUBLEClient:
-    def __init__(self, service_uuid: str, characteristic_uuids: List[str], csvout: bool = True) -> None:
+    # Upper bound on samples queued between the notification callback and
+    # the consumer, and on samples handled per consumer wake-up
+    MAX_QUEUED = 4096
+    MAX_BATCH = 256
+
+    def __init__(self, service_uuid: str, characteristic_uuids: List[str], csvout: bool = True,
+                 packed: bool = True, scanner: ScannerService = None,
+                 claims: ClaimRegistry = None, scheduler: AdapterScheduler = None,
+                 segment_format: str = SEGMENT_FORMAT, rotation: RotationPolicy = None) -> None:
         self._client = None
+        self._claims = claims if claims is not None else ClaimRegistry()
+        self._scheduler = scheduler if scheduler is not None else AdapterScheduler()
+        # A scanner shared with other clients (hub.py), or our own one
+        self._scanner = scanner
+        self._owns_scanner = scanner is None
         self._device = None
+        self._adapter = None
         self._connected = False
         self._running = False
         self._service_uuid = service_uuid
         self._characteristic_uuids = characteristic_uuids
+        # Use the packed characteristic when the firmware offers it
+        self._allow_packed = packed
+        self._packed = False
+        # Characteristic handles by UUID, cached from the first connection
+        self._layout: Dict[str, int] = {}
+        # Per-axis decoders by characteristic handle, built in start()
+        self._decoders = {}
+        self._lost_at = None
         self._found = False
-        self._data = {
-            "time": 0,
-            "ax": 0.0, "ay": 0.0, "az": 0.0,
-            "gx": 0.0, "gy": 0.0, "gz": 0.0
-        }
+        self._assembler = SampleAssembler()
+        self._loss = LossTracker()
+        # Set by link(); the first samples after it restart the loss window
+        # so the gap of a (re)connect does not count against the new link
+        self._fresh_link = False
+        # Set by migrate() so the reconnect keeps the adapter it was moved to
+        self._migrating = False
+        self._clock = ClockModel()
+        self._recent = SampleRing(RING_SECONDS * RING_MAX_HZ)
+        self._rate = RateEstimator()
+        self._impact = WindowImpact()
+        self._last_arrival = None
+        self._samples = asyncio.Queue(maxsize=self.MAX_QUEUED)
+        self._disconnected = None
+        self._last_sample = Sample(0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
         self._csvout = csvout
-        self.newdata = False
+        self._format = segment_format
+        self._rotation = rotation if rotation is not None else RotationPolicy(
+            SEGMENT_SECONDS, True, SEGMENT_MAX_SAMPLES, SEGMENT_MAX_BYTES)
+        self._segment_samples = 0
+        self.received = 0
+        self.dropped = 0
         self.start_time = time.time()
         self.file = None
-        self.writer = None
-        self.sample_count = 0
-        self.last_sample_time = time.time()
-        self.samples_per_second = []
         self.last_print_time = time.time()
         self.file_name = None 
+        self._segment_seq = 1
 
-    def create_new_csv(self):
-        if self.file is not None:
-            print("Moving old csv to create a new csv")
-            self.file.close()
-            self.move_file()
-            self.file = None
+    def create_new_segment(self):
+        # Only creates the segment object; the storage thread opens the file
+        # with the first records and moves sealed ones to send_out
+        self.seal_segment()
         self.start_time = time.time()
+        self._segment_samples = 0
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"imu_data_{timestamp}_{self._device.address}.csv"
-        self.file_name = filename
-        print(os.path.join(os.getcwd(),filename))
-        for file in os.listdir(os.getcwd()):
-            if file.endswith(".csv"):
-                if str(self._device.address) in file:
-                    print(f"File Match Found")
-                    return 0
-        self.file = open(filename, 'w', newline='')
-        self.writer = csv.writer(self.file)
-
-        # Add location information at the top
-        self.writer.writerow([GATEWAY_LOC])  # This is the new line
-
-
-        header = ["Timestamp", "Sample Rate (Hz)", "Time", "Ax", "Ay", "Az", "Gx", "Gy", "Gz"]
-        self.writer.writerow(header)
-        self.sample_count = 0
-        self.last_sample_time = time.time()
-        self.samples_per_second = []
-        return 1
+        ext = ".csv" if self._format == "csv" else SEGMENT_EXT
+        file_name = f"imu_data_{timestamp}_{self._device.address}{ext}"
+        # Sample or byte limits can rotate more than once a second
+        if self.file_name is not None and self.file_name.startswith(file_name[:-len(ext)]):
+            file_name = f"imu_data_{timestamp}_{self._device.address}_{self._segment_seq}{ext}"
+            self._segment_seq += 1
+        else:
+            self._segment_seq = 1
+        self.file_name = file_name
+        print(os.path.join(os.getcwd(), self.file_name))
+        writer = CsvSegmentWriter if self._format == "csv" else SegmentWriter
+        self.file = writer(self.file_name, GATEWAY_LOC, self._device.address)
+        rotator.add(self.check_rotation)
+
+    def seal_segment(self) -> None:
+        if self.file is not None:
+            rotator.discard(self.check_rotation)
+            storage.seal(self.file)
+            self.file = None
+
+    def check_rotation(self, now: float) -> float:
+        # Called by the rotation timer; returns when to be called next
+        if self.file is None:
+            return now + 3600
+        if self._rotation.expired(self.start_time, self.file.bytes, now):
+            self.create_new_segment()
+        return self._rotation.deadline(self.start_time)
 
     @property
     def connected(self) -> bool:
@@ -89,7 +163,12 @@ class NanoIMUBLEClient:
 
     @property
     def data(self) -> Dict:
-        return self._data
+        return self._last_sample._asdict()
+
+    @property
+    def recent(self) -> SampleRing:
+        # Last RING_SECONDS of samples, for windowed consumers
+        return self._recent
 
     @property
     def service_uuid(self) -> str:
@@ -103,94 +182,251 @@ class NanoIMUBLEClient:
     def device(self):
         return self._device
 
+    def link_loss(self) -> Optional[float]:
+        """
+        :return: Fraction of samples the link lost since the previous call,
+                 or None if too few arrived to tell (LossTracker.window()).
+        """
+        return self._loss.window()
+
     async def discover_devices(self):
         print('Seeed XIAO BLE Service')
         print('Looking for Peripheral Device...')
-        devices = None
-        scanner = BleakScanner(adapter="hci0")
-        lock_file = "/tmp/bluetooth_lock"
-        lock = self.acquire_lock(lock_file)
-        try:
-           devices =  await asyncio.wait_for(scanner.discover(),timeout=10)
-        except asyncio.TimeoutError:
-            print("Scan Timeout")
-            pass 
-
-        self.release_lock(lock)
-        for d in devices:
-            local_name = d.name or 'Unknown'
-            if local_name == TARGET_TAG_NAME and (d.rssi > -80):
-                print(f"RSSI: {d.rssi}")
-                self._found = True
-                self._device = d
-                print(f'Found Peripheral Device {self._device.address}. Local Name: {local_name}')
-                return
+        if self._scanner is None:
+            self._scanner = ScannerService(TARGET_TAG_NAME, self._scheduler.adapters,
+                                           interval=SCAN_INTERVAL, window=SCAN_WINDOW)
+        await self._scanner.start()
+        # Answered from the live advertisement table, so this only waits when
+        # no sensor has been heard yet. Sensors another connector has claimed
+        # are skipped before any connection is attempted.
+        taken = set()
+        while True:
+            found = await self._scanner.wait_for_sensor(MIN_RSSI, exclude=taken,
+                                                        timeout=SCAN_TIMEOUT)
+            if found is None:
+                break
+            d, rssi = found
+            if not self.take(d):
+                taken.add(d.address)
+                continue
+            print(f"RSSI: {rssi} on {self._adapter}")
+            self._found = True
+            self._device = d
+            print(f'Found Peripheral Device {self._device.address}. Local Name: {d.name}')
+            return
 
         print("Peripheral device not found. Retry...")
-        await asyncio.sleep(1)
 
     async def connect(self) -> None:
-        flag = 0
-        lock_file = "/tmp/bluetooth_lock"
         while not self._connected:
             await self.discover_devices()
             if not self._found:
                 continue
             if self._device is not None:
-                try:
-                    print(f"Attempting to connect to {self._device.address}")
-                    self._client = BleakClient(self._device.address)
-                    try:
-                        await asyncio.wait_for(self._client.connect(), timeout=10)
-                        print(f'Connected to {self._device.address}.')
-                        self._connected = True
-                        # Discover characteristics to verify
-                        await asyncio.sleep(3)
-                        await self.discover_characteristics()
-                        err = self.create_new_csv()
-                        if not err:
-                            raise Exception("File match found")
-                        await self.start()
-
-
-                    except asyncio.TimeoutError:
-                        print("Connection Timeout")
-                        self._connected = True
-                        pass
-
-                    while self._connected:
-                        if self._running and self.newdata:
-                            if self.is_discovery_in_progress(lock_file):
-                                print("Discovery in progress, stopping notifications...")
-                                # Pause notifications until discovery is done
-                                flag = 1;
-                                self.stop()
-                            elif flag == 1:
-                                flag = 0
-                                print("Discovery stopped, starting notifcations...")
-                                self.start()
-
-                            else:
-                                self.save_data()
-                            if time.time() - self.last_print_time >= 3:  # Print every second
-                                print(f"Connected: {self._client.is_connected} to {self._device.address}")
-                                #self.print_newdata()
-                                self.last_print_time = time.time()
-                            self.newdata = False
-                        if not self._client.is_connected:
-                            print("Device disconnected. Exiting...") 
-                            await self.disconnect()
-                            break
-                        await asyncio.sleep(0.01)
-                except (BleakError, asyncio.TimeoutError, Exception) as e:
-                    print(f"Connection failed: {e}. Retry...")
-                    await self.disconnect()
+                await self.session()
+                break
+
+    def assign(self, device) -> bool:
+        # Hand over a device found by someone else's scan (see hub.py).
+        # Returns False if another connector has already claimed it.
+        if not self.take(device):
+            return False
+        self._device = device
+        self._found = True
+        return True
+
+    def take(self, device) -> bool:
+        # Claim the device and pick the adapter that hears it best
+        if not self._claims.claim(device.address):
+            return False
+        rssi = self._scanner.rssi_by_adapter(device.address) if self._scanner else {}
+        self._adapter = self._scheduler.place(device.address, rssi, MIN_RSSI)
+        if self._adapter is None:
+            print(f"No adapter with a free slot hears {device.address} well enough")
+            self._claims.release(device.address)
+            return False
+        return True
+
+    async def session(self) -> None:
+        device = self._device
+        address = device.address
+        metrics.register(address, self.counters)
+        # A new session may be a rebooted sensor; fit its clock afresh
+        self._clock.reset()
+        try:
+            print(f"Attempting to connect to {address}")
+            await self.link()
+            while self._connected:
+                await self.stream()
+                lost_at = time.monotonic()
+                print("Device disconnected.")
+                await self.disconnect()
+                if not await self.reconnect(device):
+                    print("Reconnect failed. Exiting...")
                     break
-                    #self._connected = False
-                    #self._found = False
-                    #await self.retry_connection()
-                    #await asyncio.sleep(1)
-            
+                self._lost_at = lost_at
+        except (BleakError, asyncio.TimeoutError, Exception) as e:
+            print(f"Connection failed: {e}. Retry...")
+            await self.disconnect()
+        finally:
+            metrics.unregister(address, self.counters)
+            self._scheduler.release(address)
+            self._claims.release(address)
+
+    async def link(self) -> None:
+        # Connect, subscribe and open a new csv. The GATT layout is only
+        # walked on the first connection; reconnects reuse the cached handles.
+        address = self._device.address
+        self._disconnected = asyncio.Event()
+        # Connecting by address makes bleak scan for the device first (on
+        # every reconnect, unseen by scan_window); hand it the device object
+        # the chosen adapter reported instead
+        target = self._scanner.device(address, self._adapter) if self._scanner else None
+        self._client = BleakClient(target if target is not None else address,
+                                   disconnected_callback=self.disconnected_hndlr,
+                                   adapter=self._adapter)
+        await asyncio.wait_for(self._client.connect(), timeout=10)
+        print(f'Connected to {address} on {self._adapter}.')
+        self._connected = True
+        self._fresh_link = True
+        if self._scanner is not None:
+            self._scanner.forget(address)
+            if self._owns_scanner:
+                # Only scan while looking for a sensor
+                await self._scanner.stop()
+        if not self._layout:
+            # Discover characteristics to verify
+            await asyncio.sleep(3)
+            await self.discover_characteristics()
+        self.create_new_segment()
+        await self.start()
+        if not self._running:
+            raise BleakError(f"Could not subscribe to {address}")
+
+    async def stream(self) -> None:
+        # The consumer only wakes when samples are queued; this
+        # task sleeps until the link goes away.
+        consumer = asyncio.create_task(self.consume())
+        try:
+            await self._disconnected.wait()
+        finally:
+            consumer.cancel()
+        self.drain()
+
+    async def reconnect(self, device) -> bool:
+        """
+        Connect straight back to a device that dropped, without scanning.
+
+        :param device: The device of the session that was lost.
+        :return: True once the link is back up, False after the last attempt.
+        """
+        for attempt, delay in enumerate(RECONNECT_BACKOFF):
+            await asyncio.sleep(delay)
+            self._device = device
+            # Move to another adapter if it now hears the device better,
+            # unless the hub just moved it. When no adapter with a free slot
+            # hears it, place() keeps the placement on the current adapter.
+            heard = self._scanner.rssi_by_adapter(device.address) if self._scanner else {}
+            if heard and not self._migrating:
+                adapter = self._scheduler.place(device.address, heard, MIN_RSSI)
+                if adapter is not None:
+                    self._adapter = adapter
+            print(f"Reconnecting to {device.address} on {self._adapter}, attempt {attempt + 1}")
+            try:
+                await self.link()
+                self._migrating = False
+                return True
+            except (BleakError, asyncio.TimeoutError, OSError) as e:
+                print(f"Reconnect failed: {e}")
+                await self.disconnect()
+        self._migrating = False
+        return False
+
+    async def migrate(self, adapter: str) -> None:
+        # Drop the link so the session reconnects on another adapter
+        print(f"Moving {self._device.address} from {self._adapter} to {adapter}")
+        self._adapter = adapter
+        self._migrating = True
+        if self._client is not None:
+            await self._client.disconnect()
+
+    async def consume(self) -> None:
+        queue = self._samples
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty() and len(batch) < self.MAX_BATCH:
+                batch.append(queue.get_nowait())
+            self.track(batch)
+            metrics.maybe_write()
+            if not self._running:
+                continue
+            if self._lost_at is not None:
+                self.log_reconnect_gap(time.monotonic() - self._lost_at)
+                self._lost_at = None
+            # Notifications keep flowing through scan windows; their cost is
+            # measured instead
+            self.save_batch(batch)
+            if time.time() - self.last_print_time >= 3:  # Print every second
+                print(f"Connected: {self._client.is_connected} to {self._device.address}")
+                print(f"Frames: {self._assembler.stats()} received: {self.received} dropped: {self.dropped}")
+                #self.print_newdata()
+                self.last_print_time = time.time()
+
+    def track(self, batch) -> None:
+        # Loss accounting and sample rate from the firmware counter, before
+        # anything is saved, and recent history into the ring buffer
+        observe = self._loss.observe
+        resets = self._loss.resets
+        ring = self._recent
+        count = 0
+        for item in batch:
+            if isinstance(item, Sample):
+                t = observe(item.time)
+                ring.append(t, *item[1:])
+                count += 1
+            else:
+                times = [observe(t) for t in item['time'].tolist()]
+                ring.extend(times, item)
+                count += len(times)
+        if self._fresh_link:
+            self._fresh_link = False
+            self._loss.restart_window()
+            self._rate.reset()
+        if self._loss.resets != resets:
+            # The sensor restarted; its old clock fit no longer applies
+            self._clock.reset()
+            self._rate.reset()
+        self._rate.observe(count)
+        # With the queue empty the newest arrival belongs to the last sample
+        if self._samples.empty() and self._last_arrival is not None:
+            last = batch[-1]
+            counter = last.time if isinstance(last, Sample) else int(last['time'][-1])
+            self._clock.observe(counter, self._last_arrival)
+            latency = self._last_arrival - self._clock.wall_time(counter)
+            samples = sum(1 if isinstance(item, Sample) else len(item) for item in batch)
+            self._impact.observe(time.monotonic(), samples, latency, scan_window.any_active)
+
+    def counters(self) -> Dict[str, float]:
+        counters = self._loss.counters()
+        for name, value in self._assembler.stats().items():
+            counters[f"frames_{name}_total"] = value
+        counters["samples_dropped_total"] = self.dropped
+        counters["sample_rate_hz"] = self._rate.rate
+        counters.update(self._clock.counters())
+        counters.update(self._impact.counters())
+        return counters
+
+    def drain(self) -> None:
+        # Save whatever was queued before the consumer was cancelled
+        while not self._samples.empty():
+            sample = self._samples.get_nowait()
+            self.track([sample])
+            if self._running and self.file is not None:
+                self.save_batch([sample])
+
+    def disconnected_hndlr(self, client) -> None:
+        if self._disconnected is not None:
+            self._disconnected.set()
 
     async def disconnect(self) -> None:
         if self._connected:
@@ -201,19 +437,32 @@ class NanoIMUBLEClient:
             finally:
                 self.log_disconnect()
                 print("Finished Disconnect routine")
-                try:
-                    self.move_file()
-                except:
-                    pass
+                self.seal_segment()
                 self._device = None
                 self._connected = False
                 self._running = False
 
+    def notify_uuids(self) -> List[str]:
+        if self._packed:
+            return [PACKED_UUID]
+        return self._characteristic_uuids
+
+    async def close(self) -> None:
+        # Stop the scanner if this client started it
+        if self._owns_scanner and self._scanner is not None:
+            await self._scanner.stop()
+
     async def start(self) -> None:
         if self._connected:
+            handler = self.packed_hndlr if self._packed else self.newdata_hndlr
             try:
-                for uuid in self._characteristic_uuids:
-                    await self._client.start_notify(uuid, self.newdata_hndlr)
+                # A cached handle avoids a lookup by UUID
+                characteristics = [self._client.services.get_characteristic(self._layout.get(uuid, uuid))
+                                   for uuid in self.notify_uuids()]
+                # Decoders are ready before the first notification can arrive
+                self._decoders = build_decoders({c.uuid: c.handle for c in characteristics})
+                for characteristic in characteristics:
+                    await self._client.start_notify(characteristic, handler)
                 self._running = True
             except Exception as e:
                 print(f"Starting notification failed: {e}")
@@ -222,8 +471,8 @@ class NanoIMUBLEClient:
     async def stop(self) -> None:
         if self._running:
             try:
-                for uuid in self._characteristic_uuids:
-                    await self._client.stop_notify(uuid)
+                for uuid in self.notify_uuids():
+                    await self._client.stop_notify(self._layout.get(uuid, uuid))
             except Exception as e:
                 print(f"Stopping notification failed: {e}")
                 await self.disconnect()
@@ -231,96 +480,85 @@ class NanoIMUBLEClient:
 
     def newdata_hndlr(self, sender, data):
         try:
-            uuid = str(sender.uuid)  # Ensure UUID is in string format
-            if uuid == '12345678-1234-5678-1234-56789abcdef1':
-                #print(f"Accel X UUID is {uuid}")
-                a_x = struct.unpack('<f', bytes(data[0:4]))[-1]
-                self._data['ax'] = a_x 
-
-
-
-            elif uuid == '12345678-1234-5678-1234-56789abcdef2':
-                #print(f"Accel Y UUID is {uuid}")
-                a_y = struct.unpack('<f', bytes(data[0:4]))[-1]
-                self._data['ay'] = a_y
-
-
-
-            elif uuid == '12345678-1234-5678-1234-56789abcdef3':
-                #print(f"Accel Z UUID is {uuid}")
-                a_z = struct.unpack('<f', bytes(data[0:4]))[-1]
-                self._data['az'] = a_z
-
-                
-                # Handle data for UUID 12345678-1234-5678-1234-56789abcdef3
-                # Implement specific handling logic here
-
-            elif uuid == '12345678-1234-5678-1234-56789abcdef4':
-                #print(f"Gyro X UUID is {uuid}")
-                self._data['gx'] = (struct.unpack('<f', bytes(data[0:4]))[-1])
-
-                # Handle data for UUID 12345678-1234-5678-1234-56789abcdef4
-                # Implement specific handling logic here
-
-            elif uuid == '12345678-1234-5678-1234-56789abcdef5':
-                #print(f"Gyro Y UUID is {uuid}")
-                self._data['gy'] = (struct.unpack('<f', bytes(data[0:4]))[-1])
-
-                # Handle data for UUID 12345678-1234-5678-1234-56789abcdef5
-                # Implement specific handling logic here
-
-            elif uuid == '12345678-1234-5678-1234-56789abcdef6':
-                #print(f"Gyro Z UUID is {uuid}")
-                self._data['gz'] = (struct.unpack('<f', bytes(data[0:4]))[-1])
-                # Handle data for UUID 12345678-1234-5678-1234-56789abcdef6
-                # Implement specific handling logic here
-
-            elif uuid == '12345678-1234-5678-1234-56789abcdef7':
-                #print(f"Timestamp UUID is {uuid}")
-                self._data['time'] = struct.unpack('<L', bytes(data[0:4]))[-1]
-                # Handle data for UUID 12345678-1234-5678-1234-56789abcdef7
-                # Implement specific handling logic here
-
-            self.newdata = True
+            decoder = self._decoders.get(sender.handle)
+            if decoder is None:
+                return
+            field, unpack_from = decoder
+            value = unpack_from(data)[0]
+
+            # Only complete frames are handed to the save loop, once each
+            sample = self._assembler.push(field, value)
+            if sample is not None:
+                self.received += 1
+                self._last_sample = sample
+                self._last_arrival = time.time()
+                try:
+                    self._samples.put_nowait(sample)
+                except asyncio.QueueFull:
+                    self.dropped += 1
         except Exception as e:
             print(f"Error handling new data: {e}")
-            self._connected = False
-
-    
-    def save_data(self) -> None:
-        if self._csvout:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-            row = [
-                timestamp,
-                self.calculate_sample_rate(),
-                self._data['time'] / 1000000.0,
-                self._data['ax'],
-                self._data['ay'],
-                self._data['az'],
-                self._data['gx'],
-                self._data['gy'],
-                self._data['gz']
-            ]
-            self.writer.writerow(row)
-            if time.time() - self.start_time > 60:
-                self.create_new_csv()
-                self.start_time = time.time()
-
-
-    def calculate_sample_rate(self):
-        current_time = time.time()
-        self.sample_count += 1
-        elapsed_time = current_time - self.last_sample_time
-        if elapsed_time >= 1.0:
-            samples_per_second = self.sample_count / elapsed_time
-            self.samples_per_second.append(samples_per_second)
-            self.samples_per_second = self.samples_per_second[-10:]
-            self.sample_count = 0
-            self.last_sample_time = current_time
-        if self.samples_per_second:
-            return round(sum(self.samples_per_second) / len(self.samples_per_second), 2)
-        return 0
+            if self._disconnected is not None:
+                self._disconnected.set()
 
+    def packed_hndlr(self, sender, data):
+        try:
+            # One notification carries several samples; decode them as a
+            # single array view and queue it as one item.
+            samples = decode_packed(data)
+            if not len(samples):
+                return
+            self.received += len(samples)
+            self._last_sample = Sample._make(samples[-1].tolist())
+            self._last_arrival = time.time()
+            try:
+                self._samples.put_nowait(samples)
+            except asyncio.QueueFull:
+                self.dropped += len(samples)
+        except Exception as e:
+            print(f"Error handling new data: {e}")
+            if self._disconnected is not None:
+                self._disconnected.set()
+
+    def save_batch(self, batch) -> None:
+        if not self._csvout or self.file is None:
+            return
+        # Queue items are single samples (per-axis path) or sample arrays
+        # (packed path). Consecutive single samples become one record array;
+        # packed arrays already have the record layout and go as they are.
+        rows = []
+        for item in batch:
+            if isinstance(item, Sample):
+                rows.append(item)
+                continue
+            if rows:
+                self.save_records(np.array(rows, dtype=SAMPLE_DTYPE))
+                rows = []
+            self.save_records(item)
+        if rows:
+            self.save_records(np.array(rows, dtype=SAMPLE_DTYPE))
+
+    def save_records(self, records: np.ndarray) -> None:
+        # A sample limit splits the records so every segment holds exactly
+        # that many; time and byte limits are left to the rotation timer
+        room = self._rotation.room(self._segment_samples)
+        while room is not None and len(records) >= room:
+            self.write_records(records[:room])
+            self.create_new_segment()
+            records = records[room:]
+            room = self._rotation.room(0)
+        self.write_records(records)
+
+    def write_records(self, records: np.ndarray) -> None:
+        if not len(records):
+            return
+        self._segment_samples += len(records)
+        if not self.file.anchored:
+            # Wall times in the segment come from the device clock model
+            counter = int(records['time'][0])
+            self.file.anchor(counter, self._clock.wall_time(counter),
+                             1.0 + self._clock.drift_ppm / 1e6)
+        storage.write(self.file, records)
 
     def print_newdata(self) -> None:
         _str = (f"\r Time: {self.data['time']/1000000.0:+3.3f} | " +
@@ -332,7 +570,7 @@ class NanoIMUBLEClient:
                 f"{self.data['gx']:+3.3f}, " +
                 f"{self.data['gy']:+3.3f}, " +
                 f"{self.data['gz']:+3.3f} | " +
-                f"Sample Rate: {self.calculate_sample_rate():+3.2f} Hz")
+                f"Sample Rate: {self._rate.rate:+3.2f} Hz")
         sys.stdout.write(_str)
         sys.stdout.flush()
 
@@ -340,105 +578,46 @@ class NanoIMUBLEClient:
 
     async def discover_characteristics(self):
         if self._connected:
+            self._packed = False
             services = await self._client.get_services()
             for service in services:
                 if service.uuid == self._service_uuid:
                     print(f"Service UUID: {service.uuid}")
                     for characteristic in service.characteristics:
                         print(f"Characteristic UUID: {characteristic.uuid}")
+                        self._layout[characteristic.uuid] = characteristic.handle
+                        if self._allow_packed and characteristic.uuid == PACKED_UUID:
+                            self._packed = True
+            print(f"Notification mode: {'packed' if self._packed else 'per-axis'}")
     
-    def move_file(self, subdirectory_name='forward'):
-
-        subdirectory_name='send_out'
-        file_path = self.file_name
-        
-        # Ensure the file exists
-        if not os.path.isfile(file_path):
-            raise FileNotFoundError(f"The file {file_path} does not exist.")
-        
-        # Get the current directory of the file
-        current_directory = os.path.dirname(file_path)
-        
-        # Define the target subdirectory path
-        target_directory = os.path.join(current_directory, subdirectory_name)
-        
-        # Create the subdirectory if it does not exist
-        if not os.path.exists(target_directory):
-            os.makedirs(target_directory)
-        
-        # Get the base name of the file
-        file_name = os.path.basename(file_path)
-        
-        # Create the full path to the new location
-        new_file_path = os.path.join(target_directory, file_name)
-        
-        # Move the file
-        shutil.move(file_path, new_file_path)
-       
-        self.file = None
-        print(f"File moved to {new_file_path}")
-
-    async def retry_connection(self):
-
-        max_retries = 5
-        retry_delay = 3 
-
-        for attempt in range(max_retries):
-            try:
-                print(f"Retrying connection to {self.address}, attempt {attempt + 1}")
-                await self.client.connect()
-                print(f"Connected to {self.address} on attempt {attempt + 1}")
-
-                services = await self.client.get_services()
-                print(f"Discovered services: {services}")
-                break  
-
-            except Exception as e:
-                print(f"Retry failed: {e}")
-
-                if "failed to discover services" in str(e) or "device disconnected" in str(e):
-                    await self.handle_disconnection()
-
-                await asyncio.sleep(2)
-
-        else:
-            print(f"Failed to connect after {max_retries} attempts.")
+    def log_reconnect_gap(self, gap: float) -> None:
+        # Time from losing the link to the first sample after reconnecting
+        print(f"Reconnect gap: {gap:.2f} s")
+        with open('disconnect_log.txt', 'a') as file:
+            file.write(f"Device: {self._device.address} @ "
+                       f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} | reconnect gap: {gap:.2f} s\n")
 
     def log_disconnect(self):
         # Get the current date and time
         path = 'disconnect_log.txt'
         current_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         device = self._device.address
+        self._assembler.flush()
+        stats = self._assembler.stats()
         # Open the file in append mode and write the current date and time
         with open(path, 'a') as file:
-            file.write("Device: " + str(device) + " @ " + current_datetime + '\n')
-
-    # Function to lock the Bluetooth access
-    def acquire_lock(self,lock_file):
-        file = open(lock_file, "w")
-        fcntl.flock(file, fcntl.LOCK_EX)
-        return file
-
-    # Function to release the lock
-    def release_lock(self,file):
-        fcntl.flock(file, fcntl.LOCK_UN)
-        file.close()
-
-    def is_discovery_in_progress(self,lock_file):
-        file = open(lock_file, "w")
-        try:
-            file.close()
-            return False
-        except BlockingIOError:
-            # Lock is held, discovery is in progress
-            file.close()
-            return True
+            file.write("Device: " + str(device) + " @ " + current_datetime +
+                       f" | complete: {stats['complete']} partial: {stats['partial']}" +
+                       f" duplicates: {stats['duplicates']}" + '\n')
 
 async def run():
     global imu_client
-    imu_client = NanoIMUBLEClient('12345678-1234-5678-1234-56789abcdef0', IMU_UUIDS, True)
+    # Send on what a previous run left open when it died
+    storage.recover()
+    imu_client = NanoIMUBLEClient(IMU_SERVICE_UUID, IMU_UUIDS, True)
     await imu_client.connect()
     await imu_client.disconnect()
+    await imu_client.close()
 
 if __name__ == "__main__":
     loop = asyncio.get_event_loop()
@@ -0,0 +1,61 @@
+import struct
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+# Packed characteristic: each notification carries N consecutive samples,
+# each laid out as uint32 device time (us) followed by ax, ay, az, gx, gy, gz
+# as float32, all little-endian. Older firmware only exposes the seven
+# per-axis characteristics in IMU_UUIDS.
+PACKED_UUID = '12345678-1234-5678-1234-56789abcdef8'
+
+SAMPLE_DTYPE = np.dtype([
+    ("time", "<u4"),
+    ("ax", "<f4"), ("ay", "<f4"), ("az", "<f4"),
+    ("gx", "<f4"), ("gy", "<f4"), ("gz", "<f4"),
+])
+SAMPLE_SIZE = SAMPLE_DTYPE.itemsize
+
+# Per-axis characteristics: UUID -> (sample field, value layout)
+FLOAT32 = struct.Struct('<f')
+UINT32 = struct.Struct('<L')
+AXIS_FORMATS = {
+    '12345678-1234-5678-1234-56789abcdef1': ('ax', FLOAT32),
+    '12345678-1234-5678-1234-56789abcdef2': ('ay', FLOAT32),
+    '12345678-1234-5678-1234-56789abcdef3': ('az', FLOAT32),
+    '12345678-1234-5678-1234-56789abcdef4': ('gx', FLOAT32),
+    '12345678-1234-5678-1234-56789abcdef5': ('gy', FLOAT32),
+    '12345678-1234-5678-1234-56789abcdef6': ('gz', FLOAT32),
+    '12345678-1234-5678-1234-56789abcdef7': ('time', UINT32),
+}
+
+
+def decode_packed(data) -> np.ndarray:
+    """
+    Decode a packed notification into a structured array of samples.
+
+    The array is a view on the notification buffer; no per-sample objects
+    are created. Trailing bytes that do not form a whole sample are ignored.
+
+    :param data: Notification payload (bytes or bytearray).
+    :return: Array of SAMPLE_DTYPE records.
+    """
+    count = len(data) // SAMPLE_SIZE
+    return np.frombuffer(data, dtype=SAMPLE_DTYPE, count=count)
+
+
+def build_decoders(handles: Dict[str, int]) -> Dict[int, Tuple[str, Callable]]:
+    """
+    Build the per-axis dispatch table once, when notifications are started.
+
+    :param handles: Characteristic handle by UUID for the subscribed
+                    characteristics.
+    :return: {handle: (field, unpack_from)} so a notification is decoded
+             with one dict lookup and one precompiled unpack_from call.
+    """
+    table = {}
+    for uuid, handle in handles.items():
+        if uuid in AXIS_FORMATS:
+            field, layout = AXIS_FORMATS[uuid]
+            table[handle] = (field, layout.unpack_from)
+    return table
@@ -0,0 +1,153 @@
+import asyncio
+import sys
+import time
+from typing import List, Optional
+
+from connect import (IMU_SERVICE_UUID, IMU_UUIDS, MIN_RSSI, SCAN_INTERVAL,
+                     SCAN_WINDOW, TARGET_TAG_NAME, NanoIMUBLEClient)
+from adapters import AdapterScheduler
+from claims import ClaimRegistry
+from scanner import ScannerService
+from storage import storage
+from usage import UsageMeter
+
+# Number of sensors one hub process serves (log.py used to start three
+# connect.py processes)
+DEFAULT_SLOTS = 3
+USAGE_REPORT_INTERVAL = 30
+REBALANCE_INTERVAL = 10
+# Seconds before retrying a sensor another process has claimed
+CLAIM_RETRY = 10
+
+
+class SensorHub:
+    """
+    Serve several sensors from a single process.
+
+    One continuous scanner keeps a table of FallSensor advertisements; each
+    sensor that is not already being served is handed to a free slot as
+    soon as it is heard. Every slot runs an ordinary NanoIMUBLEClient
+    session; when the session ends the slot frees up and the device can be
+    picked up again once it advertises.
+
+    :param slots: Maximum number of concurrent sensor sessions.
+    """
+
+    def __init__(self, slots: int = DEFAULT_SLOTS) -> None:
+        self._slots: List[Optional[asyncio.Task]] = [None] * slots
+        self._clients: List[Optional[NanoIMUBLEClient]] = [None] * slots
+        self._scheduler = AdapterScheduler()
+        self._scanner = ScannerService(TARGET_TAG_NAME, self._scheduler.adapters,
+                                       interval=SCAN_INTERVAL, window=SCAN_WINDOW)
+        self._last_rebalance = time.monotonic()
+        self._claims = ClaimRegistry()
+        # Addresses claimed by other processes, with the time we found out
+        self._taken = {}
+        self._usage = UsageMeter()
+        self._last_report = time.monotonic()
+
+    def free_slots(self) -> List[int]:
+        return [i for i, task in enumerate(self._slots) if task is None or task.done()]
+
+    def active_addresses(self) -> set:
+        return {client.device.address for i, client in enumerate(self._clients)
+                if client is not None and client.device is not None
+                and i not in self.free_slots()}
+
+    async def run(self) -> None:
+        while True:
+            free = self.free_slots()
+            # Only scan while a slot is free; scanning is duty-cycled so
+            # open sessions keep streaming
+            if free:
+                await self._scanner.start()
+            else:
+                await self._scanner.stop()
+            if free:
+                active = self.active_addresses()
+                now = time.monotonic()
+                # Forget claims old enough to be retried, so the table only
+                # holds what is being skipped
+                self._taken = {a: t for a, t in self._taken.items() if now - t < CLAIM_RETRY}
+                skip = active | set(self._taken)
+                for device, rssi in self._scanner.sensors(MIN_RSSI, exclude=skip):
+                    if not free:
+                        break
+                    if not self.start_session(free[0], device):
+                        # Claimed elsewhere or no adapter slot; look again later
+                        self._taken[device.address] = now
+                        continue
+                    print(f"Slot {free.pop(0)}: {device.address} (RSSI: {rssi})")
+            await self.rebalance()
+            self.report_usage()
+            if not free:
+                await asyncio.sleep(1)
+                continue
+            # Wake on the next advertisement, or periodically to notice
+            # sessions that ended
+            try:
+                await asyncio.wait_for(self._scanner.wait_for_update(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    def start_session(self, slot: int, device) -> bool:
+        client = NanoIMUBLEClient(IMU_SERVICE_UUID, IMU_UUIDS, True, scanner=self._scanner,
+                                  claims=self._claims, scheduler=self._scheduler)
+        if not client.assign(device):
+            return False
+        self._clients[slot] = client
+        self._slots[slot] = asyncio.create_task(client.session())
+        return True
+
+    async def rebalance(self) -> None:
+        if time.monotonic() - self._last_rebalance < REBALANCE_INTERVAL:
+            return
+        self._last_rebalance = time.monotonic()
+        links = {}
+        for i, client in enumerate(self._clients):
+            if i in self.free_slots() or client is None or client.device is None:
+                continue
+            if client.connected:
+                links[client.device.address] = client
+        loss = {address: client.link_loss() for address, client in links.items()}
+        for address, _, new in self._scheduler.rebalance(loss, self._scanner.rssi_by_adapter,
+                                                         MIN_RSSI):
+            await links[address].migrate(new)
+
+    def report_usage(self) -> None:
+        if time.monotonic() - self._last_report < USAGE_REPORT_INTERVAL:
+            return
+        self._last_report = time.monotonic()
+        sessions = len(self._slots) - len(self.free_slots())
+        print(f"Hub usage: {self._usage.sample()} sessions: {sessions} "
+              f"adapters: {self._scheduler.load()}")
+
+    async def shutdown(self) -> None:
+        for task in self._slots:
+            if task is not None:
+                task.cancel()
+        for client in self._clients:
+            if client is not None and client.connected:
+                await client.disconnect()
+        await self._scanner.stop()
+        self._claims.release_all()
+
+
+async def run(slots: int) -> None:
+    # Send on what a previous run left open when it died
+    storage.recover()
+    hub = SensorHub(slots)
+    try:
+        await hub.run()
+    finally:
+        await hub.shutdown()
+
+
+if __name__ == "__main__":
+    slots = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SLOTS
+    try:
+        asyncio.run(run(slots))
+    except KeyboardInterrupt:
+        print('\nReceived Keyboard Interrupt')
+    finally:
+        print('Program finished')
@@ -0,0 +1,217 @@
+import fcntl
+import os
+import shutil
+import struct
+import time
+import zlib
+from typing import Callable, Dict, List, Optional
+
+# Journals live next to the open segments, like send_out
+JOURNAL_DIR = "journal"
+JOURNAL_EXT = ".jnl"
+# A journal is started afresh, carrying only the open segments over, once
+# it grows past this size
+JOURNAL_ROTATE_BYTES = 1024 * 1024
+
+# Every record is framed as payload length and CRC32 of the payload, so a
+# torn journal tail is detected and ignored
+FRAME = struct.Struct("<HI")
+OPEN = struct.Struct("<cI")         # b"O", segment id, then the path
+COMMIT = struct.Struct("<cIQQI")    # b"C", segment id, start, end, CRC32 of [start, end)
+SEAL = struct.Struct("<cI")         # b"S", segment id
+
+
+class Journal:
+    """
+    Append-only record of which segments are open and how far they are
+    known to be written.
+
+    The storage thread commits every segment it flushed: the byte range
+    written since the previous commit and its CRC32. The journal file is
+    exclusively flocked for as long as the process lives, so recovery can
+    tell journals of crashed processes from those of running ones. Its size
+    is bounded by rotation: once it grows past JOURNAL_ROTATE_BYTES a new
+    one is started with just the open segments and their last commit.
+
+    :param directory: Directory the journal files are kept in.
+    """
+
+    def __init__(self, directory: str = JOURNAL_DIR) -> None:
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._ids: Dict[object, int] = {}
+        self._last_commit: Dict[int, bytes] = {}
+        self._next_id = 0
+        self._file = None
+        self.path = None
+        self._new_file()
+
+    def _new_file(self) -> None:
+        path = os.path.join(self._directory, f"{os.getpid()}_{time.time_ns()}{JOURNAL_EXT}")
+        # Locked under a name recover() ignores and only then put in place, so
+        # recover() never sees this journal unlocked and removes it
+        file = open(path + ".tmp", "ab")
+        fcntl.flock(file, fcntl.LOCK_EX)
+        os.rename(file.name, path)
+        old, self._file = self._file, file
+        old_path, self.path = self.path, path
+        if old is None:
+            return
+        # Carry the open segments over, then drop the old journal
+        for segment, segment_id in self._ids.items():
+            self._append(OPEN.pack(b"O", segment_id) + os.path.abspath(segment.path).encode())
+            if segment_id in self._last_commit:
+                self._append(self._last_commit[segment_id])
+        self.sync()
+        os.unlink(old_path)
+        old.close()
+
+    def _append(self, payload: bytes) -> None:
+        self._file.write(FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+
+    def open(self, segment) -> None:
+        segment_id = self._next_id
+        self._next_id += 1
+        self._ids[segment] = segment_id
+        self._append(OPEN.pack(b"O", segment_id) + os.path.abspath(segment.path).encode())
+        self._file.flush()
+
+    def commit(self, segment) -> None:
+        """
+        Record what was written to a segment since its last commit. Call
+        after the segment's data was flushed to the OS.
+        """
+        segment_id = self._ids.get(segment)
+        block = segment.commit()
+        if segment_id is None or block is None:
+            return
+        record = COMMIT.pack(b"C", segment_id, *block)
+        self._last_commit[segment_id] = record
+        self._append(record)
+
+    def seal(self, segment) -> None:
+        segment_id = self._ids.pop(segment, None)
+        if segment_id is None:
+            return
+        self._last_commit.pop(segment_id, None)
+        self._append(SEAL.pack(b"S", segment_id))
+        self._file.flush()
+
+    def sync(self, fsync: bool = False) -> None:
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+        if self._file.tell() > JOURNAL_ROTATE_BYTES:
+            self._new_file()
+
+    def close(self) -> None:
+        # A journal with nothing open has nothing to recover
+        self.sync()
+        if not self._ids:
+            os.unlink(self.path)
+        self._file.close()
+
+
+def read_journal(path: str) -> Dict[int, dict]:
+    """
+    :return: Segments opened in the journal and not sealed, by id, each
+             with its path and list of (start, end, crc) commits.
+    """
+    segments = {}
+    with open(path, "rb") as file:
+        data = file.read()
+    offset = 0
+    while offset + FRAME.size <= len(data):
+        length, crc = FRAME.unpack_from(data, offset)
+        payload = data[offset + FRAME.size:offset + FRAME.size + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            break  # torn tail
+        offset += FRAME.size + length
+        kind = payload[:1]
+        if kind == b"O":
+            _, segment_id = OPEN.unpack_from(payload)
+            segments[segment_id] = {"path": payload[OPEN.size:].decode(), "commits": []}
+        elif kind == b"C":
+            _, segment_id, start, end, block_crc = COMMIT.unpack(payload)
+            if segment_id in segments:
+                segments[segment_id]["commits"].append((start, end, block_crc))
+        elif kind == b"S":
+            segments.pop(SEAL.unpack(payload)[1], None)
+    return segments
+
+
+def valid_length(path: str, commits: List[tuple]) -> int:
+    """
+    Find the end of the last commit whose bytes are on disk intact. Only the
+    newest blocks are read; normally the last one checks out.
+
+    :return: Number of bytes of the file to keep.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        for start, end, crc in reversed(commits):
+            if end > size:
+                continue
+            file.seek(start)
+            if zlib.crc32(file.read(end - start)) == crc:
+                return end
+    return 0
+
+
+def move_to(path: str, target: str) -> str:
+    new_path = os.path.join(target, os.path.basename(path))
+    shutil.move(path, new_path)
+    return new_path
+
+
+def recover(directory: str = JOURNAL_DIR, send_out: str = "send_out",
+            finish: Callable[[str, str], str] = move_to) -> List[str]:
+    """
+    Seal the segments left open by processes that died.
+
+    Journals still locked belong to running processes and are skipped. For
+    every other one, each unsealed segment is cut back to its last intact
+    commit and moved to send_out (relative to the segment's directory), or
+    removed if nothing in it was committed. The journal is deleted after.
+
+    :param finish: Called with a recovered segment and the send_out path to
+                   put it there; returns the new path.
+    :return: Paths the recovered segments were moved to.
+    """
+    recovered = []
+    if not os.path.isdir(directory):
+        return recovered
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(JOURNAL_EXT):
+            continue
+        path = os.path.join(directory, name)
+        with open(path, "ab") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            for segment in read_journal(path).values():
+                moved = recover_segment(segment["path"], segment["commits"], send_out, finish)
+                if moved is not None:
+                    recovered.append(moved)
+            os.unlink(path)
+    return recovered
+
+
+def recover_segment(path: str, commits: List[tuple], send_out: str,
+                    finish: Callable[[str, str], str] = move_to) -> Optional[str]:
+    if not os.path.isfile(path):
+        # Sealed and moved before the seal record made it to the journal
+        return None
+    keep = valid_length(path, commits)
+    if keep == 0:
+        os.remove(path)
+        return None
+    with open(path, "r+b") as file:
+        file.truncate(keep)
+        os.fsync(file.fileno())
+    target = os.path.join(os.path.dirname(path), send_out)
+    os.makedirs(target, exist_ok=True)
+    new_path = finish(path, target)
+    print(f"Recovered {path}: {keep} bytes -> {new_path}")
+    return new_path
@@ -1,24 +1,36 @@
 import subprocess
+import sys
 import time
 import threading
 
+from usage import UsageMeter
+
 # Define the two scripts you want to run
 SCRIPT_1 = "python connect.py"
 SCRIPT_2 = "python connect.py"
 SCRIPT_3 = "python connect.py"
 
+# Hub mode serves all sensors from one process instead (python log.py hub)
+HUB_SCRIPT = "python hub.py 3"
+
+USAGE_REPORT_INTERVAL = 30
+
+# Process ids of the scripts currently running, by script name
+running = {}
+
 # Function to run a script, poll its status, and restart it if it exits
 def monitor_script(command, script_name):
     while True:
         print(f"Starting {script_name}...")
-        process = subprocess.Popen(command, shell=True)
+        process = subprocess.Popen(command.split())
+        running[script_name] = process.pid
 
         # Poll the process to check if it's still running
         while True:
             ret_code = process.poll()
             if ret_code is None:
                 # Script is still running
-               pass 
+               pass
             else:
                 # Script has exited, restart it
                 print(f"{script_name} has exited with return code {ret_code}. Restarting in 3 seconds...")
@@ -28,19 +40,33 @@ def monitor_script(command, script_name):
         # Wait for 3 seconds before restarting
         time.sleep(1)
 
+# Print combined memory and CPU of the running scripts so the
+# three-process and hub setups can be compared
+def report_usage():
+    meter = UsageMeter([])
+    while True:
+        time.sleep(USAGE_REPORT_INTERVAL)
+        pids = sorted(running.values())
+        if pids != meter.pids:
+            # A script restarted; start measuring again from here
+            meter = UsageMeter(pids)
+            continue
+        print(f"Script usage: {meter.sample()}")
+
 # Run both scripts in parallel using threading
 if __name__ == "__main__":
-    thread1 = threading.Thread(target=monitor_script, args=(SCRIPT_1, "Script 1"))
-    thread2 = threading.Thread(target=monitor_script, args=(SCRIPT_2, "Script 2"))
-    thread3 = threading.Thread(target=monitor_script, args=(SCRIPT_3, "Script 3"))
+    if len(sys.argv) > 1 and sys.argv[1] == "hub":
+        scripts = [(HUB_SCRIPT, "Hub")]
+    else:
+        scripts = [(SCRIPT_1, "Script 1"), (SCRIPT_2, "Script 2"), (SCRIPT_3, "Script 3")]
+
+    threads = [threading.Thread(target=monitor_script, args=args) for args in scripts]
+    threads.append(threading.Thread(target=report_usage, daemon=True))
 
     # Start both threads
-    thread1.start()
-    thread2.start()
-    thread3.start()
+    for thread in threads:
+        thread.start()
 
     # Wait for both threads to finish (this never happens because of the infinite while loop)
-    thread1.join()
-    thread2.join()
-    thread3.join()
- 
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,154 @@
+from typing import Dict, Optional
+
+# The firmware time characteristic is a uint32 microsecond counter
+COUNTER_WRAP = 1 << 32
+# Deltas used to learn the nominal sample period before gaps are judged
+WARMUP_SAMPLES = 32
+# Gap histogram buckets, as upper bounds on the number of missing samples
+GAP_BUCKETS = (1, 2, 4, 8, 16, 64, 256)
+# A counter going back further than this means the sensor restarted
+RESET_US = 1000000
+# A counter wraps only from just below 2^32 to just above 0; the longest
+# gap, reconnects included, that is still read as a wrap
+WRAP_GAP_US = 60000000
+# Samples a loss window has to expect before its ratio is reported
+WINDOW_SAMPLES = 200
+
+
+class LossTracker:
+    """
+    Account for lost and duplicated samples using the firmware counter.
+
+    The counter is unwrapped into a monotonic 64-bit time. The nominal
+    sample period is learnt from the median of the first deltas and then
+    follows slow drift, so a delta of k periods means k - 1 samples were lost.
+    Gaps are counted in a histogram by the number of missing samples.
+    """
+
+    def __init__(self) -> None:
+        self._last: Optional[int] = None
+        self._offset = 0
+        self._period: Optional[float] = None
+        self._warmup = []
+        self.received = 0
+        self.expected = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.wraps = 0
+        self.resets = 0
+        self.gaps = [0] * (len(GAP_BUCKETS) + 1)
+        # Totals at the start of the current window()
+        self._window_lost = 0
+        self._window_expected = 0
+
+    @property
+    def period_us(self) -> Optional[float]:
+        return self._period
+
+    def unwrap(self, counter: int) -> int:
+        """
+        :param counter: Raw uint32 device time in microseconds.
+        :return: Device time extended past wraparound.
+        """
+        t = counter + self._offset
+        # Any other backward jump, e.g. a reboot from far below 2^32, is
+        # left to observe() to count as a reset
+        if (self._last is not None and t < self._last
+                and t + COUNTER_WRAP - self._last <= WRAP_GAP_US):
+            self._offset += COUNTER_WRAP
+            self.wraps += 1
+            t += COUNTER_WRAP
+        return t
+
+    def observe(self, counter: int) -> int:
+        """
+        Account for one received sample.
+
+        :param counter: Raw uint32 device time in microseconds.
+        :return: Unwrapped device time of the sample.
+        """
+        t = self.unwrap(counter)
+        self.received += 1
+        last = self._last
+        if last is None:
+            self._last = t
+            self.expected += 1
+            return t
+        delta = t - last
+        if delta == 0:
+            self.duplicates += 1
+            return t
+        if delta < 0:
+            if -delta > RESET_US:
+                self.resets += 1
+                self.expected += 1
+                self._last = t
+            else:
+                self.reordered += 1
+            return t
+        self._last = t
+
+        if self._period is None:
+            self.expected += 1
+            self._warmup.append(delta)
+            if len(self._warmup) >= WARMUP_SAMPLES:
+                self._warmup.sort()
+                self._period = float(self._warmup[len(self._warmup) // 2])
+                self._warmup = []
+            return t
+
+        steps = max(1, round(delta / self._period))
+        self.expected += steps
+        if steps == 1:
+            # Follow slow clock drift on regular deltas only
+            self._period += (delta - self._period) / 256.0
+        else:
+            missing = steps - 1
+            self.lost += missing
+            for i, bound in enumerate(GAP_BUCKETS):
+                if missing <= bound:
+                    self.gaps[i] += 1
+                    break
+            else:
+                self.gaps[-1] += 1
+        return t
+
+    def window(self) -> Optional[float]:
+        """
+        :return: Fraction of samples lost since the previous window, which
+                 ends here, or None if fewer than WINDOW_SAMPLES were expected
+                 meanwhile (the window then keeps running).
+        """
+        expected = self.expected - self._window_expected
+        if expected < WINDOW_SAMPLES:
+            return None
+        lost = self.lost - self._window_lost
+        self._window_lost = self.lost
+        self._window_expected = self.expected
+        return lost / expected
+
+    def restart_window(self) -> None:
+        # Start the window here, e.g. after the gap of a reconnect
+        self._window_lost = self.lost
+        self._window_expected = self.expected
+
+    def counters(self) -> Dict[str, float]:
+        counters = {
+            "samples_received_total": self.received,
+            "samples_expected_total": self.expected,
+            "samples_lost_total": self.lost,
+            "samples_duplicate_total": self.duplicates,
+            "samples_reordered_total": self.reordered,
+            "counter_wraps_total": self.wraps,
+            "counter_resets_total": self.resets,
+            "loss_ratio": round(self.lost / self.expected, 6) if self.expected else 0,
+        }
+        if self._period is not None:
+            counters["sample_period_us"] = round(self._period, 1)
+        lower = 1
+        for bound, count in zip(GAP_BUCKETS, self.gaps):
+            counters[f"gaps_missing_{lower}_{bound}_total"] = count
+            lower = bound + 1
+        counters[f"gaps_missing_{lower}_plus_total"] = self.gaps[-1]
+        return counters
@@ -0,0 +1,149 @@
+import atexit
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+# node_exporter's textfile collector can be pointed at this directory; on
+# tmpfs, so rewriting the file every WRITE_INTERVAL never touches the SD card
+METRICS_DIR = ("/dev/shm/fallyx_metrics" if os.path.isdir("/dev/shm")
+               else "/tmp/fallyx_metrics")
+WRITE_INTERVAL = 10
+
+
+class Metrics:
+    """
+    Collect counters from the running clients and export them as a
+    Prometheus text file.
+
+    Sources are callables returning a dict of metric name to value; they are
+    only called when the file is written, so nothing is computed per sample.
+    The text is rendered by the caller and written by a worker thread, so
+    the event loop never waits for the file system. Each process writes its
+    own file, removed again on a clean exit. Nothing is created on disk
+    before the first write, so importing the module has no side effects.
+
+    :param directory: Directory the .prom file is written to.
+    """
+
+    def __init__(self, directory: str = METRICS_DIR) -> None:
+        self._directory = directory
+        self._path = os.path.join(directory, f"gateway_{os.getpid()}.prom")
+        self._sources: Dict[tuple, Callable[[], Dict[str, float]]] = {}
+        self._last_write = 0.0
+        # Created on the first write
+        self._writer = None
+        self._pending = None
+
+    def register(self, device: str, source: Callable[[], Dict[str, float]]) -> None:
+        self._sources[(device, source)] = source
+
+    def unregister(self, device: str, source: Callable[[], Dict[str, float]]) -> None:
+        self._sources.pop((device, source), None)
+
+    def render(self) -> str:
+        lines = []
+        for (device, _), source in list(self._sources.items()):
+            for name, value in source().items():
+                lines.append(f'fallyx_{name}{{device="{device}"}} {value}')
+        lines.sort()
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> None:
+        # Skipped while the previous write is still in progress
+        self._last_write = time.monotonic()
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics")
+            atexit.register(self.remove)
+        if self._pending is None or self._pending.done():
+            self._pending = self._writer.submit(self._write, self.render())
+
+    def _write(self, text: str) -> None:
+        tmp = self._path + ".tmp"
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            with open(tmp, "w") as file:
+                file.write(text)
+            # Readers never see a half-written file
+            os.replace(tmp, self._path)
+        except OSError as e:
+            print(f"Cannot write metrics to {self._path}: {e}")
+
+    def maybe_write(self, interval: float = WRITE_INTERVAL) -> None:
+        if time.monotonic() - self._last_write >= interval:
+            self.write()
+
+    def remove(self) -> None:
+        if self._writer is not None:
+            self._writer.shutdown()
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+
+class RateEstimator:
+    """
+    Sample rate over a sliding window, in constant time per update.
+
+    Samples are counted into one bucket per second of arrival (monotonic)
+    time; the window total is kept up to date as buckets roll over, so
+    reading the rate never rescans history. The bucket still filling is left
+    out. Keyed to arrival rather than device time, the rate falls when a link
+    stalls and is not thrown off when the sensor's counter jumps.
+
+    :param window: Seconds of history the rate is averaged over.
+    """
+
+    def __init__(self, window: int = 10) -> None:
+        self._window = window
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget the history, e.g. when the link or the sensor restarted."""
+        self._counts = [0] * self._window
+        self._total = 0
+        self._second = None
+        self._first = None
+
+    def _roll(self, second: int) -> None:
+        if self._second is None:
+            self._second = self._first = second
+        elif second > self._second:
+            # Clear the buckets rolling out of the window; at most one pass
+            for s in range(self._second + 1, min(second, self._second + self._window) + 1):
+                i = s % self._window
+                self._total -= self._counts[i]
+                self._counts[i] = 0
+            self._second = second
+
+    def observe(self, n: int = 1, now: float = None) -> None:
+        """
+        :param n: Number of samples that arrived.
+        :param now: Arrival time, time.monotonic() by default.
+        """
+        self._roll(int(time.monotonic() if now is None else now))
+        self._counts[self._second % self._window] += n
+        self._total += n
+
+    def rate_at(self, now: float = None) -> float:
+        """
+        :param now: Time to read the rate at, time.monotonic() by default.
+        :return: Samples per second over the complete buckets in the window.
+        """
+        if self._second is None:
+            return 0.0
+        self._roll(int(time.monotonic() if now is None else now))
+        complete = min(self._second - self._first, self._window - 1)
+        if complete <= 0:
+            return 0.0
+        current = self._counts[self._second % self._window]
+        return round((self._total - current) / complete, 2)
+
+    @property
+    def rate(self) -> float:
+        return self.rate_at()
+
+
+# One registry per process, shared by all clients in it
+metrics = Metrics()
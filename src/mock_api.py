@@ -0,0 +1,145 @@
+"""
+Local stand-in for the /inference endpoint.
+
+Accepts the JSON send_to_api.py posts (plain or with a gzip / zstd
+Content-Encoding, with a Content-Length or chunked), answers 200 and records how many samples arrived and how old each one was on arrival (receive time minus its
+Timestamp). Used by bench_capacity.py; can also be run on its own:
+
+    python mock_api.py 5000
+    FALLYX_API_URL=http://127.0.0.1:5000/inference python send_to_api.py
+"""
+import json
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+import numpy as np
+
+from compression import decompress_body
+
+
+class MockAPI:
+    """
+    :param host: Address to listen on.
+    :param port: Port to listen on, 0 for any free port.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+        self._lock = threading.Lock()
+        # Epoch of each whole-second Timestamp prefix seen so far
+        self._seconds: Dict[str, float] = {}
+        self.reset()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/inference"
+
+    def reset(self) -> None:
+        with self._lock:
+            self.uploads = 0
+            self.samples = 0
+            self.bytes = 0
+            self._latencies = []
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def latencies(self) -> np.ndarray:
+        with self._lock:
+            return np.concatenate(self._latencies) if self._latencies else np.empty(0)
+
+    def record(self, body: bytes, received: float, size: int = None) -> int:
+        """
+        :param body: Decoded request body.
+        :param received: Wall time it arrived.
+        :param size: Bytes on the wire, if the body was compressed.
+        :return: Number of samples in it.
+        """
+        data = json.loads(body)
+        stamps = data.get("Timestamp", [])
+        # Timestamps look like 2024-01-01 12:00:00.123456; only the whole
+        # second goes through strptime, once per distinct second
+        wall = np.empty(len(stamps))
+        for i, stamp in enumerate(stamps):
+            prefix = stamp[:19]
+            second = self._seconds.get(prefix)
+            if second is None:
+                second = datetime.strptime(prefix, "%Y-%m-%d %H:%M:%S").timestamp()
+                self._seconds[prefix] = second
+            wall[i] = second + (float(stamp[19:]) if len(stamp) > 19 else 0.0)
+        with self._lock:
+            self.uploads += 1
+            self.samples += len(stamps)
+            self.bytes += len(body) if size is None else size
+            self._latencies.append(received - wall)
+        return len(stamps)
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    body = self._read_chunked()
+                else:
+                    body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                try:
+                    samples = api.record(decompress_body(body, self.headers.get("Content-Encoding")),
+                                         time.time(), len(body))
+                except (ValueError, KeyError) as e:
+                    self._reply(400, {"error": str(e)})
+                    return
+                self._reply(200, {"status": "ok", "samples": samples})
+
+            def _read_chunked(self) -> bytes:
+                # Chunk size in hex, CRLF, the chunk, CRLF; a zero size ends
+                # the body, followed by optional trailers and an empty line
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    if size == 0:
+                        break
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                return b"".join(chunks)
+
+            def _reply(self, status: int, payload: dict) -> None:
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    api = MockAPI(port=port)
+    print(f"Listening on {api.url}")
+    api.start()
+    try:
+        while True:
+            time.sleep(10)
+            latencies = api.latencies()
+            p50 = np.percentile(latencies, 50) if latencies.size else 0
+            print(f"uploads: {api.uploads} samples: {api.samples} p50 latency: {p50:.1f} s")
+    except KeyboardInterrupt:
+        api.stop()
@@ -0,0 +1,130 @@
+"""
+Streaming encoder for the /inference request body.
+
+The API takes one JSON object per segment, column by column:
+
+    {"Location": ..., "Timestamp": [...], "Ax": [...], ..., "Gz": [...]}
+
+json_body() produces it as a sequence of byte chunks, read straight from the
+segment or CSV file and handed to requests as the request body (sent with
+chunked Transfer-Encoding). Each column is one pass over the file in
+chunks of CHUNK_SAMPLES records, decoded and formatted as numpy columns a
+chunk at a time, so memory stays the same however long the segment is and
+no JSON file is written to send_out.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from clocksync import TimestampFormatter
+from compression import open_compressed, strip_extension
+from segments import SEGMENT_EXT, SegmentStream
+
+# Values per yielded chunk
+CHUNK_SAMPLES = 4096
+# JSON key, segment record field and CSV column of each axis
+AXES = [("Ax", "ax", 3), ("Ay", "ay", 4), ("Az", "az", 5),
+        ("Gx", "gx", 6), ("Gy", "gy", 7), ("Gz", "gz", 8)]
+
+Column = Tuple[str, Callable[[], Iterator[list]]]
+
+
+def encode(location: Optional[str], columns: List[Column]) -> Iterator[bytes]:
+    """
+    :param location: Value of "Location".
+    :param columns: (key, function returning the column's values as lists)
+                    for every column, in order.
+    :return: The JSON object, compact, in chunks.
+    """
+    yield ('{"Location":' + json.dumps(location)).encode()
+    for key, values in columns:
+        yield f',"{key}":['.encode()
+        separator = ""
+        for chunk in values():
+            if chunk:
+                yield (separator + json.dumps(chunk, separators=(",", ":"))[1:-1]).encode()
+                separator = ","
+        yield b"]"
+    yield b"}"
+
+
+def _chunked(values: Iterable, size: int = CHUNK_SAMPLES) -> Iterator[list]:
+    values = iter(values)
+    while True:
+        chunk = list(itertools.islice(values, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def segment_body(path: str) -> Optional[Iterator[bytes]]:
+    """
+    :param path: Binary segment (.seg, .seg.gz, .seg.zst).
+    :return: Body chunks, or None if the segment holds no samples.
+    :raises ValueError: If the file is not a segment.
+    """
+    if os.path.getsize(path) == 0:
+        return None  # never written to
+    stream = SegmentStream(path)
+    if next(stream.chunks(1), None) is None:
+        return None
+
+    def timestamps() -> Iterator[list]:
+        stamp = TimestampFormatter()
+        for records in stream.chunks(CHUNK_SAMPLES):
+            yield [stamp.format(wall) for wall in stream.wall_times(records).tolist()]
+
+    def axis(field: str) -> Callable[[], Iterator[list]]:
+        return lambda: (records[field].tolist() for records in stream.chunks(CHUNK_SAMPLES))
+
+    return encode(stream.location, [("Timestamp", timestamps)] +
+                  [(key, axis(field)) for key, field, _ in AXES])
+
+
+def _csv_rows(path: str, report: bool = False) -> Iterator[Tuple[str, List[float]]]:
+    # Samples of a CSV segment as (timestamp, axis values); rows that do not
+    # parse are skipped
+    with io.TextIOWrapper(open_compressed(path), newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # location
+        next(reader, None)  # header
+        for row in reader:
+            try:
+                yield row[0], [float(row[column]) for _, _, column in AXES]
+            except (ValueError, IndexError) as e:
+                if report:
+                    print(f"Skipping row due to error: {e}")
+
+
+def csv_body(path: str) -> Optional[Iterator[bytes]]:
+    """
+    :param path: CSV segment (.csv, .csv.gz, .csv.zst) with the location
+                 row, the header row, then samples.
+    :return: Body chunks, or None if the location or header row is missing.
+    """
+    with io.TextIOWrapper(open_compressed(path), newline='') as file:
+        reader = csv.reader(file)
+        location_row = next(reader, None)
+        if location_row is None or next(reader, None) is None:
+            return None
+
+    def timestamps() -> Iterator[list]:
+        return _chunked(stamp for stamp, _ in _csv_rows(path, report=True))
+
+    def axis(index: int) -> Callable[[], Iterator[list]]:
+        return lambda: _chunked(values[index] for _, values in _csv_rows(path))
+
+    return encode(location_row[0], [("Timestamp", timestamps)] +
+                  [(key, axis(i)) for i, (key, _, _) in enumerate(AXES)])
+
+
+def json_body(path: str) -> Optional[Iterator[bytes]]:
+    """
+    :return: Body chunks for a segment or CSV file, or None if it is empty.
+    """
+    if strip_extension(path).endswith(SEGMENT_EXT):
+        return segment_body(path)
+    return csv_body(path)
@@ -0,0 +1,98 @@
+from typing import Dict
+
+import numpy as np
+
+AXES = ("ax", "ay", "az", "gx", "gy", "gz")
+
+
+class SampleRing:
+    """
+    Fixed-size in-memory history of the most recent samples of one device.
+
+    Columns are preallocated: an int64 device time (unwrapped microseconds)
+    and one float32 array per axis. Every sample is written twice, at i and
+    at i + capacity, so the latest n samples are always one contiguous slice
+    and windows are returned as views without copying. Memory use is
+    2 * capacity * 32 bytes, fixed at construction.
+
+    :param capacity: Number of samples kept.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._time = np.zeros(2 * capacity, dtype=np.int64)
+        self._axes = {axis: np.zeros(2 * capacity, dtype=np.float32) for axis in AXES}
+        self._head = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return self._time.nbytes + sum(a.nbytes for a in self._axes.values())
+
+    def append(self, t: int, ax: float, ay: float, az: float,
+               gx: float, gy: float, gz: float) -> None:
+        i = self._head
+        j = i + self.capacity
+        self._time[i] = self._time[j] = t
+        for axis, value in zip(AXES, (ax, ay, az, gx, gy, gz)):
+            column = self._axes[axis]
+            column[i] = column[j] = value
+        self._head = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def extend(self, times, samples) -> None:
+        """
+        Append a batch.
+
+        :param times: Unwrapped device times, one per sample.
+        :param samples: Structured array with the AXES fields.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        n = len(times)
+        if n > self.capacity:
+            times, samples, n = times[-self.capacity:], samples[-self.capacity:], self.capacity
+        start = self._head
+        first = min(n, self.capacity - start)
+        for lo, hi, src in ((start, start + first, slice(0, first)),
+                            (0, n - first, slice(first, n))):
+            if hi <= lo:
+                continue
+            self._time[lo:hi] = times[src]
+            self._time[lo + self.capacity:hi + self.capacity] = times[src]
+            for axis in AXES:
+                column = self._axes[axis]
+                column[lo:hi] = samples[axis][src]
+                column[lo + self.capacity:hi + self.capacity] = samples[axis][src]
+        self._head = (start + n) % self.capacity
+        self._count = min(self._count + n, self.capacity)
+
+    def last(self, n: int) -> Dict[str, np.ndarray]:
+        """
+        :param n: Number of samples wanted; capped at what is stored.
+        :return: Read-only views {"time": ..., "ax": ..., ...}, oldest first.
+                 They are overwritten as new samples arrive; copy to keep.
+        """
+        n = min(n, self._count)
+        end = self._head + self.capacity
+        window = slice(end - n, end)
+        views = {"time": self._time[window]}
+        for axis in AXES:
+            views[axis] = self._axes[axis][window]
+        for view in views.values():
+            view.flags.writeable = False
+        return views
+
+    def since(self, seconds: float) -> Dict[str, np.ndarray]:
+        """
+        :param seconds: Length of history wanted, in device time.
+        :return: Views over the samples of the last `seconds`, as for last().
+        """
+        everything = self.last(self._count)
+        times = everything["time"]
+        if not len(times):
+            return everything
+        start = np.searchsorted(times, times[-1] - int(seconds * 1e6), side="left")
+        return {name: view[start:] for name, view in everything.items()}
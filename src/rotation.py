@@ -0,0 +1,97 @@
+import asyncio
+import math
+import time
+from typing import Callable, Optional, Set
+
+# Seconds between checks of the byte limit; time boundaries are waited for
+# exactly
+CHECK_INTERVAL = 1.0
+
+
+class RotationPolicy:
+    """
+    When a segment is sealed and the next one started.
+
+    :param interval: Segment length in seconds, 0 for no time limit.
+    :param align: End segments on wall-clock multiples of interval (e.g.
+                  every :00 for 60 s), so all devices rotate together.
+    :param max_samples: Samples per segment, 0 for no limit.
+    :param max_bytes: Bytes per segment, 0 for no limit.
+    """
+
+    def __init__(self, interval: float = 60, align: bool = True, max_samples: int = 0,
+                 max_bytes: int = 0) -> None:
+        self.interval = interval
+        self.align = align
+        self.max_samples = max_samples
+        self.max_bytes = max_bytes
+
+    def deadline(self, opened: float) -> float:
+        """
+        :param opened: Wall time the segment was started.
+        :return: Wall time it is due to be sealed.
+        """
+        if not self.interval:
+            return math.inf
+        if self.align:
+            return (math.floor(opened / self.interval) + 1) * self.interval
+        return opened + self.interval
+
+    def room(self, samples: int) -> Optional[int]:
+        """
+        :return: Samples that still fit in a segment holding `samples`, or
+                 None without a sample limit.
+        """
+        if not self.max_samples:
+            return None
+        return max(self.max_samples - samples, 0)
+
+    def expired(self, opened: float, nbytes: int, now: float) -> bool:
+        return now >= self.deadline(opened) or bool(self.max_bytes and nbytes >= self.max_bytes)
+
+
+class Rotator:
+    """
+    Timer that rotates open segments, so a segment ends on time even if its
+    sensor goes quiet.
+
+    Each registered check is called with the current wall time, rotates its
+    segment if due and returns when it next needs to be called. The timer
+    sleeps until the earliest of those, or CHECK_INTERVAL for size limits.
+    """
+
+    def __init__(self, check_interval: float = CHECK_INTERVAL) -> None:
+        self._check_interval = check_interval
+        self._checks: Set[Callable[[float], float]] = set()
+        self._task = None
+        self._wake = None
+
+    def add(self, check: Callable[[float], float]) -> None:
+        self._checks.add(check)
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wake.set()
+
+    def discard(self, check: Callable[[float], float]) -> None:
+        self._checks.discard(check)
+
+    async def _run(self) -> None:
+        while self._checks:
+            now = time.time()
+            due = now + self._check_interval
+            for check in list(self._checks):
+                try:
+                    due = min(due, check(now))
+                except Exception as e:
+                    print(f"Rotation failed: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(due - time.time(), 0.01))
+            except asyncio.TimeoutError:
+                pass
+
+
+# One timer per process, shared by all clients in it
+rotator = Rotator()
@@ -0,0 +1,199 @@
+import asyncio
+import time
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from scanwindow import scan_window
+from transport import BleakScanner
+
+
+class SeenDevice:
+    __slots__ = ("device", "rssi", "last_seen", "heard")
+
+    def __init__(self, device, rssi: int, last_seen: float) -> None:
+        self.device = device
+        self.rssi = rssi
+        self.last_seen = last_seen
+        # adapter -> (rssi, last seen)
+        self.heard: Dict[str, Tuple[int, float]] = {}
+
+
+class ScannerService:
+    """
+    Long-lived scanner keeping a live table of sensor advertisements.
+
+    Scanning runs continuously with a detection callback (as in
+    misc-scripts/multi-connection/scanner.py), one scanner per adapter.
+    Every advertisement from a device named `name` updates its row (device,
+    RSSI, last seen, and the RSSI each adapter heard it at), so connectors
+    can look up a sensor immediately instead of running their own scan
+    window.
+
+    Scanning can be duty-cycled: the radio scans for `window` seconds out of
+    every `interval` and is left to the open connections the rest of the
+    time, so their notifications keep flowing while new sensors are found.
+
+    :param name: Advertised local name to track, e.g. 'FallSensor'.
+    :param adapters: HCI adapters to scan on.
+    :param max_age: Seconds after which a silent device drops out of the table.
+    :param interval: Seconds from the start of one scan window to the next.
+    :param window: Seconds scanned per interval; None scans continuously.
+    """
+
+    def __init__(self, name: str, adapters: Sequence[str] = ("hci0",),
+                 max_age: float = 10.0, interval: float = None,
+                 window: float = None) -> None:
+        self._name = name
+        self._adapters = list(adapters)
+        self._max_age = max_age
+        self._interval = interval
+        self._window = window
+        self._table: Dict[str, SeenDevice] = {}
+        # address -> adapter -> device object as last reported on that
+        # adapter; kept after forget() so reconnects need no scan
+        self._devices: Dict[str, Dict[str, object]] = {}
+        self._scanners = {}
+        self._cycle = None
+        self._updated = asyncio.Event()
+
+    @property
+    def scanning(self) -> bool:
+        return bool(self._scanners) or self._cycle is not None
+
+    @property
+    def duty_cycled(self) -> bool:
+        return (self._window is not None and self._interval is not None
+                and self._window < self._interval)
+
+    async def start(self) -> None:
+        if not self.duty_cycled:
+            await self.radio_on()
+        elif self._cycle is None:
+            self._cycle = asyncio.create_task(self.duty_cycle())
+
+    async def stop(self) -> None:
+        if self._cycle is not None:
+            self._cycle.cancel()
+            self._cycle = None
+        await self.radio_off()
+
+    async def duty_cycle(self) -> None:
+        try:
+            while True:
+                await self.radio_on()
+                await asyncio.sleep(self._window)
+                await self.radio_off()
+                await asyncio.sleep(self._interval - self._window)
+        except asyncio.CancelledError:
+            await self.radio_off()
+            raise
+
+    async def radio_on(self) -> None:
+        if not self._scanners:
+            # Let connectors in other processes know a scan window is open
+            scan_window.begin()
+        for adapter in self._adapters:
+            if adapter in self._scanners:
+                continue
+            scanner = BleakScanner(detection_callback=partial(self.detection_hndlr, adapter),
+                                   adapter=adapter)
+            try:
+                await scanner.start()
+            except Exception as e:
+                print(f"Starting scanner on {adapter} failed: {e}")
+                continue
+            self._scanners[adapter] = scanner
+        if not self._scanners:
+            scan_window.end()
+
+    async def radio_off(self) -> None:
+        for adapter, scanner in list(self._scanners.items()):
+            try:
+                await scanner.stop()
+            except Exception as e:
+                print(f"Stopping scanner on {adapter} failed: {e}")
+            del self._scanners[adapter]
+        if scan_window.scanning:
+            scan_window.end()
+
+    def detection_hndlr(self, adapter: str, device, advertisement_data) -> None:
+        name = advertisement_data.local_name or device.name
+        if name != self._name:
+            return
+        seen = self._table.get(device.address)
+        now = time.monotonic()
+        rssi = advertisement_data.rssi
+        if seen is None:
+            seen = self._table[device.address] = SeenDevice(device, rssi, now)
+        seen.heard[adapter] = (rssi, now)
+        seen.device = device
+        self._devices.setdefault(device.address, {})[adapter] = device
+        seen.last_seen = now
+        # Best RSSI over the adapters that heard it recently
+        cutoff = now - self._max_age
+        seen.rssi = max(r for r, t in seen.heard.values() if t >= cutoff)
+        self._updated.set()
+
+    def rssi_by_adapter(self, address: str) -> Dict[str, int]:
+        """
+        :return: Latest RSSI per adapter that recently heard the device.
+        """
+        seen = self._table.get(address)
+        if seen is None:
+            return {}
+        cutoff = time.monotonic() - self._max_age
+        return {adapter: rssi for adapter, (rssi, t) in seen.heard.items() if t >= cutoff}
+
+    def device(self, address: str, adapter: str):
+        """
+        :return: The device object the adapter last reported for address
+                 (a BLEDevice on real hardware), or None if it never heard it.
+        """
+        return self._devices.get(address, {}).get(adapter)
+
+    def forget(self, address: str) -> None:
+        # Called once a device is connected; it stops advertising anyway
+        self._table.pop(address, None)
+
+    def sensors(self, min_rssi: int, exclude: Iterable[str] = ()) -> List[Tuple[object, int]]:
+        """
+        :param min_rssi: Only return devices heard above this RSSI.
+        :param exclude: Addresses to leave out, e.g. already connected ones.
+        :return: List of (device, rssi) tuples, strongest first.
+        """
+        cutoff = time.monotonic() - self._max_age
+        for address in [a for a, s in self._table.items() if s.last_seen < cutoff]:
+            del self._table[address]
+        found = [(s.device, s.rssi) for a, s in self._table.items()
+                 if s.rssi > min_rssi and a not in exclude]
+        found.sort(key=lambda item: item[1], reverse=True)
+        return found
+
+    async def wait_for_sensor(self, min_rssi: int, exclude: Iterable[str] = (),
+                              timeout: Optional[float] = None) -> Optional[Tuple[object, int]]:
+        """
+        Return the strongest matching sensor, waiting for an advertisement
+        if none is in the table yet.
+
+        :return: (device, rssi), or None if the timeout passed first.
+        """
+        exclude = set(exclude)
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            found = self.sensors(min_rssi, exclude)
+            if found:
+                return found[0]
+            self._updated.clear()
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._updated.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    async def wait_for_update(self) -> None:
+        # Wake on the next sensor advertisement
+        self._updated.clear()
+        await self._updated.wait()
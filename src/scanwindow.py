@@ -0,0 +1,153 @@
+import fcntl
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+
+from usage import process_alive
+
+# tmpfs, so checking and updating the flag never touches the SD card
+SHM_PATH = "/dev/shm/fallyx_scan" if os.path.isdir("/dev/shm") else "/tmp/fallyx_scan"
+SLOTS = 64
+
+# Header: number of processes scanning
+HEADER = struct.Struct("<I")
+# One slot per process: pid, scanning
+SLOT = struct.Struct("<iI")
+SIZE = HEADER.size + SLOTS * SLOT.size
+
+
+class ScanWindow:
+    """
+    Tell connector processes when another process is scanning.
+
+    State lives in a small shared memory file mapped into every process.
+    Checking it is a read from the mapping, with no system call, so it can
+    sit on the notification path. Scanners register their windows under an
+    flock on the same file; that only happens when a scan starts or stops,
+    and slots of processes that died are cleared at the same time. The file
+    is only opened on first use, so importing the module creates nothing.
+
+    :param path: Shared memory file.
+    """
+
+    def __init__(self, path: str = SHM_PATH) -> None:
+        self._path = path
+        self._file = None
+        self._map = None
+        self._pid = os.getpid()
+        self._mine = False
+
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None:
+            self._file = open(self._path, "a+b")
+            if os.fstat(self._file.fileno()).st_size < SIZE:
+                with self._locked():
+                    if os.fstat(self._file.fileno()).st_size < SIZE:
+                        self._file.truncate(SIZE)
+            self._map = mmap.mmap(self._file.fileno(), SIZE)
+        return self._map
+
+    @property
+    def any_active(self) -> bool:
+        # True while any process, this one included, is scanning
+        return HEADER.unpack_from(self._mapped(), 0)[0] > 0
+
+    @property
+    def scanning(self) -> bool:
+        # True while this process has a scan window open
+        return self._mine
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def begin(self) -> None:
+        self._set(True)
+
+    def end(self) -> None:
+        self._set(False)
+
+    def _set(self, scanning: bool) -> None:
+        self._mapped()
+        with self._locked():
+            free = None
+            mine = None
+            count = 0
+            for i in range(SLOTS):
+                offset = HEADER.size + i * SLOT.size
+                pid, flag = SLOT.unpack_from(self._map, offset)
+                if pid == self._pid:
+                    mine = offset
+                elif pid and not process_alive(pid):
+                    SLOT.pack_into(self._map, offset, 0, 0)
+                    pid = flag = 0
+                if not pid and free is None:
+                    free = offset
+                elif pid != self._pid:
+                    count += flag
+            offset = mine if mine is not None else free
+            if offset is not None:
+                SLOT.pack_into(self._map, offset, self._pid if scanning else 0, int(scanning))
+                count += int(scanning)
+            self._mine = scanning and offset is not None
+            HEADER.pack_into(self._map, 0, count)
+
+
+class WindowImpact:
+    """
+    Measure what scan windows cost the open connections.
+
+    Each consumer batch is attributed to "scan" or "idle" depending on
+    whether any scan window was open when it was handled. Time spent in each
+    state gives the sample throughput per state; the delay between a
+    sample's modelled device time and its arrival gives notification
+    latency per state.
+    """
+
+    def __init__(self) -> None:
+        self._last = None
+        self._scanning = False
+        self._seconds = {"scan": 0.0, "idle": 0.0}
+        self._samples = {"scan": 0, "idle": 0}
+        self._latency_sum = {"scan": 0.0, "idle": 0.0}
+        self._latency_max = {"scan": 0.0, "idle": 0.0}
+        self._batches = {"scan": 0, "idle": 0}
+
+    def observe(self, now: float, samples: int, latency: float, scanning: bool) -> None:
+        """
+        :param now: Monotonic time the batch was handled.
+        :param samples: Samples in the batch.
+        :param latency: Arrival delay of the newest sample in seconds.
+        :param scanning: Whether a scan window is open.
+        """
+        if self._last is not None:
+            self._seconds["scan" if self._scanning else "idle"] += now - self._last
+        self._last = now
+        self._scanning = scanning
+        state = "scan" if scanning else "idle"
+        self._samples[state] += samples
+        self._batches[state] += 1
+        self._latency_sum[state] += latency
+        if latency > self._latency_max[state]:
+            self._latency_max[state] = latency
+
+    def counters(self):
+        counters = {}
+        for state in ("scan", "idle"):
+            seconds = self._seconds[state]
+            batches = self._batches[state]
+            counters[f"{state}_seconds_total"] = round(seconds, 1)
+            counters[f"{state}_sample_rate_hz"] = round(self._samples[state] / seconds, 2) if seconds else 0
+            counters[f"{state}_latency_ms_avg"] = (
+                round(1e3 * self._latency_sum[state] / batches, 2) if batches else 0)
+            counters[f"{state}_latency_ms_max"] = round(1e3 * self._latency_max[state], 2)
+        return counters
+
+
+# One per process, shared by the scanner and the clients in it
+scan_window = ScanWindow()
@@ -0,0 +1,434 @@
+"""
+Binary sample segments.
+
+A segment is a fixed 128-byte header followed by 28-byte records in the
+packed notification layout (decoders.SAMPLE_DTYPE): uint32 device time in
+microseconds and ax, ay, az, gx, gy, gz as float32, all little-endian.
+Records are only ever appended, and a reader maps the file and views the
+records with numpy.frombuffer without parsing or copying them.
+
+The header names the location and device and carries the clock anchor the
+writer used: wall = anchor_wall + rate * (device time - anchor_counter).
+That gives every record the same wall time the clock model would have
+produced for it when the CSV format was written.
+
+Compressed segments (.seg.gz, .seg.zst) are written whole by
+compress_segment() with header version SHUFFLED_VERSION: the records are
+stored byte-shuffled in blocks of SHUFFLE_BLOCK, first byte of every record
+in the block, then the second byte of every record and so on, so they can
+still be read a block at a time. Sign, exponent and high mantissa bytes of the
+floats change little from sample to sample and deflate far better next to
+each other (about 1.35x instead of 1.07x for gzip on simulated samples).
+
+Export to the CSV layout connect.py used to write:
+
+    python segments.py imu_data_20240101_120000_AA:BB:CC:DD:EE:FF.seg [out.csv]
+"""
+import csv
+import io
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from clocksync import TimestampFormatter
+from compression import (EXTENSIONS, codec_for, compress_file, open_compressed, strip_extension,
+                         write_compressed)
+from decoders import SAMPLE_DTYPE, SAMPLE_SIZE
+
+SEGMENT_EXT = ".seg"
+MAGIC = b"FXSG"
+VERSION = 1
+# Same header, records byte-shuffled (compressed segments only)
+SHUFFLED_VERSION = 2
+# Records shuffled together; the last block of a segment may be shorter
+SHUFFLE_BLOCK = 4096
+# magic, version, header size, start (wall s), anchor counter (us),
+# anchor wall (s), rate (wall s per device s), device, location
+HEADER = struct.Struct("<4sHHdIdd32s60s")
+HEADER_SIZE = HEADER.size
+# Bytes the header has for the device address and the location
+DEVICE_BYTES = 32
+LOCATION_BYTES = 60
+CSV_HEADER = ["Timestamp", "Sample Rate (Hz)", "Time", "Ax", "Ay", "Az", "Gx", "Gy", "Gz"]
+
+
+def _field(text: str, size: int) -> bytes:
+    # UTF-8 of text cut to at most size bytes without splitting a character
+    return text.encode()[:size].decode("utf-8", errors="ignore").encode()
+
+
+def wall_times(times: np.ndarray, anchor_counter: int, anchor_wall: float,
+               rate: float) -> np.ndarray:
+    """
+    :param times: uint32 device times in microseconds.
+    :return: Wall time (seconds since epoch) of each device time.
+    """
+    delta = (times.astype(np.int64) - anchor_counter + (1 << 31)) % (1 << 32) - (1 << 31)
+    return anchor_wall + rate * delta / 1e6
+
+
+class SegmentWriter:
+    """
+    Append samples of one device to a segment file.
+
+    Nothing touches the disk until the first records are appended, so the
+    object can be created on the event loop and written from the writer
+    thread (storage.py). The clock anchor is set by the owner with anchor()
+    before the first records are handed over. A CRC32 is kept over the
+    bytes written since the last commit() for the journal (journal.py).
+
+    :param path: File to create.
+    :param location: Gateway location, as in the first CSV row.
+    :param device: Device address.
+    """
+
+    def __init__(self, path: str, location: str, device: str) -> None:
+        self.path = path
+        self.location = location
+        self.device = device
+        self._start = time.time()
+        self._anchor = None
+        self._file = None
+        self._crc = 0
+        self._committed = 0
+        self.samples = 0
+        self.bytes = 0
+        # Wall times of the first and last sample written, and the range of
+        # acceleration magnitudes
+        self.first = None
+        self.last = None
+        self.peak = None
+        self.trough = None
+
+    @property
+    def anchored(self) -> bool:
+        return self._anchor is not None
+
+    @property
+    def opened(self) -> bool:
+        return self._file is not None
+
+    def anchor(self, counter: int, wall: float, rate: float) -> None:
+        """
+        :param counter: Device time (us) the anchor refers to.
+        :param wall: Wall time of that device time.
+        :param rate: Wall seconds per device second (1 + drift).
+        """
+        self._anchor = (counter, wall, rate)
+
+    def append(self, records: np.ndarray) -> None:
+        """
+        :param records: Structured array with dtype SAMPLE_DTYPE.
+        """
+        if not len(records):
+            return
+        if self._file is None:
+            if self._anchor is None:
+                self._anchor = (int(records['time'][0]), time.time(), 1.0)
+            self._open()
+        self._write(records)
+        self.samples += len(records)
+        ends = wall_times(records['time'][[0, -1]], *self._anchor).tolist()
+        accel = records['ax'] ** 2 + records['ay'] ** 2 + records['az'] ** 2
+        peak, trough = float(accel.max()) ** 0.5, float(accel.min()) ** 0.5
+        if self.first is None:
+            self.first, self.peak, self.trough = ends[0], peak, trough
+        else:
+            self.peak, self.trough = max(self.peak, peak), min(self.trough, trough)
+        self.last = ends[1]
+
+    def _emit(self, data: bytes) -> None:
+        self._file.write(data)
+        self._crc = zlib.crc32(data, self._crc)
+        self.bytes += len(data)
+
+    def _open(self) -> None:
+        self._file = open(self.path, "wb")
+        self._emit(HEADER.pack(MAGIC, VERSION, HEADER_SIZE, self._start, *self._anchor,
+                               _field(self.device, DEVICE_BYTES),
+                               _field(self.location, LOCATION_BYTES)))
+
+    def _write(self, records: np.ndarray) -> None:
+        self._emit(records.tobytes())
+
+    def commit(self) -> Optional[Tuple[int, int, int]]:
+        """
+        :return: (start, end, crc32) of the bytes written since the previous
+                 commit, or None if there are none.
+        """
+        if self.bytes == self._committed:
+            return None
+        block = (self._committed, self.bytes, self._crc)
+        self._committed = self.bytes
+        self._crc = 0
+        return block
+
+    def flush(self, sync: bool = False) -> None:
+        if self._file is None:
+            return
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+class CsvSegmentWriter(SegmentWriter):
+    """
+    Same as SegmentWriter, writing the CSV layout connect.py used before
+    binary segments: location row, header row, then one row per sample.
+    """
+
+    def __init__(self, path: str, location: str, device: str) -> None:
+        super().__init__(path, location, device)
+        self._stamp = TimestampFormatter()
+        self._first_wall = None
+
+    def _rows(self, rows) -> None:
+        # Rows are formatted into memory so the bytes can be checksummed
+        text = io.StringIO()
+        csv.writer(text).writerows(rows)
+        self._emit(text.getvalue().encode())
+
+    def _open(self) -> None:
+        self._file = open(self.path, "wb")
+        self._rows([[self.location], CSV_HEADER])
+
+    def _write(self, records: np.ndarray) -> None:
+        walls = wall_times(records['time'], *self._anchor).tolist()
+        if self._first_wall is None:
+            self._first_wall = walls[0]
+        span = walls[-1] - self._first_wall
+        rate = round((self.samples + len(walls) - 1) / span, 2) if span > 0 else 0.0
+        self._rows([self._stamp.format(wall), rate, row[0] / 1000000.0] + list(row[1:])
+                   for wall, row in zip(walls, records.tolist()))
+
+
+def shuffle(records: np.ndarray) -> bytes:
+    """
+    :param records: Structured array with dtype SAMPLE_DTYPE.
+    :return: Their bytes, byte-shuffled per SHUFFLE_BLOCK records (byte i of
+             every record in the block, for i in 0 .. SAMPLE_SIZE - 1).
+    """
+    blocks = []
+    for i in range(0, len(records), SHUFFLE_BLOCK):
+        block = np.ascontiguousarray(records[i:i + SHUFFLE_BLOCK])
+        blocks.append(block.view(np.uint8).reshape(len(block), SAMPLE_SIZE).T.tobytes())
+    return b"".join(blocks)
+
+
+def _unshuffle_block(data) -> np.ndarray:
+    count = len(data) // SAMPLE_SIZE
+    planes = np.frombuffer(data, dtype=np.uint8, count=count * SAMPLE_SIZE)
+    return planes.reshape(SAMPLE_SIZE, count).T.copy().view(SAMPLE_DTYPE).reshape(count)
+
+
+def unshuffle(data) -> np.ndarray:
+    """
+    :param data: Byte-shuffled records, as made by shuffle().
+    :return: The records, with dtype SAMPLE_DTYPE.
+    """
+    step = SHUFFLE_BLOCK * SAMPLE_SIZE
+    blocks = [_unshuffle_block(data[i:i + step]) for i in range(0, len(data), step)]
+    return np.concatenate(blocks) if blocks else np.empty(0, dtype=SAMPLE_DTYPE)
+
+
+def _read_header(segment, data, path: str) -> int:
+    # Set the header fields as attributes of segment; returns the header size
+    (magic, version, header_size, segment.start, segment.anchor_counter, segment.anchor_wall,
+     segment.rate, device, location) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version not in (VERSION, SHUFFLED_VERSION):
+        raise ValueError(f"{path} is not a version {VERSION} segment")
+    segment.shuffled = version == SHUFFLED_VERSION
+    # Earlier versions could cut a character in half; drop what is left of it
+    segment.device = device.rstrip(b"\0").decode("utf-8", errors="ignore")
+    segment.location = location.rstrip(b"\0").decode("utf-8", errors="ignore")
+    return header_size
+
+
+class Segment:
+    """
+    A segment file mapped for reading. Compressed segments (.seg.gz,
+    .seg.zst) are decompressed into memory instead.
+
+    :param path: Segment file.
+    :raises ValueError: If the file is not a segment.
+    """
+
+    def __init__(self, path: str) -> None:
+        if codec_for(path):
+            with open_compressed(path) as file:
+                self._map = file.read()
+            size = len(self._map)
+        else:
+            with open(path, "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                if size >= HEADER_SIZE:
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if size < HEADER_SIZE:
+            raise ValueError(f"{path} has no segment header")
+        header_size = _read_header(self, self._map, path)
+        if self.shuffled:
+            self.records = unshuffle(self._map[header_size:])
+            return
+        # A torn last record is left out
+        count = (size - header_size) // SAMPLE_SIZE
+        self.records = np.frombuffer(self._map, dtype=SAMPLE_DTYPE, count=count, offset=header_size)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def wall_times(self) -> np.ndarray:
+        """
+        :return: Wall time (seconds since epoch) of every record.
+        """
+        return wall_times(self.records['time'], self.anchor_counter, self.anchor_wall, self.rate)
+
+    def sample_rate(self) -> float:
+        if len(self) < 2:
+            return 0.0
+        walls = self.wall_times()
+        span = walls[-1] - walls[0]
+        return round((len(self) - 1) / span, 2) if span > 0 else 0.0
+
+
+def _read_full(file, size: int) -> bytes:
+    # Decompressing readers may return less than asked before the end
+    data = file.read(size)
+    while len(data) < size:
+        more = file.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+class SegmentStream:
+    """
+    A segment read in chunks of records, so memory stays the same however
+    long the segment is. Each call to chunks() is a new pass over the file
+    (decompressing it again if it is compressed). Shuffled segments are read
+    a SHUFFLE_BLOCK at a time.
+
+    :param path: Segment file.
+    :raises ValueError: If the file is not a segment.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open_compressed(path) as file:
+            data = _read_full(file, HEADER_SIZE)
+        if len(data) < HEADER_SIZE:
+            raise ValueError(f"{path} has no segment header")
+        self._header_size = _read_header(self, data, path)
+
+    def chunks(self, size: int = 4096) -> Iterator[np.ndarray]:
+        """
+        :param size: Records per chunk.
+        :return: Arrays of up to size records with dtype SAMPLE_DTYPE, in order.
+        """
+        with open_compressed(self.path) as file:
+            _read_full(file, self._header_size)
+            if self.shuffled:
+                while True:
+                    records = _unshuffle_block(_read_full(file, SHUFFLE_BLOCK * SAMPLE_SIZE))
+                    if not len(records):
+                        return
+                    for i in range(0, len(records), size):
+                        yield records[i:i + size]
+            while True:
+                data = _read_full(file, size * SAMPLE_SIZE)
+                count = len(data) // SAMPLE_SIZE
+                if count == 0:
+                    return  # end, or a torn last record
+                yield np.frombuffer(data, dtype=SAMPLE_DTYPE, count=count)
+
+    def wall_times(self, records: np.ndarray) -> np.ndarray:
+        return wall_times(records['time'], self.anchor_counter, self.anchor_wall, self.rate)
+
+
+def encode_segment(segment: Segment, records: np.ndarray, shuffled: bool = False) -> bytes:
+    """
+    :param shuffled: Byte-shuffle the records, for a segment to be compressed.
+    :return: A segment with the header of segment and the given records,
+             e.g. a subset of its own.
+    """
+    header = HEADER.pack(MAGIC, SHUFFLED_VERSION if shuffled else VERSION, HEADER_SIZE,
+                         segment.start, segment.anchor_counter, segment.anchor_wall,
+                         segment.rate, _field(segment.device, DEVICE_BYTES),
+                         _field(segment.location, LOCATION_BYTES))
+    return header + (shuffle(records) if shuffled else records.tobytes())
+
+
+def compress_segment(path: str, codec: str, directory: str = None) -> Tuple[str, int, int]:
+    """
+    Compress a plain segment, records byte-shuffled, and remove the
+    original. Like compress_file(), the result only appears once complete;
+    files that are not segments are compressed as they are.
+
+    :param codec: "gzip" or "zstd".
+    :param directory: Where to put the result, next to the original by default.
+    :return: Path of the result, bytes in, bytes out.
+    """
+    size = os.path.getsize(path)
+    try:
+        segment = Segment(path)
+    except ValueError:
+        return compress_file(path, codec, directory)
+    target = os.path.join(directory or os.path.dirname(path),
+                          os.path.basename(path) + EXTENSIONS[codec])
+    data = encode_segment(segment, segment.records, shuffled=True)
+    del segment
+    written = write_compressed(target, data, codec)
+    os.remove(path)
+    return target, size, written
+
+
+def open_segment(path: str) -> Optional[Segment]:
+    """
+    :return: The segment, or None if no samples were ever written to it.
+    """
+    if os.path.getsize(path) == 0:
+        return None
+    return Segment(path)
+
+
+def export_csv(path: str, csv_path: str = None) -> Optional[str]:
+    """
+    Write a segment in the CSV layout of CsvSegmentWriter.
+
+    :param path: Segment file.
+    :param csv_path: Output file, next to the segment by default.
+    :return: Path of the CSV, or None if the segment is empty.
+    """
+    segment = open_segment(path)
+    if segment is None:
+        return None
+    if csv_path is None:
+        csv_path = os.path.splitext(strip_extension(path))[0] + ".csv"
+    stamp = TimestampFormatter()
+    rate = segment.sample_rate()
+    records = segment.records
+    with open(csv_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow([segment.location])
+        writer.writerow(CSV_HEADER)
+        for wall, row in zip(segment.wall_times().tolist(), records.tolist()):
+            writer.writerow([stamp.format(wall), rate, row[0] / 1000000.0] + list(row[1:]))
+    return csv_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"usage: python {sys.argv[0]} segment.seg [out.csv]")
+        sys.exit(1)
+    out = export_csv(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+    print(out if out else f"{sys.argv[1]} is empty")
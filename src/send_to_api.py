@@ -1,46 +1,63 @@
 import requests
 import os
 import time
-import csv
-import json
 import shutil
-
-def upload_json_to_api(file_path: str, api_url: str, headers: dict = None) -> None:
+from typing import Iterator
+
+from compression import DECODE_ERRORS, BodyCompressor, strip_extension
+from payload import json_body
+from segments import SEGMENT_EXT
+from uploads import QUEUE_DB, UploadQueue
+
+# Subdirectory of send_out that files which cannot be read are moved to
+QUARANTINE_DIR = "quarantine"
+# Seconds to wait after each upload so the API is not flooded; 0 uploads
+# back to back (bench_capacity.py)
+UPLOAD_PAUSE = float(os.environ.get("FALLYX_UPLOAD_PAUSE", 5))
+
+def compress_body(body: Iterator[bytes], compressor: BodyCompressor) -> Iterator[bytes]:
+    for chunk in body:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+def upload_json_to_api(body: Iterator[bytes], api_url: str, headers: dict = None) -> None:
     """
-    Upload a JSON file to a REST API.
+    Upload a JSON body to a REST API, compressed with the codec set by
+    FALLYX_COMPRESSION and sent with the matching Content-Encoding. The body
+    is streamed with chunked Transfer-Encoding as it is produced.
 
-    :param file_path: Path to the JSON file to upload.
+    :param body: JSON body in chunks (payload.json_body).
     :param api_url: URL of the REST API endpoint.
     :param headers: Optional headers to include in the request (e.g., for authentication).
     :return: None
     """
     try:
-        # Open the JSON file
-        with open(file_path, 'rb') as file:
-            # Create a dictionary to represent the file payload
-            files = {'file': (file_path, file, 'application/json')}
-            
-            # Send a POST request to the API
-            response = requests.post(api_url, data=file, headers=headers)
-            
-            # Check if the request was successful
-            if response.status_code == 200:
-                print("File uploaded successfully.")
-                print("Response:", response.json())
-                return 1
-
-            else:
-                f = open("error_log.txt", "a")
-                f.write(f"Failed to upload file. Status code: {response.status_code}")
-                f.write(f"Response: {response.text}")
-                #now = time.datetime.now()
-                #current= now.strftime("%H:%M:%S") 
-                #f.write(f"Time: {current}")
-                f.write("-------------------------------")
-                print(f"Failed to upload file. Status code: {response.status_code}")
-                print("Response:", response.text)
-                return 0
-                
+        compressor = BodyCompressor()
+        if compressor.encoding is not None:
+            headers = dict(headers or {}, **{'Content-Encoding': compressor.encoding})
+
+        # Send a POST request to the API
+        response = requests.post(api_url, data=compress_body(body, compressor), headers=headers)
+
+        # Check if the request was successful
+        if response.status_code == 200:
+            print("File uploaded successfully.")
+            print("Response:", response.json())
+            return 1
+
+        else:
+            f = open("error_log.txt", "a")
+            f.write(f"Failed to upload file. Status code: {response.status_code}")
+            f.write(f"Response: {response.text}")
+            #now = time.datetime.now()
+            #current= now.strftime("%H:%M:%S") 
+            #f.write(f"Time: {current}")
+            f.write("-------------------------------")
+            print(f"Failed to upload file. Status code: {response.status_code}")
+            print("Response:", response.text)
+            return 0
 
     except Exception as e:
 
@@ -55,139 +72,120 @@ def upload_json_to_api(file_path: str, api_url: str, headers: dict = None) -> No
 
 def get_csv_files_from_directory(directory_path: str) -> list:
     """
-    Get a list of all CSV files in a given directory.
+    Get a list of all CSV files in a given directory, compressed or not.
 
     :param directory_path: Path to the directory to scan for CSV files.
     :return: List of paths to CSV files.
     """
-    csv_files = [os.path.join(directory_path, f) for f in os.listdir(directory_path) if f.endswith('.csv')]
+    csv_files = [os.path.join(directory_path, f) for f in os.listdir(directory_path) if strip_extension(f).endswith('.csv')]
     return csv_files
 
-def get_oldest_file(files: list) -> str:
+def get_segment_files_from_directory(directory_path: str) -> list:
     """
-    Get the path to the oldest file in a list of files.
+    Get a list of all binary segment files in a given directory, compressed or not.
 
-    :param files: List of file paths.
-    :return: Path to the oldest file.
+    :param directory_path: Path to the directory to scan for segments.
+    :return: List of paths to segment files.
     """
-    if not files:
-        return None
+    return [os.path.join(directory_path, f) for f in os.listdir(directory_path) if strip_extension(f).endswith(SEGMENT_EXT)]
 
-    # Initialize with the first file
-    oldest_file = files[0]
-    oldest_time = os.path.getmtime(oldest_file)
+def quarantine(path: str) -> None:
+    """
+    Move a file that cannot be read out of the way, into QUARANTINE_DIR next to it.
+
+    :param path: File in send_out.
+    """
+    directory = os.path.join(os.path.dirname(path), QUARANTINE_DIR)
+    os.makedirs(directory, exist_ok=True)
+    shutil.move(path, os.path.join(directory, os.path.basename(path)))
+    print(f"Moved {path} to {directory}")
 
-    for file in files[1:]:
-        file_time = os.path.getmtime(file)
-        if file_time < oldest_time:
-            oldest_file = file
-            oldest_time = file_time
+def remove_leftover_json(directory_path: str) -> int:
+    """
+    Remove the JSON files earlier versions wrote next to each CSV before
+    sending it. The CSV stays in send_out until it is sent, so they are never needed.
 
-    return oldest_file
+    :param directory_path: The send_out directory.
+    :return: Number of files removed.
+    """
+    removed = 0
+    for f in os.listdir(directory_path):
+        if f.endswith('.json'):
+            try:
+                os.remove(os.path.join(directory_path, f))
+                removed += 1
+            except OSError as e:
+                print(f"Cannot remove {f}: {e}")
+    return removed
 
-def send_to_rest_api(api_url, file):
+def send_to_rest_api(api_url, body):
     # Define optional headers if needed (e.g., for authentication)
     headers = {
            'Content-Type': 'application/json'  # Optional: specify content type if required
     }
 
-    # Upload the file
-    ret = upload_json_to_api(file, api_url, headers)
+    # Upload the body
+    ret = upload_json_to_api(body, api_url, headers)
     return ret
-def csv_to_json(csv_file_path):
- import csv
-import json
-import os
-
-def csv_to_json(csv_file_path):
-    file_name = os.path.splitext(csv_file_path)[0]
-    json_file_path = f"{file_name}.json"
-    
-    data = {
-        'Location': None,
-        'Timestamp': [],
-        'Ax': [],
-        'Ay': [],
-        'Az': [],
-        'Gx': [],
-        'Gy': [],
-        'Gz': []
-    }
-
-    with open(csv_file_path, mode='r') as csv_file:
-        csv_reader = csv.reader(csv_file)
 
-        # Read the first row to get the location
-        try:
-            location_row = next(csv_reader)
-        except StopIteration:
-            print("File is empty...Removing File")
-            return 0
-
-        data['Location'] = location_row[0]  # Assuming 'Location' is the first entry of the first row
-
-        # Read the second row as headers and ignore it
-        try:
-            headers = next(csv_reader)
-        except StopIteration:
-            print("File is empty...Removing File")
-            return 0
-
-        # Process each row and add data only if all entries are valid
-        for row in csv_reader:
-            try:
-                # Extract and convert values for each column, skipping row if any value fails
-                timestamp = row[0]
-                ax = float(row[3])
-                ay = float(row[4])
-                az = float(row[5])
-                gx = float(row[6])
-                gy = float(row[7])
-                gz = float(row[8])
-
-                # Append values to data if all conversions are successful
-                data['Timestamp'].append(timestamp)
-                data['Ax'].append(ax)
-                data['Ay'].append(ay)
-                data['Az'].append(az)
-                data['Gx'].append(gx)
-                data['Gy'].append(gy)
-                data['Gz'].append(gz)
-
-            except (ValueError, IndexError) as e:
-                print(f"Skipping row due to error: {e}")
-
-    # Write the output to a JSON file
-    with open(json_file_path, mode='w') as json_file:
-        json.dump(data, json_file, indent=4)
-    
-    return json_file_path
-  
-
-    
 def main():
-    api_url = "http://3.98.214.27:5000/inference"
+    # Overridable so the uploader can be pointed at mock_api.py
+    api_url = os.environ.get("FALLYX_API_URL", "http://3.98.214.27:5000/inference")
     sd = os.path.dirname(os.path.abspath(__file__))
-    script_directory = os.path.join(sd, "send_out")
+    script_directory = os.environ.get("FALLYX_SEND_OUT", os.path.join(sd, "send_out"))
     print(script_directory)
+    os.makedirs(script_directory, exist_ok=True)
+    queue = UploadQueue(os.path.join(script_directory, QUEUE_DB))
+    if remove_leftover_json(script_directory):
+        print(f"Removed JSON files left in {script_directory} by an earlier version")
+    # Queue whatever is in send_out but not in the queue yet; after this the
+    # directory is never listed again
+    added = queue.reconcile(lambda: get_csv_files_from_directory(script_directory) +
+                            get_segment_files_from_directory(script_directory))
+    if added:
+        print(f"Queued {added} files found in {script_directory}")
     while(True):
-        file_names = get_csv_files_from_directory(script_directory) 
-        if len(file_names) > 0:
-            old_file = get_oldest_file(file_names)
-            json_file = csv_to_json(old_file)
-            if json_file == 0:
+        entry = queue.claim()
+        if entry is None:
+            time.sleep(1)
+            continue
+        old_file = entry["path"]
+        try:
+            body = json_body(old_file)
+        except FileNotFoundError:
+            queue.done(entry["id"])
+            continue
+        except (ValueError,) + DECODE_ERRORS as e:
+            # Damaged or truncated; retrying would block the queue forever
+            print(f"Cannot read {old_file}: {e}")
+            try:
+                quarantine(old_file)
+            except OSError as e:
+                print(f"Cannot quarantine {old_file}: {e}")
+                queue.fail(entry["id"], str(e))
+                continue
+            queue.done(entry["id"])
+            continue
+        except OSError as e:
+            print(f"Cannot read {old_file}: {e}")
+            queue.retry(entry["id"], str(e))
+            continue
+        if body is None:
+            print("File is empty...Removing File")
+            os.remove(old_file)
+            queue.done(entry["id"])
+        else:
+            print("Sending: ")
+            print(old_file)
+            ret = send_to_rest_api(api_url, body)
+            if UPLOAD_PAUSE > 0:
+                time.sleep(UPLOAD_PAUSE)
+            #shutil.move(old_file, os.path.join(processed_directory, os.path.basename(old_file)))
+            if ret == 1:
                 os.remove(old_file)
+                queue.done(entry["id"])
             else:
-                print("Sending: ")
-                print(json_file)
-                ret = send_to_rest_api(api_url, json_file)
-                time.sleep(5)
-                #shutil.move(json_file, os.path.join(processed_directory, os.path.basename(json_file)))
-                #shutil.move(old_file, os.path.join(processed_directory, os.path.basename(old_file)))
-                if ret == 1:
-                    os.remove(json_file)
-                    os.remove(old_file)
-        time.sleep(1)
+                queue.retry(entry["id"], "upload failed")
 
 
 
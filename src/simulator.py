@@ -0,0 +1,387 @@
+"""
+Simulated FallSensor radio with the parts of the bleak API the gateway uses.
+
+Virtual sensors advertise as 'FallSensor' and, once connected, notify the
+seven per-axis characteristics (or the packed one) at a set rate. Sample
+values are replayed from a CSV or segment recorded by connect.py, or
+generated when no recording is given. Jitter, dropped notifications and
+disconnects can be injected.
+
+Select it with FALLYX_TRANSPORT=sim. Without setup code the sensors come
+from the environment:
+
+    FALLYX_SIM_SENSORS  number of sensors (3)
+    FALLYX_SIM_RATE     samples per second per sensor (100)
+    FALLYX_SIM_CSV      recording to replay, .csv or .seg (synthetic data if unset)
+    FALLYX_SIM_RSSI     advertised RSSI in dBm (-60)
+    FALLYX_SIM_JITTER   std. deviation of notification timing in s (0)
+    FALLYX_SIM_DROP     probability a notification is lost (0)
+    FALLYX_SIM_PACKED   1 to offer the packed characteristic (0)
+    FALLYX_SIM_DISCONNECT  mean seconds between random disconnects (never)
+    FALLYX_SIM_STATS    file the per-sensor send counts are written to on exit
+"""
+import asyncio
+import atexit
+import csv
+import io
+import json
+import math
+import os
+import random
+import time
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from compression import open_compressed, strip_extension
+from decoders import AXIS_FORMATS, PACKED_UUID, SAMPLE_DTYPE
+from segments import SEGMENT_EXT, open_segment
+
+SERVICE_UUID = '12345678-1234-5678-1234-56789abcdef0'
+TARGET_TAG_NAME = 'FallSensor'
+# Characteristic handles as a real sensor would number them
+FIRST_HANDLE = 0x10
+# Seconds between advertisements of an unconnected sensor
+ADVERTISING_INTERVAL = 0.2
+# Seconds a connection takes to set up
+CONNECT_DELAY = 0.3
+# Notifications are emitted in bursts on this tick, catching up on every
+# sample that became due in between
+TICK = 0.01
+PACKED_SAMPLES_PER_NOTIFICATION = 8
+
+
+class BleakError(Exception):
+    pass
+
+
+def load_recording(path: str) -> List[tuple]:
+    """
+    Read the axis values from a recording made by NanoIMUBLEClient.
+
+    :param path: Binary segment, or CSV with the location row, the header
+                 row, then samples; either may be compressed (.gz, .zst).
+    :return: List of (ax, ay, az, gx, gy, gz) tuples.
+    """
+    if strip_extension(path).endswith(SEGMENT_EXT):
+        segment = open_segment(path)
+        if segment is None or not len(segment):
+            raise ValueError(f"No samples in {path}")
+        return [row[1:] for row in segment.records.tolist()]
+    rows = []
+    with io.TextIOWrapper(open_compressed(path), newline='') as file:
+        reader = csv.reader(file)
+        next(reader, None)  # location
+        next(reader, None)  # header
+        for row in reader:
+            try:
+                rows.append(tuple(float(v) for v in row[3:9]))
+            except (ValueError, IndexError):
+                continue
+    if not rows:
+        raise ValueError(f"No samples in {path}")
+    return rows
+
+
+def synthetic_recording(rate_hz: float, seconds: float = 10.0) -> List[tuple]:
+    # Gravity on z with some sway and noise
+    rows = []
+    for i in range(int(rate_hz * seconds)):
+        phase = 2 * math.pi * i / rate_hz
+        rows.append((0.3 * math.sin(phase) + random.gauss(0, 0.05),
+                     0.2 * math.cos(phase) + random.gauss(0, 0.05),
+                     -9.81 + random.gauss(0, 0.05),
+                     random.gauss(0, 0.5), random.gauss(0, 0.5), random.gauss(0, 0.5)))
+    return rows
+
+
+class FakeDevice:
+    def __init__(self, address: str, name: str) -> None:
+        self.address = address
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"{self.address}: {self.name}"
+
+
+class FakeAdvertisement:
+    def __init__(self, local_name: str, rssi: int) -> None:
+        self.local_name = local_name
+        self.rssi = rssi
+
+
+class FakeCharacteristic:
+    def __init__(self, uuid: str, handle: int) -> None:
+        self.uuid = uuid
+        self.handle = handle
+
+
+class FakeService:
+    def __init__(self, uuid: str, characteristics: List[FakeCharacteristic]) -> None:
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+
+class FakeServices:
+    def __init__(self, services: List[FakeService]) -> None:
+        self._services = services
+        self._by_key = {}
+        for service in services:
+            for c in service.characteristics:
+                self._by_key[c.uuid] = c
+                self._by_key[c.handle] = c
+
+    def __iter__(self):
+        return iter(self._services)
+
+    def get_characteristic(self, key: Union[str, int]) -> Optional[FakeCharacteristic]:
+        return self._by_key.get(key)
+
+
+class VirtualSensor:
+    """
+    One simulated FallSensor.
+
+    :param address: Device address.
+    :param rate_hz: Samples per second sent while connected.
+    :param recording: Axis tuples to replay in a loop.
+    :param rssi: Advertised RSSI, or RSSI per adapter name.
+    :param jitter: Std. deviation in seconds added to each notification burst.
+    :param drop: Probability that a single notification is lost.
+    :param packed: Offer the packed characteristic.
+    :param disconnect_every: Mean seconds between random disconnects, 0 for never.
+    """
+
+    def __init__(self, address: str, rate_hz: float = 100.0, recording: List[tuple] = None,
+                 rssi: Union[int, Dict[str, int]] = -60, jitter: float = 0.0,
+                 drop: float = 0.0, packed: bool = False, disconnect_every: float = 0.0) -> None:
+        self.address = address
+        self.device = FakeDevice(address, TARGET_TAG_NAME)
+        self.rate_hz = rate_hz
+        self.recording = recording or synthetic_recording(rate_hz)
+        self.rssi = rssi
+        self.jitter = jitter
+        self.drop = drop
+        self.packed = packed
+        self.disconnect_every = disconnect_every
+        self.client: Optional["BleakClient"] = None
+        self.down_until = 0.0
+        # Samples generated, notifications delivered and notifications lost
+        self.samples = 0
+        self.sent = 0
+        self.dropped = 0
+        self._counter = random.randrange(1 << 32)
+        self._index = 0
+        self.services = self._build_services()
+
+    def _build_services(self) -> FakeServices:
+        uuids = list(AXIS_FORMATS)
+        if self.packed:
+            uuids.append(PACKED_UUID)
+        characteristics = [FakeCharacteristic(uuid, FIRST_HANDLE + 2 * i)
+                           for i, uuid in enumerate(uuids)]
+        return FakeServices([FakeService(SERVICE_UUID, characteristics)])
+
+    def rssi_on(self, adapter: str) -> Optional[int]:
+        if isinstance(self.rssi, dict):
+            return self.rssi.get(adapter)
+        return self.rssi
+
+    @property
+    def advertising(self) -> bool:
+        return self.client is None and time.monotonic() >= self.down_until
+
+    def drop_link(self, down: float = 0.0) -> None:
+        """
+        Disconnect the current client, as if the sensor went out of range.
+
+        :param down: Seconds before the sensor advertises again.
+        """
+        self.down_until = time.monotonic() + down
+        if self.client is not None:
+            self.client._lost()
+
+    def next_sample(self) -> tuple:
+        # Device time advances by exactly one period per sample
+        row = self.recording[self._index]
+        self._index = (self._index + 1) % len(self.recording)
+        counter = self._counter
+        self.samples += 1
+        self._counter = (counter + int(1e6 / self.rate_hz)) & 0xFFFFFFFF
+        return (counter,) + row
+
+
+class SimulatedAir:
+    """The set of virtual sensors every fake scanner and client talks to."""
+
+    def __init__(self) -> None:
+        self.sensors: Dict[str, VirtualSensor] = {}
+
+    def add_sensor(self, address: str = None, **kwargs) -> VirtualSensor:
+        if address is None:
+            address = f"5E:00:00:00:{len(self.sensors) // 256:02X}:{len(self.sensors) % 256:02X}"
+        sensor = VirtualSensor(address, **kwargs)
+        self.sensors[address] = sensor
+        return sensor
+
+    @classmethod
+    def from_env(cls) -> "SimulatedAir":
+        air = cls()
+        rate = float(os.environ.get("FALLYX_SIM_RATE", 100))
+        path = os.environ.get("FALLYX_SIM_CSV")
+        recording = load_recording(path) if path else None
+        for _ in range(int(os.environ.get("FALLYX_SIM_SENSORS", 3))):
+            air.add_sensor(rate_hz=rate, recording=recording,
+                           rssi=int(os.environ.get("FALLYX_SIM_RSSI", -60)),
+                           jitter=float(os.environ.get("FALLYX_SIM_JITTER", 0)),
+                           drop=float(os.environ.get("FALLYX_SIM_DROP", 0)),
+                           packed=os.environ.get("FALLYX_SIM_PACKED") == "1",
+                           disconnect_every=float(os.environ.get("FALLYX_SIM_DISCONNECT", 0)))
+        return air
+
+    def write_stats(self, path: str) -> None:
+        stats = {address: {"samples": s.samples, "sent": s.sent, "dropped": s.dropped}
+                 for address, s in self.sensors.items()}
+        with open(path, "w") as file:
+            json.dump(stats, file)
+
+
+_air: Optional[SimulatedAir] = None
+
+
+def air() -> SimulatedAir:
+    """The simulated radio environment, built from FALLYX_SIM_* on first use."""
+    global _air
+    if _air is None:
+        _air = SimulatedAir.from_env()
+        if os.environ.get("FALLYX_SIM_STATS"):
+            atexit.register(_air.write_stats, os.environ["FALLYX_SIM_STATS"])
+    return _air
+
+
+def set_air(new_air: SimulatedAir) -> None:
+    global _air
+    _air = new_air
+
+
+class BleakScanner:
+    def __init__(self, detection_callback=None, adapter: str = "hci0", **kwargs) -> None:
+        self._callback = detection_callback
+        self._adapter = adapter
+        self._task = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._advertise())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _advertise(self) -> None:
+        while True:
+            for sensor in list(air().sensors.values()):
+                rssi = sensor.rssi_on(self._adapter)
+                if sensor.advertising and rssi is not None and self._callback is not None:
+                    self._callback(sensor.device, FakeAdvertisement(TARGET_TAG_NAME, rssi))
+            await asyncio.sleep(ADVERTISING_INTERVAL)
+
+
+class BleakClient:
+    def __init__(self, address_or_device, disconnected_callback=None,
+                 adapter: str = None, **kwargs) -> None:
+        self.address = getattr(address_or_device, "address", address_or_device)
+        self._disconnected_callback = disconnected_callback
+        self._sensor: Optional[VirtualSensor] = None
+        self._handlers = {}
+        self._task = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._sensor is not None
+
+    @property
+    def services(self) -> FakeServices:
+        if self._sensor is None:
+            raise BleakError("Not connected")
+        return self._sensor.services
+
+    async def connect(self, **kwargs) -> bool:
+        sensor = air().sensors.get(self.address)
+        await asyncio.sleep(CONNECT_DELAY)
+        if sensor is None or not sensor.advertising:
+            raise BleakError(f"Device with address {self.address} was not found")
+        sensor.client = self
+        self._sensor = sensor
+        return True
+
+    async def disconnect(self) -> bool:
+        self._lost()
+        return True
+
+    async def get_services(self) -> FakeServices:
+        return self.services
+
+    async def start_notify(self, characteristic, callback) -> None:
+        if not isinstance(characteristic, FakeCharacteristic):
+            characteristic = self.services.get_characteristic(characteristic)
+        if characteristic is None:
+            raise BleakError("Characteristic not found")
+        self._handlers[characteristic.uuid] = (characteristic, callback)
+        if self._task is None:
+            self._task = asyncio.create_task(self._notify())
+
+    async def stop_notify(self, characteristic) -> None:
+        uuid = getattr(characteristic, "uuid", None)
+        if uuid is None:
+            found = self._sensor.services.get_characteristic(characteristic) if self._sensor else None
+            uuid = found.uuid if found else characteristic
+        self._handlers.pop(uuid, None)
+
+    def _lost(self) -> None:
+        if self._sensor is None:
+            return
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._sensor.client = None
+        self._sensor = None
+        self._handlers = {}
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+    async def _notify(self) -> None:
+        sensor = self._sensor
+        period = 1.0 / sensor.rate_hz
+        pending = []
+        due = time.monotonic()
+        while self._sensor is sensor:
+            await asyncio.sleep(max(0.0, TICK + random.gauss(0, sensor.jitter)))
+            now = time.monotonic()
+            if sensor.disconnect_every and random.random() < TICK / sensor.disconnect_every:
+                sensor.drop_link()
+                return
+            while due <= now:
+                due += period
+                sample = sensor.next_sample()
+                if PACKED_UUID in self._handlers:
+                    pending.append(sample)
+                    if len(pending) == PACKED_SAMPLES_PER_NOTIFICATION:
+                        self._send(PACKED_UUID, np.array(pending, dtype=SAMPLE_DTYPE).tobytes())
+                        pending = []
+                    continue
+                for uuid, value in zip(AXIS_FORMATS, sample[1:] + sample[:1]):
+                    self._send(uuid, AXIS_FORMATS[uuid][1].pack(value))
+
+    def _send(self, uuid: str, payload: bytes) -> None:
+        entry = self._handlers.get(uuid)
+        if entry is None:
+            return
+        sensor = self._sensor
+        if sensor.drop and random.random() < sensor.drop:
+            sensor.dropped += 1
+            return
+        sensor.sent += 1
+        characteristic, callback = entry
+        callback(characteristic, bytearray(payload))
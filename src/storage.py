@@ -0,0 +1,339 @@
+import atexit
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+from compression import SEAL_COMPRESSION, available, compress_file, strip_extension
+from journal import JOURNAL_DIR, Journal, recover
+from budget import SpoolBudget
+from metrics import metrics
+from segments import SEGMENT_EXT, compress_segment
+from uploads import QUEUE_DB, UploadQueue, describe, possible_fall
+
+# Written data is flushed to the OS after FLUSH_INTERVAL seconds or
+# FLUSH_BYTES bytes, whichever comes first, and fsynced every FSYNC_INTERVAL
+# seconds (0 to leave it to the OS). Sealed segments are always fsynced
+# before they move to send_out.
+FLUSH_INTERVAL = 1.0
+FLUSH_BYTES = 256 * 1024
+FSYNC_INTERVAL = 10.0
+# Batches waiting beyond this many bytes are dropped rather than letting a
+# stalled card grow memory without bound (about 30 min of 10 sensors at 100 Hz)
+MAX_PENDING_BYTES = 64 * 1024 * 1024
+SEND_OUT = "send_out"
+# Seconds between spool budget checks while new batches are being dropped
+BUDGET_RECHECK = 10.0
+
+
+class StorageWriter:
+    """
+    Write segments from a dedicated thread.
+
+    The event loop only hands over record arrays and seal requests, which
+    never block; opening, writing, flushing, fsyncing and moving sealed files
+    to send_out happen on the writer thread. Whatever is waiting when the
+    thread wakes is written as one group, then flushed according to the
+    policy, so a slow SD card delays the files but never the radio.
+
+    Every flush is committed to a journal (journal.py), so after a crash
+    recover() can cut open segments back to what was intact on disk and
+    send them on. Segments moved to send_out are added to its upload queue
+    (uploads.py), and the spool budget (budget.py) keeps send_out within its
+    share of the disk; when the disk is full anyway, new batches are dropped.
+
+    :param flush_interval: Seconds between flushes of written data.
+    :param flush_bytes: Bytes written before a flush regardless of time.
+    :param fsync_interval: Seconds between fsyncs, 0 for none.
+    :param journal_dir: Directory of the journal files.
+    :param compression: Codec sealed segments are compressed with on their
+                        way to send_out, "none" by default (SEAL_COMPRESSION
+                        in compression.py).
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, flush_bytes: int = FLUSH_BYTES,
+                 fsync_interval: float = FSYNC_INTERVAL, journal_dir: str = JOURNAL_DIR,
+                 compression: str = SEAL_COMPRESSION) -> None:
+        self._compression = compression
+        self._journal_dir = journal_dir
+        self._journal = None
+        # Upload queue and disk budget of each send_out directory
+        self._queues: Dict[str, UploadQueue] = {}
+        self._budgets: Dict[str, SpoolBudget] = {}
+        self._full = False
+        self._flush_interval = flush_interval
+        self._flush_bytes = flush_bytes
+        self._fsync_interval = fsync_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Segments written since the last flush / fsync
+        self._dirty = set()
+        self._unsynced = set()
+        self._unflushed_bytes = 0
+        self._last_flush = self._last_fsync = time.monotonic()
+        self._pending_bytes = 0
+        self._stats = {
+            "queue_depth_max": 0,
+            "batches_total": 0,
+            "bytes_total": 0,
+            "groups_total": 0,
+            "flushes_total": 0,
+            "fsyncs_total": 0,
+            "sealed_total": 0,
+            "recovered_total": 0,
+            "compress_in_bytes_total": 0,
+            "compress_out_bytes_total": 0,
+            "compression_ratio_last": 0.0,
+            "dropped_batches_total": 0,
+            "queue_errors_total": 0,
+            "thread_errors_total": 0,
+            "write_ms_max": 0.0,
+            "write_ms_sum": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._journal = Journal(self._journal_dir)
+            self._thread = threading.Thread(target=self._run, name="storage", daemon=True)
+            self._thread.start()
+            metrics.register("storage", self.counters)
+            atexit.register(self.close)
+            # Segments are written to the working directory
+            try:
+                self._uploads(SEND_OUT)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Cannot open the upload queue in {SEND_OUT}: {e}")
+
+    def write(self, segment, records) -> None:
+        """
+        Queue records to be appended to a segment.
+
+        :param segment: segments.SegmentWriter (or CsvSegmentWriter).
+        :param records: Structured array with dtype SAMPLE_DTYPE; must not be
+                        modified afterwards.
+        """
+        self.start()
+        size = records.nbytes
+        with self._lock:
+            if self._full or self._pending_bytes + size > MAX_PENDING_BYTES:
+                self._stats["dropped_batches_total"] += 1
+                return
+            self._pending_bytes += size
+        self._queue.put(("write", segment, records, time.monotonic()))
+        depth = self._queue.qsize()
+        if depth > self._stats["queue_depth_max"]:
+            self._stats["queue_depth_max"] = depth
+
+    def seal(self, segment, directory: str = SEND_OUT) -> None:
+        """
+        Close a segment once its queued records are written, fsync it and
+        move it into directory (relative to the segment's own directory).
+        """
+        self.start()
+        self._queue.put(("seal", segment, directory, time.monotonic()))
+
+    def close(self, timeout: float = 30.0) -> None:
+        # Write everything still queued, then stop the thread
+        if self._thread is None:
+            return
+        self._queue.put(("stop", None, None, time.monotonic()))
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._journal.close()
+        self._thread = None
+
+    def recover(self) -> List[str]:
+        """
+        Seal segments left open by gateway processes that died, before this
+        one starts writing.
+
+        :return: Paths of the recovered segments in send_out.
+        """
+        recovered = recover(self._journal_dir, SEND_OUT, self._finish)
+        self._stats["recovered_total"] += len(recovered)
+        return recovered
+
+    def counters(self) -> Dict[str, float]:
+        stats = dict(self._stats)
+        groups = stats.pop("groups_total")
+        write_sum = stats.pop("write_ms_sum")
+        stats["queue_depth"] = self._queue.qsize()
+        stats["pending_bytes"] = self._pending_bytes
+        stats["write_ms_avg"] = round(write_sum / groups, 3) if groups else 0
+        stats["write_ms_max"] = round(stats["write_ms_max"], 3)
+        stats["wait_ms_max"] = round(stats["wait_ms_max"], 3)
+        stats["groups_total"] = groups
+        if stats["compress_out_bytes_total"]:
+            stats["compression_ratio"] = round(
+                stats["compress_in_bytes_total"] / stats["compress_out_bytes_total"], 2)
+        return stats
+
+    def _run(self) -> None:
+        while True:
+            timeout = max(0.0, self._flush_interval - (time.monotonic() - self._last_flush))
+            if not self._dirty:
+                # While the disk is full nothing is queued; keep checking
+                # whether the uploader made room
+                timeout = BUDGET_RECHECK if self._full else None
+            try:
+                items = [self._queue.get(timeout=timeout)]
+            except queue.Empty:
+                items = []
+            # Group commit: take everything that queued up meanwhile
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if not self._handle(items):
+                    return
+            except Exception as e:
+                # Whatever went wrong, the thread must keep writing: nothing
+                # restarts it and every later batch would be dropped
+                self._stats["thread_errors_total"] += 1
+                print(f"Storage thread error: {e!r}")
+                if any(item[0] == "stop" for item in items):
+                    return
+
+    def _handle(self, items) -> bool:
+        started = time.monotonic()
+        written = 0
+        stop = False
+        for kind, segment, arg, queued in items:
+            wait = 1e3 * (started - queued)
+            if wait > self._stats["wait_ms_max"]:
+                self._stats["wait_ms_max"] = wait
+            try:
+                if kind == "write":
+                    opened = segment.opened
+                    segment.append(arg)
+                    if not opened and segment.opened:
+                        self._journal.open(segment)
+                    written += arg.nbytes
+                    self._stats["batches_total"] += 1
+                    self._dirty.add(segment)
+                    self._unsynced.add(segment)
+                elif kind == "seal":
+                    self._seal(segment, arg)
+                else:
+                    stop = True
+            except (OSError, sqlite3.Error) as e:
+                print(f"Storage error on {segment.path if segment else '-'}: {e}")
+            except Exception as e:
+                # A bug in one item must not cost the rest of the group
+                self._stats["thread_errors_total"] += 1
+                print(f"Storage error on {segment.path if segment else '-'}: {e!r}")
+            finally:
+                if kind == "write":
+                    with self._lock:
+                        self._pending_bytes -= arg.nbytes
+        self._stats["bytes_total"] += written
+        self._unflushed_bytes += written
+        self._check_budgets()
+        now = time.monotonic()
+        if stop or self._unflushed_bytes >= self._flush_bytes or now - self._last_flush >= self._flush_interval:
+            sync = stop or (self._fsync_interval and now - self._last_fsync >= self._fsync_interval)
+            self._flush(sync)
+        if items:
+            elapsed = 1e3 * (time.monotonic() - started)
+            self._stats["groups_total"] += 1
+            self._stats["write_ms_sum"] += elapsed
+            if elapsed > self._stats["write_ms_max"]:
+                self._stats["write_ms_max"] = elapsed
+        return not stop
+
+    def _flush(self, sync: bool) -> None:
+        for segment in list(self._unsynced if sync else self._dirty):
+            try:
+                segment.flush(sync)
+                self._journal.commit(segment)
+            except (OSError, ValueError) as e:
+                print(f"Storage error on {segment.path}: {e}")
+        # Commits only ever describe data already handed to the OS
+        self._journal.sync(sync)
+        self._stats["flushes_total"] += 1
+        self._dirty.clear()
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+        if sync:
+            self._stats["fsyncs_total"] += 1
+            self._unsynced.clear()
+            self._last_fsync = self._last_flush
+
+    def _seal(self, segment, directory: str) -> None:
+        self._dirty.discard(segment)
+        self._unsynced.discard(segment)
+        if not segment.opened:
+            # No samples were ever written; there is no file
+            return
+        segment.flush(True)
+        self._journal.commit(segment)
+        self._journal.sync()
+        segment.close()
+        target = os.path.join(os.path.dirname(segment.path), directory)
+        os.makedirs(target, exist_ok=True)
+        self._finish(segment.path, target, segment)
+        self._journal.seal(segment)
+        self._stats["sealed_total"] += 1
+
+    def _finish(self, path: str, target: str, segment=None) -> str:
+        # Move a complete segment into target, compressing it on the way, and
+        # queue it for upload. Until the compressed copy is in place the
+        # original stays where the journal expects it, so a crash never loses
+        # the segment; one that is moved but not queued is found again by the
+        # uploader's reconcile().
+        if not available(self._compression) or self._compression == "none":
+            new_path = os.path.join(target, os.path.basename(path))
+            shutil.move(path, new_path)
+            print(f"File moved to {new_path}")
+        else:
+            compress = (compress_segment if strip_extension(path).endswith(SEGMENT_EXT)
+                        else compress_file)
+            new_path, size_in, size_out = compress(path, self._compression, target)
+            ratio = size_in / size_out if size_out else 0.0
+            self._stats["compress_in_bytes_total"] += size_in
+            self._stats["compress_out_bytes_total"] += size_out
+            self._stats["compression_ratio_last"] = round(ratio, 2)
+            print(f"File moved to {new_path} ({size_in} -> {size_out} bytes, {ratio:.2f}x)")
+        if segment is not None and segment.first is not None:
+            meta = dict(device=segment.device, location=segment.location,
+                        start=segment.first, end=segment.last, samples=segment.samples,
+                        flagged=possible_fall(segment.peak, segment.trough))
+        else:
+            meta = describe(new_path)
+        try:
+            self._uploads(target).put(new_path, **meta)
+        except sqlite3.Error as e:
+            # The file stays in send_out; the uploader's reconcile() queues it
+            self._stats["queue_errors_total"] += 1
+            print(f"Cannot queue {new_path} for upload: {e}")
+        self._check_budgets()
+        return new_path
+
+    def _uploads(self, directory: str) -> UploadQueue:
+        directory = os.path.abspath(directory)
+        if directory not in self._queues:
+            os.makedirs(directory, exist_ok=True)
+            queue = UploadQueue(os.path.join(directory, QUEUE_DB))
+            self._queues[directory] = queue
+            self._budgets[directory] = SpoolBudget(queue, directory)
+            metrics.register("spool", self._budgets[directory].counters)
+        return self._queues[directory]
+
+    def _check_budgets(self) -> None:
+        for directory, budget in self._budgets.items():
+            try:
+                budget.maybe_check()
+            except Exception as e:
+                print(f"Spool budget check failed for {directory}: {e!r}")
+        self._full = any(budget.full for budget in self._budgets.values())
+
+
+# One writer thread per process, shared by all clients in it
+storage = StorageWriter()
@@ -0,0 +1,10 @@
+import os
+
+# FALLYX_TRANSPORT=sim swaps the radio for simulated sensors (simulator.py),
+# so the gateway can be run and load-tested without Bluetooth hardware
+if os.environ.get("FALLYX_TRANSPORT") == "sim":
+    from simulator import BleakClient, BleakError, BleakScanner
+else:
+    from bleak import BleakClient, BleakError, BleakScanner
+
+__all__ = ["BleakClient", "BleakError", "BleakScanner"]
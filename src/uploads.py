@@ -0,0 +1,307 @@
+"""
+Queue of sealed segments waiting to be uploaded.
+
+The storage thread adds every segment it moves to send_out; send_to_api.py
+takes the oldest pending one, uploads it and removes it from the queue, and
+the spool budget (budget.py) picks what to shrink or drop from it. The
+queue is an SQLite database in send_out (WAL mode, so the gateway processes
+can add entries while the uploader reads), and taking the next segment is
+one indexed query however long the backlog has grown.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from compression import DECODE_ERRORS, strip_extension
+from segments import SEGMENT_EXT, open_segment
+from usage import process_alive
+
+QUEUE_DB = "uploads.db"
+# Seconds a writer waits for another process holding the database lock
+BUSY_TIMEOUT = 30.0
+
+# Entry states: waiting to be sent, being sent (or shrunk by the spool
+# budget), or given up on (the file could not be read)
+PENDING = "pending"
+SENDING = "sending"
+FAILED = "failed"
+# After this many failed uploads an entry is retried only every RETRY_DELAY
+# seconds, so one the API keeps refusing does not hold up the ones behind it
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 600.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    device TEXT,
+    location TEXT,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    samples INTEGER,
+    size INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'pending',
+    enqueued REAL NOT NULL,
+    error TEXT
+);
+"""
+# Columns added after the first version, created on databases that lack them
+MIGRATIONS = {
+    "flagged": "INTEGER NOT NULL DEFAULT 0",
+    "decimation": "INTEGER NOT NULL DEFAULT 1",
+    # PID of the process that took the entry out of pending
+    "owner": "INTEGER",
+    # Wall time before which a pending entry is not claimed
+    "retry_at": "REAL NOT NULL DEFAULT 0",
+}
+INDEXES = """
+CREATE INDEX IF NOT EXISTS uploads_next ON uploads (state, start_time, id);
+CREATE INDEX IF NOT EXISTS uploads_flagged ON uploads (state, flagged, start_time, id);
+"""
+COLUMNS = ("id", "path", "device", "location", "start_time", "end_time", "samples", "size",
+           "attempts", "state", "enqueued", "error", "flagged", "decimation", "owner",
+           "retry_at")
+
+# A segment is flagged as a possible fall if its acceleration magnitude
+# (m/s^2, as the sensor reports it) peaks like an impact or drops like free
+# fall; flagged segments are kept longest when the spool runs out of room
+FALL_IMPACT = 2.5 * 9.81
+FALL_FREE = 0.3 * 9.81
+
+# imu_data_20240101_120000_AA:BB:CC:DD:EE:FF[_1].csv
+FILE_NAME = re.compile(r"imu_data_\d{8}_\d{6}_([0-9A-Fa-f:]{17})")
+
+
+def possible_fall(peak: Optional[float], trough: Optional[float]) -> bool:
+    """
+    :param peak: Largest acceleration magnitude in a segment.
+    :param trough: Smallest acceleration magnitude in it.
+    """
+    return ((peak is not None and peak >= FALL_IMPACT) or
+            (trough is not None and trough <= FALL_FREE))
+
+
+def magnitudes(records: np.ndarray) -> np.ndarray:
+    """
+    :param records: Structured array with dtype SAMPLE_DTYPE.
+    :return: Acceleration magnitude of every record.
+    """
+    return np.sqrt(records['ax'] ** 2 + records['ay'] ** 2 + records['az'] ** 2)
+
+
+def describe(path: str) -> Dict[str, object]:
+    """
+    Read what the queue records about a segment from the file itself, for
+    segments that were not enqueued by the writer (recovered or found in
+    send_out). CSVs only give their device, by name, and modification time.
+    """
+    mtime = os.path.getmtime(path)
+    match = FILE_NAME.match(os.path.basename(path))
+    meta = {"device": match.group(1) if match else None, "location": None,
+            "start": mtime, "end": mtime, "samples": None, "flagged": False}
+    if strip_extension(path).endswith(SEGMENT_EXT):
+        try:
+            segment = open_segment(path)
+        except (ValueError,) + DECODE_ERRORS:
+            # Queued as it is; the uploader quarantines it
+            segment = None
+        if segment is not None and len(segment):
+            walls = segment.wall_times()
+            accel = magnitudes(segment.records)
+            meta.update(device=segment.device, location=segment.location,
+                        start=float(walls[0]), end=float(walls[-1]), samples=len(segment),
+                        flagged=possible_fall(float(accel.max()), float(accel.min())))
+    return meta
+
+
+class UploadQueue:
+    """
+    :param path: Database file, created if missing.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit; claim() opens its own transaction
+        self._db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # With WAL a crash can only lose the last few entries, and
+        # reconcile() finds their files again
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        existing = {row[1] for row in self._db.execute("PRAGMA table_info(uploads)")}
+        for column, definition in MIGRATIONS.items():
+            if column not in existing:
+                self._db.execute(f"ALTER TABLE uploads ADD COLUMN {column} {definition}")
+        self._db.executescript(INDEXES)
+
+    def put(self, path: str, device: str = None, location: str = None, start: float = None,
+            end: float = None, samples: int = None, flagged: bool = False) -> None:
+        """
+        Add a sealed segment. Adding a path already queued does nothing.
+
+        :param path: Segment in send_out.
+        :param start: Wall time of its first sample (default: its mtime).
+        :param end: Wall time of its last sample.
+        :param flagged: Whether it may hold a fall (possible_fall()).
+        """
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        if start is None:
+            start = end = os.path.getmtime(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO uploads (path, device, location, start_time, end_time,"
+                " samples, size, enqueued, flagged) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, device, location, start, end, samples, size, time.time(), int(flagged)))
+
+    def claim(self) -> Optional[Dict[str, object]]:
+        """
+        Take the oldest pending segment and mark it as being sent. Entries
+        waiting out RETRY_DELAY are skipped.
+
+        :return: Its entry, or None if nothing is pending.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM uploads WHERE state = ? AND retry_at <= ?"
+                    " ORDER BY start_time, id LIMIT 1", (PENDING, time.time())).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE uploads SET state = ?, attempts = attempts + 1, owner = ?"
+                        " WHERE id = ?", (SENDING, os.getpid(), row[0]))
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        entry = dict(zip(COLUMNS, row))
+        entry["state"] = SENDING
+        entry["attempts"] += 1
+        entry["owner"] = os.getpid()
+        return entry
+
+    def oldest(self, limit: int, flagged: bool,
+               below_decimation: int = None) -> List[Dict[str, object]]:
+        """
+        :param below_decimation: Only entries decimated less than this.
+        :return: Up to limit pending entries, flagged or not, oldest first.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM uploads WHERE state = ? AND flagged = ?"
+                " AND decimation < ? ORDER BY start_time, id LIMIT ?",
+                (PENDING, int(flagged), below_decimation or 1 << 30, limit)).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def take(self, entry_id: int) -> bool:
+        """
+        Mark a pending entry as in use, so the uploader leaves it alone.
+
+        :return: False if it is no longer pending.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE uploads SET state = ?, owner = ? WHERE id = ? AND state = ?",
+                (SENDING, os.getpid(), entry_id, PENDING))
+        return cursor.rowcount == 1
+
+    def replace(self, entry_id: int, path: str, decimation: int = None,
+                samples: int = None) -> None:
+        """
+        Point a taken entry at its rewritten file and make it pending again.
+
+        :param decimation: New decimation factor, if it changed.
+        :param samples: Samples now in the file, if that changed.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            self._db.execute(
+                "UPDATE uploads SET path = ?, size = ?, decimation = COALESCE(?, decimation),"
+                " samples = COALESCE(?, samples), state = ? WHERE id = ?",
+                (path, os.path.getsize(path), decimation, samples, PENDING, entry_id))
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM uploads").fetchone()[0]
+
+    def done(self, entry_id: int) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM uploads WHERE id = ?", (entry_id,))
+
+    def retry(self, entry_id: int, error: str = None) -> None:
+        # Back in line; still the oldest, so it is the next one tried unless
+        # it has failed MAX_ATTEMPTS times, then not for RETRY_DELAY seconds
+        with self._lock:
+            self._db.execute(
+                "UPDATE uploads SET state = ?, error = ?,"
+                " retry_at = CASE WHEN attempts >= ? THEN ? ELSE 0 END WHERE id = ?",
+                (PENDING, error, MAX_ATTEMPTS, time.time() + RETRY_DELAY, entry_id))
+
+    def fail(self, entry_id: int, error: str) -> None:
+        self._set_state(entry_id, FAILED, error)
+
+    def _set_state(self, entry_id: int, state: str, error: Optional[str]) -> None:
+        with self._lock:
+            self._db.execute("UPDATE uploads SET state = ?, error = ? WHERE id = ?",
+                             (state, error, entry_id))
+
+    def reconcile(self, list_files: Callable[[], List[str]]) -> int:
+        """
+        Bring the queue in line with the files in send_out, for use when the
+        uploader starts: entries left being sent by a process that is gone
+        go back to pending (the spool budget of a running gateway may hold
+        others), files that are not queued (sealed by an older version, or
+        the crash came before they were queued) are added, and entries whose
+        file is gone are dropped.
+
+        :param list_files: Returns the segment files currently in send_out.
+        :return: Number of files added.
+        """
+        scanned = time.time()
+        paths = {os.path.abspath(path) for path in list_files()}
+        with self._lock:
+            held = self._db.execute("SELECT id, owner FROM uploads WHERE state = ?",
+                                    (SENDING,)).fetchall()
+            self._db.executemany("UPDATE uploads SET state = ? WHERE id = ? AND state = ?",
+                                 [(PENDING, entry_id, SENDING) for entry_id, owner in held
+                                  if owner is None or not process_alive(owner)])
+            known = {path for path, in self._db.execute("SELECT path FROM uploads")}
+            # Only entries older than the listing can be missing from it
+            self._db.executemany("DELETE FROM uploads WHERE path = ? AND enqueued < ?",
+                                 [(path, scanned) for path in known - paths])
+        added = 0
+        for path in sorted(paths - known):
+            try:
+                self.put(path, **describe(path))
+                added += 1
+            except OSError:
+                pass  # removed meanwhile
+        return added
+
+    def counts(self) -> Dict[str, float]:
+        """
+        :return: Number of entries per state and bytes pending.
+        """
+        stats = {f"uploads_{state}": 0 for state in (PENDING, SENDING, FAILED)}
+        with self._lock:
+            for state, count, size in self._db.execute(
+                    "SELECT state, COUNT(*), SUM(size) FROM uploads GROUP BY state"):
+                stats[f"uploads_{state}"] = count
+                if state == PENDING:
+                    stats["uploads_pending_bytes"] = size
+        stats.setdefault("uploads_pending_bytes", 0)
+        return stats
+
+    def close(self) -> None:
+        self._db.close()
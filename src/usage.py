@@ -0,0 +1,71 @@
+import os
+import time
+from typing import Dict, Iterable
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def process_alive(pid: int) -> bool:
+    """
+    :param pid: Process id.
+    :return: Whether the process exists, owned by anyone.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def process_usage(pid="self") -> Dict[str, float]:
+    """
+    Read resident memory and accumulated CPU time of a process from /proc.
+
+    :param pid: Process id, or "self" for the calling process.
+    :return: Dict with rss_mb and cpu_s, empty if the process is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = 0
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss_kb = int(line.split()[1])
+                    break
+    except (FileNotFoundError, ProcessLookupError):
+        return {}
+    utime, stime = int(fields[11]), int(fields[12])
+    return {"rss_mb": rss_kb / 1024.0, "cpu_s": (utime + stime) / CLK_TCK}
+
+
+class UsageMeter:
+    """
+    Track memory and CPU share of a set of processes between reports.
+
+    :param pids: Process ids to sum over ("self" for the caller).
+    """
+
+    def __init__(self, pids: Iterable = ("self",)) -> None:
+        self.pids = list(pids)
+        self._last_cpu = self._cpu()
+        self._last_time = time.monotonic()
+
+    def _cpu(self) -> float:
+        return sum(process_usage(pid).get("cpu_s", 0.0) for pid in self.pids)
+
+    def sample(self) -> Dict[str, float]:
+        """
+        :return: Total rss_mb and cpu_pct of the tracked processes since the
+                 previous call.
+        """
+        now = time.monotonic()
+        cpu = self._cpu()
+        elapsed = max(now - self._last_time, 1e-6)
+        cpu_pct = 100.0 * (cpu - self._last_cpu) / elapsed
+        self._last_cpu, self._last_time = cpu, now
+        rss = sum(process_usage(pid).get("rss_mb", 0.0) for pid in self.pids)
+        return {"processes": len(self.pids), "rss_mb": round(rss, 1), "cpu_pct": round(cpu_pct, 1)}
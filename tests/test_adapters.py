@@ -0,0 +1,50 @@
+import adapters
+from adapters import REBALANCE_COOLDOWN, AdapterScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(adapters.time, "monotonic", clock)
+    scheduler = AdapterScheduler(["hci0", "hci1", "hci2"], capacity=2)
+    return scheduler, clock
+
+
+def test_rebalance_needs_an_adapter_that_heard_the_sensor_clearly_better(monkeypatch):
+    scheduler, clock = make(monkeypatch)
+    assert scheduler.place("A", {"hci0": -70, "hci1": -72}, -90) == "hci0"
+    clock.now += REBALANCE_COOLDOWN + 1
+
+    # hci1 is louder by less than the margin, hci2 never heard the sensor
+    heard = {"hci0": -70, "hci1": -67}
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == []
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == []
+    assert scheduler.adapter_for("A") == "hci0"
+
+    heard = {"hci0": -80, "hci1": -60}
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == [("A", "hci0", "hci1")]
+
+def test_rebalance_waits_for_repeated_loss_and_the_cooldown(monkeypatch):
+    scheduler, clock = make(monkeypatch)
+    heard = {"hci0": -85, "hci1": -60, "hci2": -62}
+    scheduler.place("A", {"hci0": -60}, -90)
+
+    # Within the cooldown of the placement nothing moves
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == []
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == []
+    clock.now += REBALANCE_COOLDOWN + 1
+    # One bad window after a good one is not enough
+    assert scheduler.rebalance({"A": 0.0}, lambda a: heard, -90) == []
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == []
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == [("A", "hci0", "hci1")]
+    # And it does not bounce straight back
+    heard = {"hci0": -50, "hci1": -85}
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == []
+    assert scheduler.rebalance({"A": 0.3}, lambda a: heard, -90) == []
@@ -0,0 +1,44 @@
+import pytest
+
+from assembler import FIELD_ORDER, Sample, SampleAssembler
+
+
+def push_frame(assembler, t, fields=FIELD_ORDER):
+    out = None
+    for field in fields:
+        out = assembler.push(field, t if field == "time" else float(t) / 10)
+    return out
+
+
+def test_complete_frame_is_emitted_once():
+    assembler = SampleAssembler()
+
+    assert push_frame(assembler, 10) == Sample(10, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0)
+    assert push_frame(assembler, 20).time == 20
+    assert assembler.stats() == {"complete": 2, "partial": 0, "duplicates": 0}
+
+
+def test_partial_frame_is_dropped_and_counted():
+    assembler = SampleAssembler()
+    assert push_frame(assembler, 10, FIELD_ORDER[:4]) is None
+
+    # ax again starts a new frame
+    assert push_frame(assembler, 20).time == 20
+    assert push_frame(assembler, 30, FIELD_ORDER[:2]) is None
+    assembler.flush()
+
+    assert assembler.stats() == {"complete": 1, "partial": 2, "duplicates": 0}
+
+
+def test_repeated_counter_is_a_duplicate():
+    assembler = SampleAssembler()
+    push_frame(assembler, 10)
+
+    assert push_frame(assembler, 10) is None
+    assert push_frame(assembler, 20).time == 20
+    assert assembler.stats() == {"complete": 2, "partial": 0, "duplicates": 1}
+
+
+def test_order_must_name_every_field():
+    with pytest.raises(ValueError):
+        SampleAssembler(FIELD_ORDER[:-1])
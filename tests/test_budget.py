@@ -0,0 +1,45 @@
+import numpy as np
+
+from budget import SpoolBudget
+from decoders import SAMPLE_DTYPE
+from segments import Segment, SegmentWriter
+from uploads import UploadQueue
+
+
+def test_decimation_updates_the_sample_count(tmp_path):
+    queue = UploadQueue(str(tmp_path / "uploads.db"))
+    for i in range(4):
+        data = np.zeros(1000, dtype=SAMPLE_DTYPE)
+        data['time'] = np.arange(1000) * 10000
+        data['az'] = -9.81
+        writer = SegmentWriter(str(tmp_path / f"{i}.seg"), "loc", "AA:BB:CC:DD:EE:FF")
+        writer.append(data)
+        writer.close()
+        queue.put(writer.path, start=float(i), end=float(i), samples=1000)
+    size = queue.total_bytes()
+    # Above DECIMATE_AT, below the limit; compression is left out
+    budget = SpoolBudget(queue, str(tmp_path), max_bytes=int(size / 0.9), max_percent=0,
+                         codec="gzip")
+    budget._compress = lambda actions: actions
+
+    budget.check()
+
+    entries = queue.oldest(10, False)
+    assert len(entries) == 4
+    decimated = [e for e in entries if e["decimation"] == 2]
+    assert decimated
+    for entry in decimated:
+        assert entry["samples"] == len(Segment(entry["path"])) == 500
+
+
+def test_unreadable_segment_goes_back_to_the_queue(tmp_path):
+    queue = UploadQueue(str(tmp_path / "uploads.db"))
+    path = tmp_path / "a.seg.gz"
+    path.write_bytes(b"\x1f\x8b\x08\x00" + b"\x00" * 6 + b"\x01\x02")
+    queue.put(str(path), start=0.0, end=0.0, samples=1000)
+    budget = SpoolBudget(queue, str(tmp_path), max_bytes=1, max_percent=0, codec="gzip")
+    budget._evict = lambda excess: 0
+
+    budget.check()
+
+    assert queue.counts()["uploads_pending"] == 1
@@ -0,0 +1,24 @@
+from clocksync import ClockModel, TimestampFormatter
+
+
+def feed(clock, counter, arrival, seconds, rate=100):
+    for i in range(int(seconds * rate)):
+        clock.observe(counter + i * 1000000 // rate, arrival + i / rate + 0.002)
+    return counter + int(seconds * 1e6), arrival + seconds
+
+
+def test_sensor_reboot_restarts_the_fit():
+    clock = ClockModel()
+    counter, arrival = feed(clock, 300000000, 1700000000.0, 60)
+    # The sensor reboots: one second later its counter starts from zero
+    counter, arrival = feed(clock, 0, arrival + 1.0, 30)
+
+    assert clock.resets == 1
+    assert abs(clock.wall_time(counter - 10000) - (arrival - 0.01)) < 0.01
+    assert abs(clock.drift_ppm) < 100
+
+
+def test_timestamps_are_rounded():
+    stamp = TimestampFormatter()
+    assert stamp.format(1700000000.51).endswith(".510000")
+    assert stamp.format(1700000000.9999996).endswith(":21.000000")
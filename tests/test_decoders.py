@@ -0,0 +1,27 @@
+import struct
+
+import numpy as np
+
+from decoders import SAMPLE_SIZE, decode_packed
+
+SAMPLE = struct.Struct("<I6f")
+
+
+def test_packed_notification_decodes_every_sample():
+    # Counter values near the top of the uint32 range
+    rows = [(4294927295 + i * 10000, 0.5 * i, -1.0, -9.81, 0.0, 1.5, -2.25)
+            for i in range(5)]
+    data = bytearray(b"".join(SAMPLE.pack(*row) for row in rows))
+    assert SAMPLE.size == SAMPLE_SIZE
+
+    samples = decode_packed(data + b"\x01\x02\x03")
+
+    assert len(samples) == 5
+    assert samples['time'].tolist() == [row[0] for row in rows]
+    assert np.allclose(samples['ax'], [row[1] for row in rows])
+    assert samples['az'][0] == np.float32(-9.81)
+    assert samples['gz'].tolist() == [-2.25] * 5
+
+
+def test_short_notification_decodes_to_nothing():
+    assert len(decode_packed(b"\x00" * (SAMPLE_SIZE - 1))) == 0
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from decoders import SAMPLE_DTYPE
+from journal import Journal
+from segments import SegmentWriter, open_segment
+from storage import StorageWriter
+from uploads import QUEUE_DB, UploadQueue
+
+
+def records(count: int, start: int = 0) -> np.ndarray:
+    data = np.zeros(count, dtype=SAMPLE_DTYPE)
+    data['time'] = start + np.arange(count) * 10000
+    data['az'] = -9.81
+    return data
+
+
+def test_crashed_segment_is_cut_to_its_last_commit_and_queued(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal_dir = str(tmp_path / "journal")
+    journal = Journal(journal_dir)
+    segment = SegmentWriter(str(tmp_path / "a.seg"), "loc", "AA:BB:CC:DD:EE:FF")
+    journal.open(segment)
+    for i in range(3):
+        segment.append(records(100, i * 1000000))
+        segment.flush()
+        journal.commit(segment)
+        journal.sync()
+    # Written but never committed, then a torn journal record
+    segment.append(records(50, 3000000))
+    segment.flush()
+    with open(journal.path, "ab") as file:
+        file.write(b"\x15\x00\x01\x02")
+    # The process dies: its lock goes, nothing is sealed
+    journal._file.close()
+    running = Journal(journal_dir)
+
+    recovered = StorageWriter(journal_dir=journal_dir, compression="none").recover()
+
+    path = str(tmp_path / "send_out" / "a.seg")
+    assert recovered == [path]
+    assert len(open_segment(path)) == 300
+    assert not os.path.exists(journal.path)
+    assert os.listdir(journal_dir) == [os.path.basename(running.path)]
+    entries = UploadQueue(str(tmp_path / "send_out" / QUEUE_DB)).oldest(10, False)
+    assert [e["path"] for e in entries] == [path]
+    assert entries[0]["samples"] == 300
@@ -0,0 +1,24 @@
+from losstracker import COUNTER_WRAP, LossTracker
+
+
+def feed(tracker, start, count, period=10000):
+    return [tracker.observe((start + i * period) % COUNTER_WRAP) for i in range(count)]
+
+
+def test_counter_wrap_keeps_time_monotonic():
+    tracker = LossTracker()
+    times = feed(tracker, COUNTER_WRAP - 500 * 10000, 1000)
+
+    assert tracker.wraps == 1 and tracker.resets == 0
+    assert tracker.lost == 0
+    assert all(b - a == 10000 for a, b in zip(times, times[1:]))
+
+
+def test_reboot_far_below_the_wrap_is_a_reset():
+    tracker = LossTracker()
+    feed(tracker, 2500000000, 100)
+    feed(tracker, 0, 100)
+
+    assert tracker.resets == 1 and tracker.wraps == 0
+    assert tracker.lost == 0
+    assert tracker.expected == 200
@@ -0,0 +1,22 @@
+from metrics import RateEstimator
+
+
+def test_rate_falls_when_samples_stop_arriving():
+    rate = RateEstimator(window=10)
+    for i in range(200):
+        rate.observe(10, now=100 + i / 20.0)
+    assert rate.rate_at(109.5) == 200.0
+
+    assert 0 < rate.rate_at(112.5) < 200.0
+    assert rate.rate_at(125.0) == 0.0
+
+
+def test_rate_restarts_after_reset():
+    rate = RateEstimator(window=10)
+    for i in range(50):
+        rate.observe(100, now=100 + i / 10.0)
+    rate.reset()
+    for i in range(30):
+        rate.observe(5, now=105 + i / 10.0)
+
+    assert rate.rate_at(108.5) == 50.0
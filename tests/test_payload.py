@@ -0,0 +1,65 @@
+import json
+import tracemalloc
+
+import numpy as np
+
+from clocksync import TimestampFormatter
+from decoders import SAMPLE_DTYPE
+from payload import AXES, json_body
+from segments import Segment, SegmentWriter, compress_segment, export_csv
+
+
+def write_segment(path, count):
+    data = np.zeros(count, dtype=SAMPLE_DTYPE)
+    data['time'] = np.arange(count) * 10000
+    for i, (_, field, _) in enumerate(AXES):
+        data[field] = np.sin(np.arange(count) / (10.0 + i))
+    writer = SegmentWriter(str(path), "Room 1", "AA:BB:CC:DD:EE:FF")
+    writer.anchor(0, 1700000000.0, 1.0)
+    writer.append(data)
+    writer.close()
+    return str(path)
+
+
+def expected(path):
+    # The body built the simple way, from the whole segment in memory
+    segment = Segment(path)
+    stamp = TimestampFormatter()
+    body = {"Location": segment.location,
+            "Timestamp": [stamp.format(wall) for wall in segment.wall_times().tolist()]}
+    for key, field, _ in AXES:
+        body[key] = segment.records[field].tolist()
+    return json.dumps(body, separators=(",", ":")).encode()
+
+
+def test_body_matches_the_whole_segment_encoding(tmp_path):
+    plain = write_segment(tmp_path / "a.seg", 10000)
+    reference = expected(plain)
+    csv_path = export_csv(plain, str(tmp_path / "a.csv"))
+    compressed = compress_segment(plain, "gzip")[0]
+
+    assert b"".join(json_body(compressed)) == reference
+    csv_body = json.loads(b"".join(json_body(csv_path)))
+    assert csv_body["Timestamp"] == json.loads(reference)["Timestamp"]
+    assert np.allclose(csv_body["Az"], json.loads(reference)["Az"])
+
+
+def peak_bytes(path):
+    tracemalloc.start()
+    try:
+        for _ in json_body(path):
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_peak_memory_does_not_grow_with_the_segment(tmp_path):
+    for name in ("plain", "compressed"):
+        small = write_segment(tmp_path / f"{name}_small.seg", 8192)
+        large = write_segment(tmp_path / f"{name}_large.seg", 81920)
+        if name == "compressed":
+            small = compress_segment(small, "gzip")[0]
+            large = compress_segment(large, "gzip")[0]
+
+        assert peak_bytes(large) < 1.5 * peak_bytes(small)
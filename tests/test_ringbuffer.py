@@ -0,0 +1,33 @@
+import numpy as np
+
+from decoders import SAMPLE_DTYPE
+from ringbuffer import SampleRing
+
+
+def batch(start, count):
+    data = np.zeros(count, dtype=SAMPLE_DTYPE)
+    data['ax'] = np.arange(start, start + count)
+    return np.arange(start, start + count) * 10000, data
+
+
+def test_append_wraps_around_and_keeps_the_newest():
+    ring = SampleRing(4)
+    for i in range(10):
+        ring.append(i * 10000, float(i), 0, 0, 0, 0, 0)
+
+    window = ring.last(10)
+    assert len(ring) == 4
+    assert window["time"].tolist() == [60000, 70000, 80000, 90000]
+    assert window["ax"].tolist() == [6.0, 7.0, 8.0, 9.0]
+    assert not window["ax"].flags.writeable
+
+
+def test_extend_across_the_end_matches_append():
+    ring = SampleRing(8)
+    for start, count in ((0, 5), (5, 6), (11, 20)):
+        ring.extend(*batch(start, count))
+
+    window = ring.last(8)
+    assert window["ax"].tolist() == list(range(23, 31))
+    assert np.shares_memory(window["time"], ring.last(3)["time"])
+    assert ring.since(0.02)["ax"].tolist() == [28.0, 29.0, 30.0]
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from decoders import SAMPLE_DTYPE
+from segments import Segment, SegmentStream, SegmentWriter, compress_segment
+
+
+def test_compressed_segment_reads_back_unshuffled(tmp_path):
+    # More than one SHUFFLE_BLOCK, the last one partial
+    data = np.zeros(10000, dtype=SAMPLE_DTYPE)
+    data['time'] = np.arange(10000) * 10000
+    data['ax'] = np.sin(np.arange(10000) / 10.0)
+    data['az'] = -9.81
+    writer = SegmentWriter(str(tmp_path / "a.seg"), "loc", "AA:BB:CC:DD:EE:FF")
+    writer.append(data)
+    writer.close()
+
+    path, size_in, size_out = compress_segment(writer.path, "gzip")
+
+    assert path.endswith(".seg.gz") and not os.path.exists(writer.path)
+    assert size_out < size_in
+    segment = Segment(path)
+    assert segment.shuffled and segment.location == "loc"
+    assert np.array_equal(segment.records, data)
+    assert np.array_equal(np.concatenate(list(SegmentStream(path).chunks(300))), data)
+
+
+def test_long_location_is_cut_on_a_character_boundary(tmp_path):
+    location = "x" * 59 + "é"
+    writer = SegmentWriter(str(tmp_path / "a.seg"), location, "AA:BB:CC:DD:EE:FF")
+    writer.append(np.zeros(1, dtype=SAMPLE_DTYPE))
+    writer.close()
+
+    assert Segment(writer.path).location == "x" * 59
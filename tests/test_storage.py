@@ -0,0 +1,57 @@
+import os
+import sqlite3
+
+import numpy as np
+
+from decoders import SAMPLE_DTYPE
+from segments import SegmentWriter, open_segment
+from storage import StorageWriter
+from uploads import UploadQueue
+
+
+def records(count: int, start: int = 0) -> np.ndarray:
+    data = np.zeros(count, dtype=SAMPLE_DTYPE)
+    data['time'] = start + np.arange(count) * 10000
+    data['az'] = -9.81
+    return data
+
+
+def test_failing_queue_insert_keeps_writer_alive(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def put(self, path, **meta):
+        raise sqlite3.OperationalError("database or disk is full")
+
+    monkeypatch.setattr(UploadQueue, "put", put)
+    storage = StorageWriter(flush_interval=0.01, journal_dir=str(tmp_path / "journal"),
+                            compression="none")
+    first = SegmentWriter(str(tmp_path / "first.seg"), "loc", "AA:BB:CC:DD:EE:FF")
+    storage.write(first, records(10))
+    storage.seal(first)
+    second = SegmentWriter(str(tmp_path / "second.seg"), "loc", "AA:BB:CC:DD:EE:FF")
+    storage.write(second, records(20, 100000))
+    storage.close()
+
+    # The sealed file stays in send_out for reconcile() to queue
+    assert os.path.isfile(tmp_path / "send_out" / "first.seg")
+    assert storage.counters()["queue_errors_total"] == 1
+    assert len(open_segment(str(tmp_path / "second.seg"))) == 20
+
+
+def test_unexpected_error_keeps_writer_alive(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    storage = StorageWriter(flush_interval=0.01, journal_dir=str(tmp_path / "journal"),
+                            compression="none")
+    first = SegmentWriter(str(tmp_path / "first.seg"), "loc", "AA:BB:CC:DD:EE:FF")
+
+    def append(records):
+        raise RuntimeError("boom")
+
+    first.append = append
+    storage.write(first, records(10))
+    second = SegmentWriter(str(tmp_path / "second.seg"), "loc", "AA:BB:CC:DD:EE:FF")
+    storage.write(second, records(20, 100000))
+    storage.close()
+
+    assert storage.counters()["thread_errors_total"] == 1
+    assert len(open_segment(str(tmp_path / "second.seg"))) == 20
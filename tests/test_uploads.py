@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+from uploads import MAX_ATTEMPTS, PENDING, SENDING, UploadQueue
+
+
+def queue_with(tmp_path, names):
+    queue = UploadQueue(str(tmp_path / "uploads.db"))
+    for i, name in enumerate(names):
+        path = tmp_path / name
+        path.write_bytes(b"x")
+        queue.put(str(path), start=float(i), end=float(i))
+    return queue
+
+
+def states(queue):
+    return dict(queue._db.execute("SELECT path, state FROM uploads"))
+
+
+def test_reconcile_only_releases_entries_of_dead_processes(tmp_path):
+    queue = queue_with(tmp_path, ["a.seg", "b.seg"])
+    dead = subprocess.Popen([sys.executable, "-c", ""])
+    dead.wait()
+    first = queue.claim()
+    queue._db.execute("UPDATE uploads SET owner = ? WHERE id = ?", (dead.pid, first["id"]))
+    second = queue.claim()
+    assert second["owner"] == os.getpid()
+
+    queue.reconcile(lambda: [str(tmp_path / "a.seg"), str(tmp_path / "b.seg")])
+
+    assert states(queue) == {first["path"]: PENDING, second["path"]: SENDING}
+
+
+def test_entry_failing_repeatedly_stops_blocking_the_queue(tmp_path):
+    queue = queue_with(tmp_path, ["a.seg", "b.seg"])
+    for _ in range(MAX_ATTEMPTS):
+        entry = queue.claim()
+        assert entry["path"].endswith("a.seg")
+        queue.retry(entry["id"], "upload failed")
+
+    assert queue.claim()["path"].endswith("b.seg")
+    assert queue.claim() is None